@@ -0,0 +1,55 @@
+from typing import List
+
+# ~4 characters per token for English text; used when the model exposes no tokenizer
+CHARS_PER_TOKEN = 4
+
+def token_lengths(model, texts: List[str]) -> List[int]:
+    """
+    Token count of each text as the model will see it (special tokens included,
+    truncated to the model's max_seq_length). Falls back to a character estimate
+    for backends without a local tokenizer (e.g. Ollama).
+    """
+    max_len = getattr(model, "max_seq_length", None)
+    tokenizer = getattr(model, "tokenizer", None)
+    try:
+        if hasattr(tokenizer, "encode_batch"):
+            # tokenizers.Tokenizer (ONNX backend) pads, so count the attention mask
+            return [sum(e.attention_mask) for e in tokenizer.encode_batch(texts)]
+        if callable(tokenizer):
+            # transformers tokenizer (SentenceTransformer)
+            ids = tokenizer(texts, add_special_tokens=True, truncation=max_len is not None, max_length=max_len)["input_ids"]
+            return [len(i) for i in ids]
+    except Exception as e:
+        print(f"[ERROR] Tokenizer failed, estimating lengths: {e}")
+    lengths = [len(t) // CHARS_PER_TOKEN + 2 for t in texts]
+    return [min(n, max_len) for n in lengths] if max_len else lengths
+
+def token_budget_batches(lengths: List[int], token_budget: int) -> List[List[int]]:
+    """
+    Groups text positions into batches whose padded size (count x longest) stays
+    within token_budget. Texts are taken longest first, so each batch holds texts
+    of similar length: many short ones per batch, few long ones. A text longer than
+    the budget gets a batch of its own.
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+    batches = []
+    batch = []
+    longest = 0
+    for i in order:
+        if batch and (len(batch) + 1) * longest > token_budget:
+            batches.append(batch)
+            batch = []
+        if not batch:
+            longest = max(lengths[i], 1)
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+def padded_tokens(lengths: List[int], batches: List[List[int]]) -> int:
+    """Tokens actually computed when every batch is padded to its longest text."""
+    return sum(len(b) * max(lengths[i] for i in b) for b in batches if b)
+
+def fixed_batches(n: int, batch_size: int) -> List[List[int]]:
+    """Plain consecutive batches of batch_size, for comparison."""
+    return [list(range(i, min(i + batch_size, n))) for i in range(0, n, batch_size)]
@@ -0,0 +1,118 @@
+"""
+TokenChunker against RecursiveCharacterTextSplitter on a multi-MB document.
+
+    python benchmarks/bench_chunking.py --mb 8
+    python benchmarks/bench_chunking.py --layout flat   # text without line breaks
+    python benchmarks/bench_chunking.py --mb 8 --model all-MiniLM-L6-v2   # real tokenizer
+    python benchmarks/bench_chunking.py --mb 8 --tokenizer tokenizer.json --max-seq-length 256
+
+Times both splitters at the EmbeddingPipeline defaults (1000/200 characters, i.e.
+250/50 tokens) and reports chunk counts. --layout picks the document shape:
+paragraphs (blank-line separated), lines (single line breaks, like PDF text) or
+flat (no line breaks, like text extracted from HTML or some PDFs). With --model
+(or --tokenizer, a tokenizer.json such as the one in a model's directory) the
+chunker counts tokens with that tokenizer, which is the default path for
+SentenceTransformers and ONNX models; the report then also shows how many chunks
+exceed the max_seq_length and would be truncated. Without either, characters
+stand in for tokens, as for Ollama models.
+
+With a tokenizer, TokenChunker's time includes counting every chunk's tokens,
+which EmbeddingPipeline reuses to batch by length. The "Recursive + token counts"
+row adds that same step to the recursive splitter (batching.token_lengths), so the
+two compare the work done before encoding. Each time is the best of --repeat runs.
+"""
+import os
+import sys
+import time
+import types
+import argparse
+import numpy as np
+from tokenizers import Tokenizer
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from chunker import TokenChunker, chunk_tokens_for
+from batching import token_lengths
+from model_registry import get_model
+
+WORDS = ("retrieval index vector chunk model query answer source notebook page layout token "
+         "embedding search latency memory document paragraph section figure table result").split()
+
+LAYOUTS = ("paragraphs", "lines", "flat")
+
+def synthetic_document(mb: float, layout: str = "paragraphs") -> str:
+    """Sentences grouped into lines and paragraphs of varying length."""
+    rng = np.random.default_rng(0)
+    parts = []
+    size = 0
+    while size < mb * 1024 * 1024:
+        sentences = [" ".join(rng.choice(WORDS, size=rng.integers(5, 25))).capitalize() + "."
+                     for _ in range(rng.integers(1, 8))]
+        paragraph = "\n".join(" ".join(sentences[i:i + 3]) for i in range(0, len(sentences), 3))
+        parts.append(paragraph)
+        size += len(paragraph) + 2
+    text = "\n\n".join(parts)
+    if layout == "lines":
+        return text.replace("\n\n", "\n")
+    if layout == "flat":
+        return text.replace("\n", " ")
+    return text
+
+def timed(fn, text, repeat: int = 1):
+    """Best time of `repeat` runs, and the chunks."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunks = fn(text)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return best, chunks
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mb", type=float, default=8.0)
+    parser.add_argument("--layout", default="paragraphs", choices=LAYOUTS)
+    parser.add_argument("--model", default=None, help="Use this model's tokenizer (default: characters)")
+    parser.add_argument("--tokenizer", default=None, help="Use this tokenizer.json instead of loading a model")
+    parser.add_argument("--max-seq-length", type=int, default=256, help="Sequence limit with --tokenizer")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    text = synthetic_document(args.mb, args.layout)
+    model = get_model(args.model) if args.model else None
+    if args.tokenizer:
+        model = types.SimpleNamespace(tokenizer=Tokenizer.from_file(args.tokenizer), max_seq_length=args.max_seq_length)
+    recursive = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                               length_function=len, separators=["\n\n", "\n", " ", ""])
+    chunker = TokenChunker(model, chunk_tokens=chunk_tokens_for(args.chunk_size),
+                           overlap_tokens=chunk_tokens_for(args.chunk_overlap))
+
+    mb = len(text) / 1024 / 1024
+    print(f"{mb:.1f} MB document ({args.layout}), {args.chunk_size}/{args.chunk_overlap} chars = "
+          f"{chunker.chunk_tokens}/{chunker.overlap_tokens} tokens ({'model tokenizer' if chunker.tokenizer else 'characters'})\n")
+    print(f"{'splitter':<32}{'seconds':>10}{'MB/s':>10}{'chunks':>10}")
+    results = {}
+    for name, fn in (("RecursiveCharacterTextSplitter", recursive.split_text), ("TokenChunker", chunker.split_text)):
+        seconds, chunks = timed(fn, text, args.repeat)
+        results[name] = chunks
+        print(f"{name:<32}{seconds:>10.2f}{mb / seconds:>10.2f}{len(chunks):>10}")
+    if chunker.tokenizer is not None:
+        def recursive_counted(text):
+            chunks = recursive.split_text(text)
+            token_lengths(model, chunks)
+            return chunks
+
+        seconds, chunks = timed(recursive_counted, text, args.repeat)
+        print(f"{'Recursive + token counts':<32}{seconds:>10.2f}{mb / seconds:>10.2f}{len(chunks):>10}")
+
+    if chunker.tokenizer is not None and getattr(model, "max_seq_length", None):
+        limit = model.max_seq_length - chunker._special_tokens()
+        for name, chunks in results.items():
+            over = sum(n > limit for n in chunker.count_tokens(chunks))
+            print(f"{name}: {over} of {len(chunks)} chunks exceed {limit} tokens and get truncated")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Latency and recall of coarse-to-fine search against the exact flat L2 search.
+
+    python benchmarks/bench_coarse_search.py --vectors 50000 --dims 32 64 128
+    python benchmarks/bench_coarse_search.py --model all-MiniLM-L6-v2   # real embeddings
+
+Builds a flat FaissVectorStore and queries it with coarse search off (exact) and with
+each coarse dimension / method, reporting ms per query and recall@k against the exact
+results. Without --model the vectors are synthetic, with the decaying variance spectrum
+typical of sentence embeddings; queries are perturbed copies of stored vectors. Run it
+at several --vectors to find the size where the coarse pass starts to win, which is what
+coarse_index.COARSE_MIN_POINTS is set from.
+"""
+import os
+import sys
+import time
+import tempfile
+import argparse
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vectorstore import FaissVectorStore
+from model_registry import get_model, registry
+from coarse_index import COARSE_METHODS
+
+class SyntheticModel:
+    """Stands in for a model when the vectors are synthetic; only the dimension is used."""
+    def __init__(self, dim: int):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    # Most of the variance sits in the leading components, as in real embedding spaces
+    scales = 1.0 / np.sqrt(np.arange(1, dim + 1))
+    vectors = rng.standard_normal((n, dim)).astype("float32") * scales.astype("float32")
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def model_vectors(model_name: str, n: int) -> np.ndarray:
+    words = ("retrieval index vector chunk model query answer source notebook page layout token "
+             "embedding search latency memory document paragraph section figure table result").split()
+    rng = np.random.default_rng(0)
+    texts = [" ".join(rng.choice(words, size=rng.integers(8, 40))) for _ in range(n)]
+    return np.asarray(get_model(model_name).encode(texts, batch_size=128), dtype="float32")
+
+def time_queries(store, queries: np.ndarray, top_k: int):
+    store._search(queries[:4], top_k)  # builds the coarse index outside the timing
+    start = time.perf_counter()
+    results = [store._search(q[None, :], top_k)[1][0] for q in queries]
+    return (time.perf_counter() - start) * 1000 / len(queries), results
+
+def recall(truth, found) -> float:
+    hits = sum(len(set(t[t >= 0]) & set(f[f >= 0])) for t, f in zip(truth, found))
+    return hits / sum(int((t >= 0).sum()) for t in truth)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384, help="Dimension of synthetic vectors")
+    parser.add_argument("--model", default=None, help="Embed a synthetic corpus with this model instead")
+    parser.add_argument("--dims", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--methods", nargs="+", default=list(COARSE_METHODS), choices=COARSE_METHODS)
+    parser.add_argument("--factor", type=int, default=10, help="Shortlist size as a multiple of top_k")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    if args.model:
+        vectors = model_vectors(args.model, args.vectors)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dim)
+        registry.loader = lambda name: SyntheticModel(args.dim)
+    rng = np.random.default_rng(1)
+    picks = rng.choice(len(vectors), size=args.queries, replace=False)
+    queries = vectors[picks] + rng.normal(0, 0.02, (args.queries, vectors.shape[1])).astype("float32")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = FaissVectorStore(os.path.join(tmp, "index"), embedding_model=args.model or "synthetic",
+                                 index_type="flat", mmap=False)
+        chunks = [Document(page_content=f"chunk {i}", metadata={"source": f"doc{i // 500}.txt"})
+                  for i in range(len(vectors))]
+        store.add_embedded(chunks, vectors, store.embedding_model)
+        store.save()
+
+        exact_ms, truth = time_queries(store, queries, args.top_k)
+        print(f"{len(vectors)} vectors x {vectors.shape[1]} dims, {args.queries} queries, "
+              f"recall@{args.top_k}, shortlist {args.factor} x top_k\n")
+        print(f"{'search':<24}{'ms/query':>10}{'speedup':>10}{'recall':>10}")
+        print(f"{'exact flat L2':<24}{exact_ms:>10.3f}{1.0:>10.2f}{1.0:>10.3f}")
+        for method in args.methods:
+            for dim in args.dims:
+                # Forced on, so sizes below COARSE_MIN_POINTS show where it stops paying off
+                store.set_coarse_search(dim, method=method, factor=args.factor, min_points=0)
+                ms, found = time_queries(store, queries, args.top_k)
+                label = f"{method} {dim}-d"
+                print(f"{label:<24}{ms:>10.3f}{exact_ms / ms:>10.2f}{recall(truth, found):>10.3f}")
+
+if __name__ == "__main__":
+    main()
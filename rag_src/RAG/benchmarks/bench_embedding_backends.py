@@ -0,0 +1,85 @@
+"""
+Chunks/second of the PyTorch (SentenceTransformers) and ONNX Runtime int8 backends,
+and how far the quantized vectors drift from the PyTorch ones.
+
+    python benchmarks/bench_embedding_backends.py --model all-MiniLM-L6-v2 --chunks 512
+    python benchmarks/bench_embedding_backends.py --files notes.pdf paper.txt
+
+Drift is the cosine similarity between both backends' vectors for the same chunk
+(1.0 = identical). Needs onnxruntime and tokenizers besides the normal requirements.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from model_registry import load_model
+
+WORDS = ("retrieval index vector chunk model query answer source notebook page layout token "
+         "embedding search latency memory document paragraph section figure table result").split()
+
+def synthetic_chunks(n: int, chars: int = 1000):
+    rng = np.random.default_rng(0)
+    chunks = []
+    for _ in range(n):
+        words = []
+        while sum(len(w) + 1 for w in words) < chars:
+            words.append(WORDS[rng.integers(len(WORDS))])
+        chunks.append(" ".join(words))
+    return chunks
+
+def file_chunks(paths):
+    from langchain_community.document_loaders import PyPDFLoader, TextLoader
+    from embedding import EmbeddingPipeline
+    docs = []
+    for path in paths:
+        loader = PyPDFLoader(path) if path.endswith(".pdf") else TextLoader(path)
+        docs.extend(loader.load())
+    return [c.page_content for c in EmbeddingPipeline().chunk_documents(docs)]
+
+def bench(name, model, texts, batch_size, repeats):
+    model.encode(texts[:batch_size], batch_size=batch_size)  # warm-up
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        vectors = model.encode(texts, batch_size=batch_size)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name:<28} {len(texts) / best:>10.1f} chunks/s   dim={vectors.shape[1]}")
+    return np.asarray(vectors, dtype="float32")
+
+def cosine(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--chunks", type=int, default=512, help="Synthetic chunks when no --files are given")
+    parser.add_argument("--files", nargs="*", help="PDF/TXT files to chunk instead of synthetic text")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = file_chunks(args.files) if args.files else synthetic_chunks(args.chunks)
+    print(f"[INFO] {len(texts)} chunks, model {args.model}")
+
+    torch_start = time.perf_counter()
+    torch_model = load_model(args.model)
+    print(f"[INFO] PyTorch backend loaded in {time.perf_counter() - torch_start:.1f}s")
+    reference = bench("pytorch float32", torch_model, texts, args.batch_size, args.repeats)
+
+    onnx_start = time.perf_counter()
+    onnx_model = load_model(f"onnx/{args.model}")
+    print(f"[INFO] ONNX backend loaded in {time.perf_counter() - onnx_start:.1f}s")
+    quantized = bench("onnxruntime int8", onnx_model, texts, args.batch_size, args.repeats)
+
+    drift = cosine(reference, quantized)
+    print(f"Cosine similarity int8 vs pytorch: mean={drift.mean():.4f} min={drift.min():.4f} "
+          f"p1={np.percentile(drift, 1):.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Padding saved by token-budget batching on a mixed corpus of short and long chunks.
+
+    python benchmarks/bench_length_bucketing.py --short 600 --long 200
+    python benchmarks/bench_length_bucketing.py --encode   # also time real encoding
+
+Chunks the corpus with EmbeddingPipeline's chunker, which records each chunk's token
+count, then compares the padded tokens (batch size x longest text, summed over
+batches) of fixed-size batches in input order, fixed-size batches after sorting by
+length, and the token-budget batches. It also times grouping by the recorded counts
+against tokenizing every chunk again, the pass bucketing cost before counts were
+recorded. With --encode it times the model's own encode() against embed_chunks.
+"""
+import os
+import sys
+import time
+import argparse
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from batching import token_lengths, token_budget_batches, padded_tokens, fixed_batches
+from embedding import EmbeddingPipeline
+from model_registry import get_model
+
+WORDS = ("retrieval index vector chunk model query answer source notebook page layout token "
+         "embedding search latency memory document paragraph section figure table result").split()
+
+def mixed_corpus(n_short: int, n_long: int, long_chars: int = 1000):
+    """Headings/captions/list items mixed with full-size chunks, shuffled like a real PDF."""
+    rng = np.random.default_rng(0)
+    def text(chars):
+        words = []
+        while sum(len(w) + 1 for w in words) < chars:
+            words.append(WORDS[rng.integers(len(WORDS))])
+        return " ".join(words)
+    texts = [text(rng.integers(10, 80)) for _ in range(n_short)] + [text(long_chars) for _ in range(n_long)]
+    rng.shuffle(texts)
+    return texts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--short", type=int, default=600)
+    parser.add_argument("--long", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--token-budget", type=int, default=8192)
+    parser.add_argument("--encode", action="store_true", help="Also time real encoding with the model")
+    args = parser.parse_args()
+
+    model = get_model(args.model)
+    pipeline = EmbeddingPipeline(model_name=args.model, token_budget=args.token_budget)
+    chunks = pipeline.chunk_documents([Document(page_content=t) for t in mixed_corpus(args.short, args.long)])
+    texts = [chunk.page_content for chunk in chunks]
+    lengths = [chunk.metadata["tokens"] for chunk in chunks]
+    real = sum(lengths)
+
+    by_length = sorted(range(len(texts)), key=lambda i: lengths[i])
+    sorted_fixed = [[by_length[i] for i in b] for b in fixed_batches(len(texts), args.batch_size)]
+    layouts = {
+        f"fixed {args.batch_size}, input order": fixed_batches(len(texts), args.batch_size),
+        f"fixed {args.batch_size}, length-sorted": sorted_fixed,
+        f"token budget {args.token_budget}": token_budget_batches(lengths, args.token_budget),
+    }
+    print(f"[INFO] {len(texts)} chunks, {real} real tokens")
+    for name, batches in layouts.items():
+        padded = padded_tokens(lengths, batches)
+        print(f"{name:<32} batches={len(batches):>4}  padded tokens={padded:>8}  "
+              f"padding={padded - real:>8} ({(padded - real) / padded:.1%})")
+
+    start = time.perf_counter()
+    token_budget_batches(lengths, args.token_budget)
+    grouping_time = time.perf_counter() - start
+    start = time.perf_counter()
+    token_lengths(model, texts)
+    tokenize_time = time.perf_counter() - start
+    print(f"grouping by recorded counts: {grouping_time * 1000:.2f} ms  "
+          f"(tokenizing again would add {tokenize_time * 1000:.2f} ms)")
+
+    if args.encode:
+        model.encode(texts[:args.batch_size])  # warm-up
+        start = time.perf_counter()
+        model.encode(texts, batch_size=args.batch_size)
+        fixed_time = time.perf_counter() - start
+        start = time.perf_counter()
+        pipeline.embed_chunks(chunks)
+        bucketed_time = time.perf_counter() - start
+        print(f"model.encode(batch_size={args.batch_size}): {len(texts) / fixed_time:.1f} chunks/s")
+        print(f"token-budget batches:          {len(texts) / bucketed_time:.1f} chunks/s")
+
+if __name__ == "__main__":
+    main()
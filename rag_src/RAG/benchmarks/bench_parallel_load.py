@@ -0,0 +1,73 @@
+"""
+Loading a folder of PDFs in-process against the loading worker pool.
+
+    python benchmarks/bench_parallel_load.py --files 200 --pages 20
+    python benchmarks/bench_parallel_load.py --processes 0 2 4 8
+
+Writes synthetic PDFs (wrapped paragraphs under running headers and page-number
+footers, like test_pdf_layout) to a temporary folder, then times load_each over
+all of them for each worker count, which is the load stage of a sync. 0 loads
+in-process. The first pooled run includes starting the workers, as the first
+sync after launching the app would. Runs below load_pool.MIN_POOL_BYTES load
+in-process whatever the worker count.
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import pymupdf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from load_pool import load_each, shutdown_load_pools
+
+BODY = ("The retrieval index keeps one vector for every chunk of the notebook sources and "
+        "answers each question with the closest chunks it can find in the store.")
+
+def write_pdf(path: str, pages: int):
+    pdf = pymupdf.open()
+    for n in range(pages):
+        page = pdf.new_page(width=595, height=842)
+        page.insert_text((72, 40), "ACME Quarterly Report", fontsize=9)
+        y = 70
+        for p in range(5):
+            words = f"Page {n + 1} paragraph {p}. {BODY} {BODY}".split()
+            lines = [" ".join(words[i:i + 10]) for i in range(0, len(words), 10)]
+            page.insert_textbox(pymupdf.Rect(72, y, 523, y + 140), "\n".join(lines), fontsize=10)
+            y += 145
+        page.insert_text((280, 820), f"Page {n + 1} of {pages}", fontsize=9)
+    pdf.save(path)
+    pdf.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--processes", type=int, nargs="+",
+                        default=sorted({0, 2, max(2, (os.cpu_count() or 1) - 1)}))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as folder:
+        paths = [os.path.join(folder, f"{i}.pdf") for i in range(args.files)]
+        for path in paths:
+            write_pdf(path, args.pages)
+        print(f"{args.files} PDFs x {args.pages} pages, {os.cpu_count()} cores")
+
+        baseline = None
+        for processes in args.processes:
+            start = time.perf_counter()
+            chars = failed = 0
+            for _, docs, error in load_each(((p, p) for p in paths), processes):
+                if error is not None:
+                    failed += 1
+                    continue
+                chars += sum(len(d.page_content) for d in docs)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(f"processes={processes:<3} {elapsed:7.2f}s  {args.files / elapsed:7.1f} files/s  "
+                  f"x{baseline / elapsed:.2f}  ({chars / 1e6:.1f}M chars, {failed} failed)")
+    shutdown_load_pools()
+
+if __name__ == "__main__":
+    main()
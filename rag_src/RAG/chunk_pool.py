@@ -0,0 +1,86 @@
+import numpy as np
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Any
+from chunker import TokenChunker, span_documents
+from embedding_pool import PoolRegistry, default_processes, spawn_executor, POOL_IDLE_SECONDS
+
+# Below this many characters per call, chunking in-process beats the pool's IPC
+MIN_POOL_CHARS = 1_000_000
+# Characters per task, so many small pages travel together and one huge file doesn't stall a worker
+TASK_CHARS = 256_000
+# Chunking is cheap next to embedding; a few workers already take it off the ingest thread
+MAX_CHUNK_PROCESSES = 4
+
+# Set in each worker process by _init_worker
+_worker_chunker = None
+
+def default_chunk_processes() -> int:
+    """Chunking workers used when none are configured, at most MAX_CHUNK_PROCESSES (see default_processes)."""
+    return default_processes(MAX_CHUNK_PROCESSES)
+
+def _init_worker(chunker: TokenChunker):
+    global _worker_chunker
+    _worker_chunker = chunker
+
+def _split_text(text: str) -> np.ndarray:
+    # Only spans go back: the parent slices the text and builds the Documents itself
+    return np.array(_worker_chunker.token_spans(text), dtype=np.int64).reshape(-1, 3)
+
+class ChunkWorkerPool:
+    """
+    Worker processes that each hold a copy of a TokenChunker (just its tokenizer, not
+    the embedding model). split_each() sends the page texts out, gets the chunk
+    spans back in document order and builds the chunk Documents in the parent, so the
+    metadata never leaves the process. The tokenizing runs outside the parent's GIL,
+    which keeps the UI thread responsive during big imports.
+    """
+    def __init__(self, chunker: TokenChunker, processes: int):
+        self.chunker = chunker
+        self.processes = processes
+        self.executor = spawn_executor(processes, _init_worker, (chunker,))
+        print(f"[INFO] Started {processes} chunking workers.")
+
+    def split_each(self, documents: List[Any]) -> List[List[Any]]:
+        texts = [doc.page_content for doc in documents]
+        total = sum(len(t) for t in texts) or 1
+        per_task = max(1, int(len(texts) * TASK_CHARS / total))
+        # map() yields results in submission order, so chunks stay in document order
+        spans = self.executor.map(_split_text, texts, chunksize=per_task)
+        return [span_documents(doc, s.tolist()) for doc, s in zip(documents, spans)]
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+_pools = PoolRegistry("chunking")
+
+def get_chunk_pool(chunker: TokenChunker, processes: int) -> ChunkWorkerPool:
+    """Returns the process-wide pool for this chunker's settings, starting it on first use."""
+    return _pools.get((chunker.signature(), processes), lambda: ChunkWorkerPool(chunker, processes))
+
+def discard_chunk_pool(pool: ChunkWorkerPool):
+    """Drops a pool whose workers died, so the next get_chunk_pool() starts a fresh one."""
+    _pools.discard(pool)
+
+def split_each(chunker: TokenChunker, documents: List[Any], processes: int = None) -> List[List[Any]]:
+    """
+    The chunks of each document, in order. They are split in worker processes when there
+    are several documents totalling at least MIN_POOL_CHARS and more than one worker is
+    allowed. processes=None picks default_chunk_processes(); 0 or 1 always splits in-process,
+    and so does a job whose workers crashed (the next large job gets a fresh pool). The
+    pool stops POOL_IDLE_SECONDS after its last use.
+    """
+    if processes is None:
+        processes = default_chunk_processes()
+    if processes > 1 and len(documents) > 1 and sum(len(d.page_content) for d in documents) >= MIN_POOL_CHARS:
+        with _pools.claimed((chunker.signature(), processes), POOL_IDLE_SECONDS):
+            pool = get_chunk_pool(chunker, processes)
+            try:
+                return pool.split_each(documents)
+            except BrokenProcessPool:
+                print("[ERROR] A chunking worker crashed; splitting in-process instead.")
+                discard_chunk_pool(pool)
+    return [span_documents(doc, chunker.token_spans(doc.page_content)) for doc in documents]
+
+def shutdown_chunk_pools():
+    _pools.shutdown()
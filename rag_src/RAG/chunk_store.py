@@ -0,0 +1,448 @@
+import sqlite3
+import os
+import pathlib
+import numpy as np
+from typing import List, Dict
+from dedup import minhash, band_keys, similarity, THRESHOLD
+
+# Stay below SQLite's limit on bound parameters per statement
+SQL_BATCH = 900
+# Optional chunk position, kept when the chunker/loader provides it (page is 0-based)
+POSITION_KEYS = ("page", "start_index", "end_index")
+
+def chunk_row(chunk) -> dict:
+    """The fields of a chunk Document that the store keeps."""
+    row = {"text": chunk.page_content, "source": chunk.metadata.get("source", "unknown")}
+    row.update((k, chunk.metadata[k]) for k in POSITION_KEYS + ("minhash",) if chunk.metadata.get(k) is not None)
+    return row
+
+def _placeholders(values) -> str:
+    return ",".join("?" * len(values))
+
+class ChunkStore:
+    """
+    On-disk store for chunk text and source info, keyed by vector id.
+    Lets the vector store keep only vectors in memory and read the
+    text of the top-k hits on demand.
+    """
+    def __init__(self, persist_dir, writable: bool = True):
+        """writable=False opens an existing database read-only and never creates or upgrades it."""
+        self.db_path = os.path.join(persist_dir, "chunks.db")
+        self.writable = writable
+        if not writable:
+            return
+        if not os.path.exists(persist_dir):
+            os.makedirs(persist_dir)
+        self._init_db()
+
+    def _connect(self):
+        if not self.writable:
+            return sqlite3.connect(pathlib.Path(os.path.abspath(self.db_path)).as_uri() + "?mode=ro", uri=True)
+        return sqlite3.connect(self.db_path)
+
+    def _init_db(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chunks (
+                id INTEGER PRIMARY KEY,
+                source TEXT,
+                text TEXT
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)")
+
+        # Monotonic id allocator, so ids of deleted chunks are never handed out again
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER
+            )
+        ''')
+
+        # Migration: full-precision vector per chunk (used to rebuild/re-train indexes and measure recall)
+        try:
+            cursor.execute("ALTER TABLE chunks ADD COLUMN vector BLOB")
+        except sqlite3.OperationalError:
+            pass # Column already exists
+
+        # Migration: where in the source document each chunk came from
+        for key in POSITION_KEYS:
+            try:
+                cursor.execute(f"ALTER TABLE chunks ADD COLUMN {key} INTEGER")
+            except sqlite3.OperationalError:
+                pass # Column already exists
+
+        # Migration: MinHash signature per chunk, for near-duplicate detection at ingest
+        try:
+            cursor.execute("ALTER TABLE chunks ADD COLUMN minhash BLOB")
+        except sqlite3.OperationalError:
+            pass # Column already exists
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_minhash ON chunks (minhash)")
+
+        # LSH band keys of each chunk's signature (dedup.band_keys), so a new chunk's
+        # near-duplicates are found by looking up its own bands only
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'minhash_bands'")
+        new_bands = cursor.fetchone() is None
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS minhash_bands (
+                key INTEGER,
+                chunk_id INTEGER,
+                PRIMARY KEY (key, chunk_id)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute("SELECT 1 FROM chunks LIMIT 1")
+        if new_bands and cursor.fetchone() is None:
+            # Nothing to backfill (see _backfill_bands)
+            cursor.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('minhash_bands', 1)")
+
+        # Near-duplicate chunks that were linked to an indexed chunk (of_id) instead of embedded
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS duplicates (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                of_id INTEGER,
+                source TEXT,
+                text TEXT,
+                page INTEGER,
+                start_index INTEGER,
+                end_index INTEGER,
+                minhash BLOB
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_of ON duplicates (of_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_duplicates_source ON duplicates (source)")
+        conn.commit()
+        conn.close()
+
+    def allocate_ids(self, n: int) -> List[int]:
+        """Reserves n new stable vector ids."""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM counters WHERE name = 'next_id'")
+        row = cursor.fetchone()
+        if row:
+            start = row[0]
+        else:
+            cursor.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM chunks")
+            start = cursor.fetchone()[0]
+        cursor.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('next_id', ?)", (start + n,))
+        conn.commit()
+        conn.close()
+        return list(range(start, start + n))
+
+    def next_id(self) -> int:
+        """The id allocate_ids would hand out next."""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM counters WHERE name = 'next_id'")
+        row = cursor.fetchone()
+        if not row:
+            cursor.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM chunks")
+            row = cursor.fetchone()
+        conn.close()
+        return row[0]
+
+    def set_next_id(self, value: int):
+        """Moves the allocator forward, e.g. after chunks were copied in under their old ids."""
+        conn = self._connect()
+        conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('next_id', ?)", (int(value),))
+        conn.commit()
+        conn.close()
+
+    def add_chunks(self, ids: List[int], metadatas: List[dict], vectors: np.ndarray = None):
+        """Stores one row per vector. Re-used ids are overwritten."""
+        if vectors is None:
+            blobs = [None] * len(metadatas)
+        else:
+            blobs = [np.asarray(v, dtype="float32").tobytes() for v in vectors]
+        rows = [(int(i), m.get("source", "unknown"), m.get("text", ""), b, *(m.get(k) for k in POSITION_KEYS),
+                 m.get("minhash") or minhash(m.get("text", ""))) for i, m, b in zip(ids, metadatas, blobs)]
+        conn = self._connect()
+        self._delete_bands(conn, [row[0] for row in rows])
+        conn.executemany("INSERT OR REPLACE INTO chunks (id, source, text, vector, page, start_index, end_index, "
+                         "minhash) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._insert_bands(conn, [(row[0], row[-1]) for row in rows])
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def _insert_bands(conn, signatures):
+        # In key order, so the inserts walk the index instead of jumping around it
+        conn.executemany("INSERT OR IGNORE INTO minhash_bands (key, chunk_id) VALUES (?, ?)",
+                         sorted((key, i) for i, signature in signatures if signature for key in band_keys(signature)))
+
+    @staticmethod
+    def _delete_bands(conn, ids: List[int]):
+        # By primary key, from the stored signatures; spares an index on chunk_id
+        signatures = []
+        for start in range(0, len(ids), SQL_BATCH):
+            batch = ids[start:start + SQL_BATCH]
+            signatures += conn.execute(f"SELECT id, minhash FROM chunks WHERE id IN ({_placeholders(batch)}) "
+                                       f"AND minhash IS NOT NULL", batch).fetchall()
+        conn.executemany("DELETE FROM minhash_bands WHERE key = ? AND chunk_id = ?",
+                         [(key, i) for i, signature in signatures if signature for key in band_keys(signature)])
+
+    def delete_ids(self, ids: List[int]):
+        ids = [int(i) for i in ids]
+        conn = self._connect()
+        for start in range(0, len(ids), SQL_BATCH):
+            batch = ids[start:start + SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            self._delete_bands(conn, batch)
+            conn.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", batch)
+        conn.commit()
+        conn.close()
+
+    def ids_for_sources(self, sources: List[str]) -> List[int]:
+        sources = list(sources)
+        if not sources:
+            return []
+        placeholders = ",".join("?" * len(sources))
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT id FROM chunks WHERE source IN ({placeholders}) ORDER BY id", sources)
+        result = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return result
+
+    def get_ids(self) -> List[int]:
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM chunks ORDER BY id")
+        result = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return result
+
+    def get_sources(self) -> List[str]:
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT DISTINCT source FROM chunks ORDER BY source")
+        result = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return result
+
+    def set_vectors(self, ids: List[int], vectors: np.ndarray):
+        rows = [(np.asarray(v, dtype="float32").tobytes(), int(i)) for i, v in zip(ids, vectors)]
+        conn = self._connect()
+        conn.executemany("UPDATE chunks SET vector = ? WHERE id = ?", rows)
+        conn.commit()
+        conn.close()
+
+    def get_vectors(self, ids: List[int] = None):
+        """
+        Returns (ids, matrix) of stored full-precision vectors, ordered by id.
+        With ids=None every stored vector is returned.
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        if ids is None:
+            cursor.execute("SELECT id, vector FROM chunks WHERE vector IS NOT NULL ORDER BY id")
+            rows = cursor.fetchall()
+        else:
+            ids = [int(i) for i in ids]
+            rows = []
+            for start in range(0, len(ids), SQL_BATCH):
+                batch = ids[start:start + SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                cursor.execute(f"SELECT id, vector FROM chunks WHERE vector IS NOT NULL AND id IN ({placeholders})", batch)
+                rows.extend(cursor.fetchall())
+            rows.sort(key=lambda r: r[0])
+        conn.close()
+        if not rows:
+            return np.empty(0, dtype="int64"), None
+        found = np.array([r[0] for r in rows], dtype="int64")
+        matrix = np.vstack([np.frombuffer(r[1], dtype="float32") for r in rows])
+        return found, matrix
+
+    def vector_bytes(self) -> int:
+        """Bytes of full-precision vectors stored in the database."""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM chunks")
+        result = cursor.fetchone()[0]
+        conn.close()
+        return result
+
+    def missing_vector_ids(self) -> List[int]:
+        """Ids of rows written before vectors were stored alongside the text."""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM chunks WHERE vector IS NULL ORDER BY id")
+        result = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return result
+
+    def get_chunks(self, ids: List[int]) -> Dict[int, dict]:
+        """Returns {id: {"text", "source"}} for the requested ids only, plus any stored POSITION_KEYS."""
+        ids = [int(i) for i in ids]
+        if not ids:
+            return {}
+        conn = self._connect()
+        cursor = conn.cursor()
+        chunks = {}
+        for start in range(0, len(ids), SQL_BATCH):
+            batch = ids[start:start + SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f"SELECT id, source, text, page, start_index, end_index FROM chunks "
+                           f"WHERE id IN ({placeholders})", batch)
+            for row in cursor.fetchall():
+                chunk = {"text": row[2], "source": row[1]}
+                chunk.update((k, v) for k, v in zip(POSITION_KEYS, row[3:]) if v is not None)
+                chunks[row[0]] = chunk
+        conn.close()
+        return chunks
+
+    def _backfill_bands(self):
+        """
+        Once per store from before the band table: computes missing signatures (rows from
+        before dedup) and the band keys of every stored chunk.
+        """
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT value FROM counters WHERE name = 'minhash_bands'")
+        if cursor.fetchone():
+            conn.close()
+            return
+        print("[INFO] Indexing near-duplicate signatures of the stored chunks...")
+        cursor.execute("SELECT id, text FROM chunks WHERE minhash IS NULL")
+        missing = cursor.fetchall()
+        conn.executemany("UPDATE chunks SET minhash = ? WHERE id = ?", [(minhash(t or ""), i) for i, t in missing])
+        cursor.execute("SELECT id, minhash FROM chunks")
+        while True:
+            rows = cursor.fetchmany(SQL_BATCH)
+            if not rows:
+                break
+            self._insert_bands(conn, rows)
+        conn.execute("INSERT OR REPLACE INTO counters (name, value) VALUES ('minhash_bands', 1)")
+        conn.commit()
+        conn.close()
+
+    def find_near_duplicates(self, signatures: List[bytes], exclude_sources: List[str] = ()) -> Dict[bytes, bytes]:
+        """
+        {signature: stored signature} for each signature that a stored chunk (not of
+        `exclude_sources`) is at least THRESHOLD similar to. Only chunks sharing an LSH band
+        with one of the signatures are read.
+        """
+        self._backfill_bands()
+        wanted = {}
+        for signature in set(signatures):
+            for key in band_keys(signature):
+                wanted.setdefault(key, []).append(signature)
+        keys = list(wanted)
+        exclude = set(exclude_sources)
+        found = {}
+        conn = self._connect()
+        cursor = conn.cursor()
+        for start in range(0, len(keys), SQL_BATCH):
+            batch = keys[start:start + SQL_BATCH]
+            cursor.execute(f"SELECT b.key, c.minhash, c.source FROM minhash_bands b JOIN chunks c ON c.id = b.chunk_id "
+                           f"WHERE b.key IN ({_placeholders(batch)})", batch)
+            for key, stored, source in cursor.fetchall():
+                if source in exclude:
+                    continue
+                for signature in wanted[key]:
+                    if signature not in found and similarity(signature, stored) >= THRESHOLD:
+                        found[signature] = stored
+        conn.close()
+        return found
+
+    def ids_for_minhashes(self, signatures: List[bytes]) -> Dict[bytes, int]:
+        """{signature: id} of a stored chunk with each signature (those still present)."""
+        signatures = list(set(signatures))
+        conn = self._connect()
+        cursor = conn.cursor()
+        found = {}
+        for start in range(0, len(signatures), SQL_BATCH):
+            batch = signatures[start:start + SQL_BATCH]
+            cursor.execute(f"SELECT minhash, id FROM chunks WHERE minhash IN ({_placeholders(batch)})", batch)
+            found.update(cursor.fetchall())
+        conn.close()
+        return found
+
+    def add_duplicates(self, of_ids: List[int], metadatas: List[dict]):
+        """Links near-duplicate chunks to the indexed chunk each one repeats."""
+        rows = [(int(o), m.get("source", "unknown"), m.get("text", ""), *(m.get(k) for k in POSITION_KEYS),
+                 m.get("minhash")) for o, m in zip(of_ids, metadatas)]
+        conn = self._connect()
+        conn.executemany("INSERT INTO duplicates (of_id, source, text, page, start_index, end_index, minhash) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+        conn.close()
+
+    def delete_duplicates(self, sources: List[str]) -> int:
+        sources = list(sources)
+        if not sources:
+            return 0
+        conn = self._connect()
+        cursor = conn.execute(f"DELETE FROM duplicates WHERE source IN ({_placeholders(sources)})", sources)
+        removed = cursor.rowcount
+        conn.commit()
+        conn.close()
+        return removed
+
+    def _duplicate_rows(self, where: str, values: List) -> List[dict]:
+        conn = self._connect()
+        cursor = conn.cursor()
+        rows = []
+        for start in range(0, len(values), SQL_BATCH):
+            batch = values[start:start + SQL_BATCH]
+            cursor.execute(f"SELECT id, of_id, source, text, page, start_index, end_index, minhash FROM duplicates "
+                           f"WHERE {where} IN ({_placeholders(batch)}) ORDER BY id", batch)
+            for row in cursor.fetchall():
+                dup = {"id": row[0], "of_id": row[1], "source": row[2], "text": row[3], "minhash": row[7]}
+                dup.update((k, v) for k, v in zip(POSITION_KEYS, row[4:7]) if v is not None)
+                rows.append(dup)
+        conn.close()
+        return rows
+
+    def duplicates_of(self, ids: List[int]) -> Dict[int, List[dict]]:
+        """{id: [linked duplicate rows]} for the ids that have any."""
+        linked = {}
+        for row in self._duplicate_rows("of_id", [int(i) for i in ids]):
+            linked.setdefault(row["of_id"], []).append(row)
+        return linked
+
+    def duplicate_targets(self, sources: List[str]) -> List[int]:
+        """Ids of the indexed chunks that duplicates from `sources` are linked to."""
+        return sorted({row["of_id"] for row in self._duplicate_rows("source", list(sources))})
+
+    def get_duplicates(self) -> List[dict]:
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM duplicates")
+        ids = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return self._duplicate_rows("id", ids)
+
+    def set_duplicates(self, rows: List[dict]):
+        """Replaces all duplicate links, e.g. with those of the store being re-embedded."""
+        conn = self._connect()
+        conn.execute("DELETE FROM duplicates")
+        conn.commit()
+        conn.close()
+        self.add_duplicates([r["of_id"] for r in rows], rows)
+
+    def delete_duplicate_ids(self, ids: List[int]):
+        ids = [int(i) for i in ids]
+        conn = self._connect()
+        for start in range(0, len(ids), SQL_BATCH):
+            batch = ids[start:start + SQL_BATCH]
+            conn.execute(f"DELETE FROM duplicates WHERE id IN ({_placeholders(batch)})", batch)
+        conn.commit()
+        conn.close()
+
+    def duplicate_count(self) -> int:
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM duplicates")
+        result = cursor.fetchone()[0]
+        conn.close()
+        return result
+
+    def count(self) -> int:
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM chunks")
+        result = cursor.fetchone()[0]
+        conn.close()
+        return result
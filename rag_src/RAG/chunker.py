@@ -0,0 +1,224 @@
+import re
+import hashlib
+from bisect import bisect_right
+from typing import List, Any, Tuple
+from langchain_core.documents import Document
+from batching import CHARS_PER_TOKEN
+
+# Chunks are cut at the best kind of gap in reach: section (two or more blank lines, which
+# the PDF layout extractor puts before headings) > paragraph (a blank line) > line > sentence
+# > word. Windows are sized in characters first; tokens are only counted per window.
+BLANK_LINES_RE = re.compile(r"\n(?:[ \t\r]*\n)+")
+SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*(?=\s)")
+WORD_START_RE = re.compile(r"(?<=\s)\S")
+NON_SPACE_RE = re.compile(r"\S")
+# Windows tokenized per encode_batch call; bounds the memory held by their encodings
+COUNT_BATCH = 1024
+
+def chunk_tokens_for(chunk_size: int) -> int:
+    """Token budget matching a chunk_size given in characters."""
+    return max(1, chunk_size // CHARS_PER_TOKEN)
+
+def span_documents(doc: Any, spans: List[Tuple[int, int, int]]) -> List[Document]:
+    """
+    One Document per (start, end, tokens) span of doc. Metadata is copied and gets
+    `start_index`, `end_index` and `tokens` (what the model will see, special tokens
+    included, so embedding can batch by length without tokenizing again). A document
+    spanning several pages lists the offset each page starts at in `page_starts`; its
+    chunks get the (0-based) `page` they start on instead.
+    """
+    text = doc.page_content
+    metadata = dict(doc.metadata)
+    page_starts = metadata.pop("page_starts", None)
+    chunks = []
+    for s, e, tokens in spans:
+        chunk_meta = dict(metadata, start_index=s, end_index=e, tokens=tokens)
+        if page_starts:
+            chunk_meta["page"] = max(0, bisect_right(page_starts, s) - 1)
+        chunks.append(Document(page_content=text[s:e], metadata=chunk_meta))
+    return chunks
+
+class TokenChunker:
+    """
+    Single-pass, token-aware text splitter.
+
+    Chunks are windows of about `chunk_tokens` * CHARS_PER_TOKEN characters, each ending
+    at the best break in its second half (section > paragraph > line > sentence > word),
+    with the next one starting about `overlap_tokens` worth of characters earlier. Breaks
+    are found with str/regex scans bounded to the window, so the text is never walked in
+    Python or tokenized as a whole. With the model's fast tokenizer, every window is then
+    tokenized (in parallel batches) and the few that exceed `chunk_tokens` are re-cut
+    from their token offsets, so no chunk is silently truncated by the model. Chunks are
+    slices of the original string; the text is never re-split or re-joined.
+    """
+    def __init__(self, model: Any = None, chunk_tokens: int = 250, overlap_tokens: int = 50):
+        """
+        Args:
+            model: Embedding model whose tokenizer and max_seq_length are used. Without a
+                fast tokenizer, CHARS_PER_TOKEN characters stand in for a token.
+            chunk_tokens: Tokens per chunk, capped at what the model accepts.
+            overlap_tokens: Tokens repeated at the start of the next chunk.
+        """
+        self.tokenizer = self._fast_tokenizer(model)
+        limit = getattr(model, "max_seq_length", None)
+        if limit:
+            chunk_tokens = min(chunk_tokens, limit - self._special_tokens())
+        self.chunk_tokens = max(1, chunk_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.chunk_tokens // 2))
+        self.chunk_chars = self.chunk_tokens * CHARS_PER_TOKEN
+        self.overlap_chars = self.overlap_tokens * CHARS_PER_TOKEN
+        self._signature = None
+
+    @staticmethod
+    def _fast_tokenizer(model):
+        """A private copy of the model's tokenizers.Tokenizer, with truncation and padding off."""
+        tokenizer = getattr(model, "tokenizer", None)
+        # transformers fast tokenizers wrap a tokenizers.Tokenizer; the ONNX backend uses one directly
+        backend = getattr(tokenizer, "backend_tokenizer", tokenizer)
+        if not hasattr(backend, "to_str"):
+            return None
+        backend = type(backend).from_str(backend.to_str())
+        backend.no_truncation()
+        backend.no_padding()
+        return backend
+
+    def signature(self) -> tuple:
+        """Identifies chunkers that split identically (same tokenizer and window sizes)."""
+        if self._signature is None:
+            tokenizer = hashlib.md5(self.tokenizer.to_str().encode("utf-8")).hexdigest() if self.tokenizer else None
+            self._signature = (tokenizer, self.chunk_tokens, self.overlap_tokens)
+        return self._signature
+
+    def _special_tokens(self) -> int:
+        post = getattr(self.tokenizer, "post_processor", None)
+        return post.num_special_tokens_to_add(False) if post is not None else 2
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Tokens in each text, special tokens excluded (characters / CHARS_PER_TOKEN without a tokenizer)."""
+        if self.tokenizer is None:
+            return [-(-len(t) // CHARS_PER_TOKEN) for t in texts]
+        return [len(e) for e in self.tokenizer.encode_batch(texts, add_special_tokens=False)]
+
+    def spans(self, text: str) -> List[Tuple[int, int]]:
+        """Character (start, end) of every chunk, in order."""
+        if self.tokenizer is None:
+            # Nothing to check, so the windows are the chunks
+            return self._char_spans(text, self.chunk_chars)
+        return [(s, e) for s, e, _ in self.token_spans(text)]
+
+    def token_spans(self, text: str) -> List[Tuple[int, int, int]]:
+        """
+        (start, end, tokens) of every chunk, in order. `tokens` is the count the window
+        check found, plus the model's special tokens.
+        """
+        spans = self._char_spans(text, self.chunk_chars)
+        special = self._special_tokens()
+        if self.tokenizer is None:
+            return [(s, e, -(-(e - s) // CHARS_PER_TOKEN) + special) for s, e in spans]
+        # Offsets are only needed for the few windows that get re-cut, so the counting pass
+        # skips them where the tokenizers version allows
+        encode = getattr(self.tokenizer, "encode_batch_fast", self.tokenizer.encode_batch)
+        checked = []
+        for i in range(0, len(spans), COUNT_BATCH):
+            batch = spans[i:i + COUNT_BATCH]
+            encodings = encode([text[s:e] for s, e in batch], add_special_tokens=False)
+            for (s, e), encoding in zip(batch, encodings):
+                tokens = len(encoding)
+                if tokens <= self.chunk_tokens:
+                    checked.append((s, e, tokens + special))
+                else:
+                    offsets = self.tokenizer.encode(text[s:e], add_special_tokens=False).offsets
+                    checked.extend((s2, e2, n + special) for s2, e2, n in self._recut(text, s, e, offsets))
+        return checked
+
+    def _char_spans(self, text: str, size: int) -> List[Tuple[int, int]]:
+        """Windows of at most `size` characters, cut at the best break in their second half."""
+        paragraphs, sections = self._blank_line_breaks(text)
+        n = len(text)
+        # Chunks end before trailing whitespace, so the last one ends here
+        last = len(text.rstrip())
+        spans = []
+        start = self._skip_space(text, 0)
+        while start < n:
+            end = n if start + size >= n else self._best_break(text, paragraphs, sections,
+                                                                start + size // 2, start + size)
+            if end > start and text[end - 1].isspace():
+                end = start + len(text[start:end].rstrip())
+            if end <= start:
+                end = min(n, start + size)
+            spans.append((start, end))
+            if end >= last:
+                break
+            start = self._next_start(text, start, end)
+        return spans
+
+    def _recut(self, text: str, start: int, end: int, offsets: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+        """
+        Splits a window holding more than chunk_tokens tokens, using its token offsets.
+        Returns (start, end, tokens) spans, counting the tokens that end inside each.
+        """
+        ends = [start + e for _, e in offsets]
+        spans = []
+        while True:
+            # Tokens still ahead are the ones ending after `start`
+            first = bisect_right(ends, start)
+            if len(ends) - first <= self.chunk_tokens:
+                spans.append((start, end, len(ends) - first))
+                return spans
+            limit = ends[first + self.chunk_tokens - 1]
+            paragraphs, sections = self._blank_line_breaks(text, start, limit)
+            cut = self._best_break(text, paragraphs, sections, start + max(1, (limit - start) // 2), limit)
+            cut = max(start + 1, start + len(text[start:cut].rstrip()))
+            spans.append((start, cut, bisect_right(ends, cut) - first))
+            start = self._next_start(text, start, cut)
+
+    def _next_start(self, text: str, start: int, end: int) -> int:
+        """Start of the chunk after (start, end): overlap_chars back, at the start of a word."""
+        if self.overlap_chars:
+            word = WORD_START_RE.search(text, max(end - self.overlap_chars, start + 1), end)
+            if word:
+                return word.start()
+        return self._skip_space(text, end)
+
+    @staticmethod
+    def _skip_space(text: str, pos: int) -> int:
+        found = NON_SPACE_RE.search(text, pos)
+        return found.start() if found else len(text)
+
+    @staticmethod
+    def _blank_line_breaks(text: str, lo: int = 0, hi: int = None) -> Tuple[List[int], List[int]]:
+        """Offsets of paragraph and section breaks (runs of one / two or more blank lines)."""
+        paragraphs, sections = [], []
+        for m in BLANK_LINES_RE.finditer(text, lo, len(text) if hi is None else hi):
+            start, end = m.span()
+            # Most matches are a bare "\n\n"; only longer ones can hold two blank lines
+            (sections if end - start > 2 and text.count("\n", start, end) > 2 else paragraphs).append(start)
+        return paragraphs, sections
+
+    @staticmethod
+    def _best_break(text: str, paragraphs: List[int], sections: List[int], lo: int, hi: int) -> int:
+        """End of a chunk cut in [lo, hi]: the latest break of the best kind, else hi."""
+        for positions in (sections, paragraphs):
+            k = bisect_right(positions, hi) - 1
+            if k >= 0 and positions[k] >= lo:
+                return positions[k]
+        line = text.rfind("\n", lo, hi + 1)
+        if line >= 0:
+            return line
+        sentence = None
+        for sentence in SENTENCE_END_RE.finditer(text, lo, hi):
+            pass
+        if sentence is not None:
+            return sentence.end()
+        space = max(text.rfind(" ", lo, hi + 1), text.rfind("\t", lo, hi + 1))
+        return space if space >= 0 else hi
+
+    def split_text(self, text: str) -> List[str]:
+        return [text[s:e] for s, e in self.spans(text)]
+
+    def split_documents(self, documents: List[Any]) -> List[Document]:
+        """One Document per chunk, see span_documents."""
+        chunks = []
+        for doc in documents:
+            chunks.extend(span_documents(doc, self.token_spans(doc.page_content)))
+        return chunks
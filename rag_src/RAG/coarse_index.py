@@ -0,0 +1,85 @@
+import os
+import faiss
+import numpy as np
+
+# How vectors are reduced for the coarse pass. "truncate" keeps the leading dimensions,
+# which is what Matryoshka-trained models (e.g. nomic-embed-text) are built for; "pca"
+# projects onto the top principal components and works for any model.
+COARSE_METHODS = ("truncate", "pca")
+
+# Live vectors below which the coarse pass is skipped. Re-ranking the shortlist reads its
+# full vectors from the chunk store, a fixed ~1.5 ms per query, which an exact scan only
+# costs past ~30k vectors (benchmarks/bench_coarse_search.py, 384-d, one core)
+COARSE_MIN_POINTS = 30000
+
+class CoarseIndex:
+    """
+    Exact flat index over low-dimensional copies of the live vectors, keyed by the same
+    stable ids as the main index. Searching it is roughly dim / coarse_dim times cheaper
+    than a full-dimension scan; the shortlist it returns is re-ranked with the stored
+    full-precision vectors (see FaissVectorStore._search_coarse).
+    """
+    def __init__(self, dim: int, coarse_dim: int, method: str = "pca"):
+        if method not in COARSE_METHODS:
+            raise ValueError(f"Unknown coarse method: {method}")
+        self.dim = dim
+        self.coarse_dim = min(coarse_dim, dim)
+        self.method = method
+        self.pca = None
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.coarse_dim))
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def build(self, ids: np.ndarray, vectors: np.ndarray):
+        """Fills the index from scratch; PCA is (re)trained on these vectors."""
+        self.index.reset()
+        if vectors is None:
+            return
+        if self.method == "pca":
+            self.pca = faiss.PCAMatrix(self.dim, self.coarse_dim)
+            self.pca.train(np.ascontiguousarray(vectors, dtype="float32"))
+        self.add(ids, vectors)
+
+    def project(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype="float32")
+        if self.method == "pca":
+            return self.pca.apply(vectors)
+        return np.ascontiguousarray(vectors[:, :self.coarse_dim])
+
+    def add(self, ids, vectors: np.ndarray):
+        if len(ids):
+            self.index.add_with_ids(self.project(vectors), np.asarray(ids, dtype="int64"))
+
+    def remove(self, ids):
+        if len(ids):
+            self.index.remove_ids(np.asarray(ids, dtype="int64"))
+
+    def search(self, query_vecs: np.ndarray, k: int, sel=None):
+        params = faiss.SearchParameters(sel=sel) if sel is not None else None
+        return self.index.search(self.project(query_vecs), k, params=params)
+
+    def save(self, path: str):
+        """Writes the index (with its PCA matrix in front, if any) to one file, atomically."""
+        index = faiss.IndexPreTransform(self.pca, self.index) if self.method == "pca" else self.index
+        faiss.write_index(index, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str, dim: int) -> "CoarseIndex":
+        """Reads an index written by save(); the method and coarse_dim come from the file."""
+        index = faiss.read_index(path)
+        if isinstance(index, faiss.IndexPreTransform):
+            coarse = cls(index.d, index.index.d, "pca")
+            coarse.pca = faiss.downcast_VectorTransform(index.chain.at(0))
+            coarse.index = faiss.downcast_index(index.index)
+            # The wrapper owns both parts; keep it alive for as long as they are used
+            coarse._file_index = index
+        else:
+            coarse = cls(dim, index.d, "truncate")
+            coarse.index = index
+        return coarse
+
+    def nbytes(self) -> int:
+        return self.ntotal * self.coarse_dim * 4
@@ -5,9 +5,10 @@ import re
 from pathlib import Path
 from typing import List, Any
 from langchain_community.document_loaders import (
-    PyPDFLoader, TextLoader, CSVLoader, PyMuPDFLoader,
+    PyPDFLoader, TextLoader, CSVLoader,
     Docx2txtLoader, JSONLoader, WebBaseLoader
 )
+from pdf_layout import LayoutPDFLoader
 from langchain_community.document_loaders.excel import UnstructuredExcelLoader
 from bs4 import BeautifulSoup
 import textwrap
@@ -161,7 +162,7 @@ class DocumentLoader(DocumentManager):
         path_obj = Path(self.current_project_path)
         
         loader_map = {
-            ".pdf": PyMuPDFLoader,
+            ".pdf": LayoutPDFLoader,
             ".txt": TextLoader,
             ".csv": CSVLoader,
             ".docx": Docx2txtLoader,
@@ -58,6 +58,22 @@ class DBManager:
         conn.commit()
         conn.close()
 
+    def get_registered_files(self):
+        """Returns the filenames currently tracked in the registry."""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("SELECT filename FROM file_registry")
+        result = [row[0] for row in cursor.fetchall()]
+        conn.close()
+        return result
+
+    def remove_file_registry(self, filename):
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM file_registry WHERE filename = ?", (filename,))
+        conn.commit()
+        conn.close()
+
     def add_chat_message(self, role, content):
         conn = sqlite3.connect(self.db_path)
         cursor = conn.cursor()
@@ -0,0 +1,120 @@
+import re
+import hashlib
+import numpy as np
+from functools import lru_cache
+from typing import List, Any, Callable, Dict, Tuple
+
+# Chunks whose word shingles overlap at least this much (estimated Jaccard) are near-duplicates
+THRESHOLD = 0.8
+# Words per shingle; shingles make the comparison sensitive to word order, not just vocabulary
+SHINGLE = 3
+# MinHash signature length, split into LSH bands of ROWS values. Pairs at THRESHOLD share a
+# band with probability 1 - (1 - 0.8**4)**16 > 0.999; unrelated chunks rarely do.
+NUM_PERM = 64
+ROWS = 4
+BANDS = NUM_PERM // ROWS
+
+WORD_RE = re.compile(r"\w+")
+_rng = np.random.default_rng(0x5EED)
+# Universal hashing (a * x + b, high 32 bits) as the permutations; fixed so signatures are stable
+PERM_A = _rng.integers(1, 2**63, NUM_PERM, dtype=np.uint64) | np.uint64(1)
+PERM_B = _rng.integers(0, 2**63, NUM_PERM, dtype=np.uint64)
+BAND_IDS = np.arange(1, BANDS + 1, dtype=np.uint64)
+MIXERS = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xC2B2AE3D27D4EB4F), np.uint64(0x165667B19E3779F9))
+
+@lru_cache(maxsize=200_000)
+def word_hash(word: str) -> int:
+    # Stable across processes (unlike hash()), since signatures are stored in chunks.db
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+
+def minhash(text: str) -> bytes:
+    """MinHash signature of the text's word shingles (NUM_PERM uint32s), or b"" for no words."""
+    words = WORD_RE.findall(text.lower())
+    if not words:
+        return b""
+    hashes = np.array([word_hash(w) for w in words], dtype=np.uint64)
+    if len(hashes) >= SHINGLE:
+        # Shingle hash: each word hash in the window times a per-position constant, xor-ed
+        n = len(hashes) - SHINGLE + 1
+        shingles = np.zeros(n, dtype=np.uint64)
+        for k in range(SHINGLE):
+            shingles ^= hashes[k:k + n] * MIXERS[k]
+        hashes = np.unique(shingles)
+    permuted = (hashes[:, None] * PERM_A + PERM_B) >> np.uint64(32)
+    return permuted.min(axis=0).astype(np.uint32).tobytes()
+
+def similarity(a: bytes, b: bytes) -> float:
+    """Estimated Jaccard similarity of two signatures."""
+    return float(np.mean(np.frombuffer(a, dtype=np.uint32) == np.frombuffer(b, dtype=np.uint32)))
+
+def band_keys(signature: bytes) -> List[int]:
+    """
+    One 64-bit key per LSH band: the band's two 64-bit words mixed with its number, so
+    equal values in different bands don't collide. Signed, to fit an SQLite INTEGER.
+    """
+    words = np.frombuffer(signature, dtype=np.uint64).reshape(BANDS, ROWS // 2)
+    keys = words[:, 0] * MIXERS[0] ^ words[:, 1] * MIXERS[1] ^ BAND_IDS * MIXERS[2]
+    return keys.view(np.int64).tolist()
+
+class MinHashIndex:
+    """
+    LSH over MinHash signatures. find() only compares against signatures sharing a band
+    with the query, instead of every one seen so far. An optional scope (e.g. the source)
+    keeps matches within the same scope.
+    """
+    def __init__(self):
+        self.buckets = {}
+
+    def add(self, signature: bytes, scope: Any = None):
+        for key in band_keys(signature):
+            self.buckets.setdefault((scope, key), []).append(signature)
+
+    def find(self, signature: bytes, scope: Any = None, threshold: float = THRESHOLD):
+        """A stored signature at least `threshold` similar to this one, or None."""
+        checked = set()
+        for key in band_keys(signature):
+            for other in self.buckets.get((scope, key), ()):
+                if other in checked:
+                    continue
+                checked.add(other)
+                if similarity(signature, other) >= threshold:
+                    return other
+        return None
+
+class NearDuplicateFilter:
+    """
+    Splits chunks into unique ones and near-duplicates of a chunk seen earlier (in this
+    filter's lifetime or, through `lookup`, in the store). Every chunk gets its `minhash`
+    in metadata; a duplicate also gets `duplicate_of`, the signature of the chunk it
+    repeats, which the store resolves to that chunk's id when linking.
+    """
+    def __init__(self, lookup: Callable[[List[bytes]], Dict[bytes, bytes]] = None, per_source: bool = False):
+        """
+        Args:
+            lookup: Finds stored chunks that new ones repeat: called once per split() with
+                the new signatures, returns {signature: stored signature} for the matches
+                (e.g. ChunkStore.find_near_duplicates).
+            per_source: Only match chunks of the same source (stores that shard by source).
+        """
+        self.lookup = lookup
+        self.per_source = per_source
+        self.index = MinHashIndex()
+        self.skipped = 0
+
+    def split(self, chunks: List[Any]) -> Tuple[List[Any], List[Any]]:
+        unique, duplicates = [], []
+        signatures = [minhash(chunk.page_content) for chunk in chunks]
+        stored = self.lookup([s for s in signatures if s]) if self.lookup else {}
+        for chunk, signature in zip(chunks, signatures):
+            chunk.metadata["minhash"] = signature
+            scope = chunk.metadata.get("source") if self.per_source else None
+            original = (stored.get(signature) or self.index.find(signature, scope)) if signature else None
+            if original is None:
+                if signature:
+                    self.index.add(signature, scope)
+                unique.append(chunk)
+            else:
+                chunk.metadata["duplicate_of"] = original
+                duplicates.append(chunk)
+        self.skipped += len(duplicates)
+        return unique, duplicates
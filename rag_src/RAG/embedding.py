@@ -1,29 +1,108 @@
 from typing import List, Any
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from sentence_transformers import SentenceTransformer
+from chunker import TokenChunker, chunk_tokens_for
+from chunk_pool import split_each
+from model_registry import get_model
+from embedding_cache import EmbeddingCache
+from embedding_backends import is_ollama_model
+from embedding_pool import get_pool, discard_pool, pool_in_use, MIN_POOL_TEXTS
+from batching import token_lengths, token_budget_batches
 import numpy as np
+from concurrent.futures.process import BrokenProcessPool
 
 class EmbeddingPipeline:
-    def __init__(self, model_name: str = "all-MiniLM-L6-v2", chunk_size: int = 1000, chunk_overlap: int = 200):
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", chunk_size: int = 1000, chunk_overlap: int = 200,
+                 cache: EmbeddingCache = None, processes: int = 0, token_budget: int = 8192,
+                 chunk_processes: int = None):
+        # Characters, converted to tokens for the chunker (which also caps them at the model's limit)
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        self.model = SentenceTransformer(model_name)
-        print(f"[INFO] Loaded embedding model: {model_name}")
+        self.model_name = model_name
+        # Optional content-addressed cache; only chunks missing from it are embedded
+        self.cache = cache
+        # Opt-in: >1 encodes large jobs in a shared pool of worker processes
+        self.processes = processes
+        # Padded tokens per encode batch (count x longest); None uses fixed-size batches
+        self.token_budget = token_budget
+        # Worker processes for chunking large jobs; None picks a default from the core count, 0 is in-process
+        self.chunk_processes = chunk_processes
+        self._splitter = None
+
+    @property
+    def model(self):
+        """The shared embedding model, fetched from the registry on each use."""
+        return get_model(self.model_name)
+
+    def splitter(self) -> TokenChunker:
+        """Chunker sized in the model's own tokens (built once; it keeps only a tokenizer copy)."""
+        if self._splitter is None:
+            self._splitter = TokenChunker(self.model, chunk_tokens=chunk_tokens_for(self.chunk_size),
+                                          overlap_tokens=chunk_tokens_for(self.chunk_overlap))
+        return self._splitter
+
+    def split_each(self, documents: List[Any]) -> List[List[Any]]:
+        """The chunks of each document, in order; large jobs are split in worker processes."""
+        return split_each(self.splitter(), documents, self.chunk_processes)
 
     def chunk_documents(self, documents: List[Any]) -> List[Any]:
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=self.chunk_size,
-            chunk_overlap=self.chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        chunks = splitter.split_documents(documents)
+        chunks = [chunk for doc_chunks in self.split_each(documents) for chunk in doc_chunks]
         print(f"[INFO] Split {len(documents)} documents into {len(chunks)} chunks.")
         return chunks
 
     def embed_chunks(self, chunks: List[Any]) -> np.ndarray:
         texts = [chunk.page_content for chunk in chunks]
-        print(f"[INFO] Generating embeddings for {len(texts)} chunks...")
-        embeddings = self.model.encode(texts, show_progress_bar=True)
+        # Token counts the chunker recorded, so batching needn't tokenize every text again
+        lengths = [chunk.metadata.get("tokens") for chunk in chunks]
+        if self.cache is None or not texts:
+            print(f"[INFO] Generating embeddings for {len(texts)} chunks...")
+            embeddings = self._encode(texts, lengths)
+            print(f"[INFO] Embeddings shape: {embeddings.shape}")
+            return embeddings
+
+        vectors = self.cache.get_many(self.model_name, texts)
+        # Each distinct missing text is embedded once, even if it repeats
+        missing = list(dict.fromkeys(t for t in texts if t not in vectors))
+        print(f"[INFO] Generating embeddings for {len(missing)} chunks ({len(texts) - len(missing)} cached)...")
+        if missing:
+            length_of = dict(zip(texts, lengths))
+            new_vectors = np.asarray(self._encode(missing, [length_of[t] for t in missing]), dtype="float32")
+            self.cache.put_many(self.model_name, missing, new_vectors)
+            vectors.update(zip(missing, new_vectors))
+        embeddings = np.vstack([vectors[t] for t in texts]).astype("float32")
         print(f"[INFO] Embeddings shape: {embeddings.shape}")
         return embeddings
+
+    def _encode(self, texts: List[str], lengths: List[int] = None) -> np.ndarray:
+        # Ollama already embeds concurrently server-side, so it never needs the pool
+        if self.processes > 1 and len(texts) >= MIN_POOL_TEXTS and not is_ollama_model(self.model_name):
+            print(f"[INFO] Encoding {len(texts)} chunks in {self.processes} worker processes...")
+            with pool_in_use(self.model_name, self.processes):
+                pool = get_pool(self.model_name, self.processes)
+                try:
+                    # Batched by token length like the in-process path
+                    return pool.encode(texts, lengths, self.token_budget)
+                except BrokenProcessPool:
+                    # A worker died; the next large job starts a fresh pool, this one finishes here
+                    print("[ERROR] An embedding worker crashed; encoding in-process instead.")
+                    discard_pool(pool)
+        if not self.token_budget or len(texts) < 2 or is_ollama_model(self.model_name):
+            return self.model.encode(texts, show_progress_bar=True)
+        return self._encode_bucketed(texts, lengths)
+
+    def _encode_bucketed(self, texts: List[str], lengths: List[int] = None) -> np.ndarray:
+        """
+        Encodes texts in batches of similar token length sized by token_budget, so short
+        chunks aren't padded to the longest chunk of the job, then restores input order.
+        `lengths` are the token counts the chunker recorded; texts are only tokenized
+        here when some are missing (e.g. chunks stored before counts were recorded).
+        """
+        model = self.model
+        if lengths is None or None in lengths:
+            lengths = token_lengths(model, texts)
+        batches = token_budget_batches(lengths, self.token_budget)
+        embeddings = None
+        for batch in batches:
+            vectors = np.asarray(model.encode([texts[i] for i in batch], batch_size=len(batch)), dtype="float32")
+            if embeddings is None:
+                embeddings = np.empty((len(texts), vectors.shape[1]), dtype="float32")
+            embeddings[batch] = vectors
+        return embeddings
@@ -0,0 +1,257 @@
+import os
+import re
+import json
+import platform
+import threading
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+# Optional: only needed for the ONNX backend
+try:
+    import onnxruntime as ort
+    from tokenizers import Tokenizer
+except ImportError:
+    ort = None
+    Tokenizer = None
+
+OLLAMA_URL = "http://localhost:11434"
+OLLAMA_PREFIX = "ollama/"
+ONNX_PREFIX = "onnx/"
+# int8 exports sentence-transformers publishes per CPU family. The x86-64 one needs only
+# AVX2 (uint8 activations), so it runs on any recent x86-64 CPU
+ONNX_QUANTIZED_FILES = {
+    "x86_64": "onnx/model_quint8_avx2.onnx",
+    "arm64": "onnx/model_qint8_arm64.onnx",
+}
+# platform.machine() spellings of the same families
+MACHINE_ALIASES = {"amd64": "x86_64", "x64": "x86_64", "aarch64": "arm64", "armv8": "arm64"}
+ONNX_FILE = "onnx/model.onnx"
+# Sequence limit when the model's configs don't give one (SentenceTransformers' common default)
+DEFAULT_MAX_SEQ_LENGTH = 256
+# "name:tag" without path separators, so Windows paths (C:\models\...) aren't taken for Ollama models
+OLLAMA_TAG_RE = re.compile(r"^[\w.\-]+:[\w.\-]+$")
+
+def is_ollama_model(model_name: str) -> bool:
+    """
+    Ollama models are named "name:tag" (e.g. "nomic-embed-text:latest") or given
+    with an explicit "ollama/" prefix (also for namespaced models, "ollama/user/name:tag");
+    anything else is a SentenceTransformers model.
+    """
+    return model_name.startswith(OLLAMA_PREFIX) or bool(OLLAMA_TAG_RE.match(model_name))
+
+def is_onnx_model(model_name: str) -> bool:
+    """"onnx/<model>" runs the SentenceTransformers model with ONNX Runtime instead of PyTorch."""
+    return model_name.startswith(ONNX_PREFIX)
+
+def quantized_onnx_file(machine: str = None) -> str:
+    """The int8 export for this CPU (or `machine`), or None where none is published."""
+    machine = (machine or platform.machine()).lower()
+    return ONNX_QUANTIZED_FILES.get(MACHINE_ALIASES.get(machine, machine))
+
+class OllamaEmbeddingBackend:
+    """
+    Embeds text with a model served by Ollama.
+
+    Texts are sent in batches of `batch_size` to /api/embed over one pooled HTTP
+    session, with at most `max_concurrency` requests in flight. Servers without
+    /api/embed fall back to one /api/embeddings call per text. Exposes the same
+    encode()/get_sentence_embedding_dimension() calls as SentenceTransformer,
+    so the rest of the pipeline doesn't care which backend it got.
+    """
+    def __init__(self, model_name: str, base_url: str = OLLAMA_URL, batch_size: int = 64,
+                 max_concurrency: int = 4, timeout: float = 120):
+        if model_name.startswith(OLLAMA_PREFIX):
+            model_name = model_name[len(OLLAMA_PREFIX):]
+        self.model_name = model_name
+        self.base_url = base_url.rstrip("/")
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._dimension = None
+        self._legacy_api = False
+        self._lock = threading.Lock()
+
+        # Keep-alive connections, one per concurrent request
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def encode(self, texts: List[str], **kwargs) -> np.ndarray:
+        """Returns a (len(texts), dim) float32 matrix. Extra SentenceTransformer kwargs are ignored."""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self._dimension or 0), dtype="float32")
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) == 1:
+            results = [self._embed_batch(batches[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(batches))) as pool:
+                results = list(pool.map(self._embed_batch, batches))
+        vectors = np.vstack([np.asarray(r, dtype="float32") for r in results])
+        if self._dimension is None:
+            self._dimension = vectors.shape[1]
+        return vectors
+
+    def get_sentence_embedding_dimension(self) -> int:
+        """Vector size reported by the model, probed with one short request on first use."""
+        with self._lock:
+            if self._dimension is None:
+                self._dimension = len(self._embed_batch(["dimension probe"])[0])
+        return self._dimension
+
+    def _embed_batch(self, batch: List[str]) -> List[List[float]]:
+        if not self._legacy_api:
+            response = self.session.post(f"{self.base_url}/api/embed", json={"model": self.model_name, "input": batch},
+                                         timeout=self.timeout)
+            # A missing route (old server) 404s as plain text; a missing model 404s with a JSON error
+            if response.status_code != 404 or not response.text.startswith("404 page not found"):
+                response.raise_for_status()
+                embeddings = response.json()["embeddings"]
+                if len(embeddings) != len(batch):
+                    raise ValueError(f"Ollama returned {len(embeddings)} embeddings for {len(batch)} texts.")
+                return embeddings
+            # Ollama before 0.3 only has the single-prompt endpoint
+            print(f"[INFO] Ollama has no /api/embed, falling back to /api/embeddings.")
+            self._legacy_api = True
+        embeddings = []
+        for text in batch:
+            response = self.session.post(f"{self.base_url}/api/embeddings", json={"model": self.model_name, "prompt": text},
+                                         timeout=self.timeout)
+            response.raise_for_status()
+            embeddings.append(response.json()["embedding"])
+        return embeddings
+
+    def close(self):
+        self.session.close()
+
+
+class OnnxEmbeddingBackend:
+    """
+    Runs a SentenceTransformers model with ONNX Runtime on the CPU, without PyTorch.
+
+    By default the int8-quantized export that sentence-transformers publishes next to
+    the model for this CPU is used (see quantized_onnx_file; other CPUs fall back to
+    float32); quantize=False loads the float32 export. Tokenization (including the
+    max_seq_length truncation), pooling and normalization follow the model's own
+    SentenceTransformers config, so vectors have the same shape as the PyTorch backend.
+
+    Quantization changes the vectors slightly. tests/test_embedding_backends.py requires
+    the cosine similarity between both backends' vectors for all-MiniLM-L6-v2 to stay
+    above 0.95 for every text of a fixed sample and above 0.98 on average (it is skipped
+    without onnxruntime, sentence-transformers and the model). For other models,
+    benchmarks/bench_embedding_backends.py reports the drift on real chunks; check it
+    before switching a project, and re-embed the project (vectors of the two backends
+    shouldn't be mixed).
+
+    Requires `pip install onnxruntime tokenizers`.
+    """
+    def __init__(self, model_name: str, quantize: bool = True, onnx_file: str = None,
+                 batch_size: int = 32, num_threads: int = None):
+        """
+        Args:
+            model_name: "onnx/<name>", a Hugging Face repo id or a local model directory.
+                Bare names resolve to sentence-transformers/<name>.
+            quantize: Use the int8 export instead of the float32 one.
+            onnx_file: Explicit ONNX file inside the model directory (overrides quantize).
+            num_threads: ONNX Runtime intra-op threads. Defaults to all cores.
+        """
+        if ort is None:
+            raise ImportError("The ONNX backend needs onnxruntime and tokenizers (pip install onnxruntime tokenizers).")
+        if model_name.startswith(ONNX_PREFIX):
+            model_name = model_name[len(ONNX_PREFIX):]
+        self.model_name = model_name
+        self.batch_size = batch_size
+        if onnx_file is None:
+            onnx_file = (quantize and quantized_onnx_file()) or ONNX_FILE
+
+        model_dir = self._model_dir(model_name, onnx_file)
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(os.path.join(model_dir, onnx_file), options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        # Exposed like SentenceTransformer.max_seq_length, so the chunker and batching see it
+        self.max_seq_length = self._max_seq_length(model_dir)
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.enable_padding()
+
+        pooling = self._read_json(model_dir, "1_Pooling/config.json")
+        self.pooling = "cls" if pooling.get("pooling_mode_cls_token") else "mean"
+        modules = self._read_json(model_dir, "modules.json") or []
+        self.normalize = any(m.get("type", "").endswith("Normalize") for m in modules)
+        self.dimension = self._read_json(model_dir, "config.json").get("hidden_size")
+
+    @staticmethod
+    def _model_dir(model_name: str, onnx_file: str) -> str:
+        if os.path.isdir(model_name):
+            return model_name
+        from huggingface_hub import snapshot_download
+        repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        # Only the tokenizer, the configs and the one ONNX file are downloaded
+        return snapshot_download(repo_id, allow_patterns=[onnx_file, "*.json"])
+
+    @classmethod
+    def _max_seq_length(cls, model_dir: str) -> int:
+        """
+        Tokens the model reads, special tokens included, chosen as SentenceTransformers
+        does: sentence_bert_config.json's max_seq_length, else the tokenizer's
+        model_max_length capped by the model's max_position_embeddings.
+        """
+        limit = cls._read_json(model_dir, "sentence_bert_config.json").get("max_seq_length")
+        if limit:
+            return limit
+        limit = cls._read_json(model_dir, "tokenizer_config.json").get("model_max_length")
+        positions = cls._read_json(model_dir, "config.json").get("max_position_embeddings")
+        # Tokenizers without a limit store a huge sentinel (1e30)
+        if not isinstance(limit, int) or limit >= 1_000_000:
+            limit = None
+        if limit and positions:
+            limit = min(limit, positions)
+        return limit or positions or DEFAULT_MAX_SEQ_LENGTH
+
+    @staticmethod
+    def _read_json(model_dir: str, name: str):
+        path = os.path.join(model_dir, name)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def encode(self, texts: List[str], batch_size: int = None, **kwargs) -> np.ndarray:
+        """Returns a (len(texts), dim) float32 matrix. Extra SentenceTransformer kwargs are ignored."""
+        texts = list(texts)
+        batch_size = batch_size or self.batch_size
+        if not texts:
+            return np.empty((0, self.dimension or 0), dtype="float32")
+        batches = [self._encode_batch(texts[i:i + batch_size]) for i in range(0, len(texts), batch_size)]
+        return np.vstack(batches)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype="int64")
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype="int64")
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype="int64")
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        if self.pooling == "cls":
+            vectors = token_embeddings[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype("float32")
+            vectors = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        if self.normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype("float32")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self.dimension is None:
+            self.dimension = self.encode(["dimension probe"]).shape[1]
+        return self.dimension
@@ -0,0 +1,134 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from typing import List, Dict
+
+# Stay below SQLite's limit on bound parameters per statement
+SQL_BATCH = 900
+
+class EmbeddingCache:
+    """
+    Persistent vector cache keyed by sha256(model name, chunk text).
+
+    Unchanged chunks of an edited file, and files copied between notebooks
+    (when the cache is shared), are looked up here instead of being embedded
+    again. The least recently used entries are evicted once the cache holds
+    more than `max_entries` vectors.
+    """
+    def __init__(self, db_path: str, max_entries: int = 200000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        # Counters for this process; see stats()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        parent = os.path.dirname(db_path)
+        if parent and not os.path.exists(parent):
+            os.makedirs(parent)
+        self._init_db()
+
+    def _connect(self):
+        return sqlite3.connect(self.db_path)
+
+    def _init_db(self):
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB,
+                last_used REAL
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+        conn.close()
+
+    @staticmethod
+    def key(model_name: str, text: str) -> str:
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, model_name: str, texts: List[str]) -> Dict[str, np.ndarray]:
+        """Returns {text: vector} for the texts already cached and counts hits/misses."""
+        hashed = [self.key(model_name, t) for t in texts]
+        keys = dict(zip(hashed, texts))
+        found = {}
+        conn = self._connect()
+        cursor = conn.cursor()
+        key_list = list(keys)
+        for start in range(0, len(key_list), SQL_BATCH):
+            batch = key_list[start:start + SQL_BATCH]
+            placeholders = ",".join("?" * len(batch))
+            cursor.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in cursor.fetchall():
+                found[key] = np.frombuffer(blob, dtype="float32")
+        if found:
+            now = time.time()
+            conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found])
+            conn.commit()
+        conn.close()
+
+        hit_count = sum(1 for k in hashed if k in found)
+        with self.lock:
+            self.hits += hit_count
+            self.misses += len(hashed) - hit_count
+        return {keys[k]: v for k, v in found.items()}
+
+    def put_many(self, model_name: str, texts: List[str], vectors: np.ndarray):
+        now = time.time()
+        rows = [(self.key(model_name, t), np.asarray(v, dtype="float32").tobytes(), now) for t, v in zip(texts, vectors)]
+        conn = self._connect()
+        conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+        conn.commit()
+        conn.close()
+        self.evict()
+
+    def evict(self) -> int:
+        """Drops least recently used entries beyond max_entries. Returns how many were removed."""
+        if not self.max_entries:
+            return 0
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM embeddings")
+        excess = cursor.fetchone()[0] - self.max_entries
+        if excess > 0:
+            cursor.execute('''
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+                )
+            ''', (excess,))
+            conn.commit()
+        conn.close()
+        excess = max(excess, 0)
+        with self.lock:
+            self.evictions += excess
+        return excess
+
+    def count(self) -> int:
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM embeddings")
+        result = cursor.fetchone()[0]
+        conn.close()
+        return result
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": self.count(),
+            "max_entries": self.max_entries,
+        }
+
+    def clear(self):
+        conn = self._connect()
+        conn.execute("DELETE FROM embeddings")
+        conn.commit()
+        conn.close()
@@ -0,0 +1,191 @@
+import os
+import atexit
+import threading
+import multiprocessing
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Callable, Any, Hashable
+from model_registry import load_model
+from batching import token_lengths, token_budget_batches
+
+# Below this many texts the pool's IPC overhead outweighs the extra cores
+MIN_POOL_TEXTS = 256
+# Texts per task; small enough to balance work across workers, large enough to batch well
+SHARD_SIZE = 128
+# Pools are stopped once no call has used them for this long, so their workers (and the
+# model copies, for embedding) only hold memory while syncs are coming in
+POOL_IDLE_SECONDS = 60
+
+# Set in each worker process by _init_worker
+_worker_model = None
+
+def default_processes(max_processes: int) -> int:
+    """Workers used when none are configured: one core is left for the app, and 0 (off) on 1-2 cores."""
+    cpus = os.cpu_count() or 1
+    processes = min(max_processes, cpus - 1)
+    return processes if processes > 1 else 0
+
+def spawn_executor(processes: int, initializer: Callable = None, initargs: tuple = ()) -> ProcessPoolExecutor:
+    """Worker processes for the pools in this module and in chunk_pool and load_pool."""
+    # spawn: forking a process that already runs PyTorch threads can deadlock
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
+
+class PoolRegistry:
+    """
+    Process-wide worker pools keyed by their settings, so later calls reuse warm workers
+    instead of spawning again. A pool is anything with shutdown(wait, cancel_futures),
+    e.g. a ProcessPoolExecutor. Callers that want idle pools stopped claim() a key while
+    they use it and release() it with an idle timeout. Every pool is shut down at exit.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.pools = {}
+        # Calls using the pool of each key, and the timers stopping the idle ones
+        self.users = {}
+        self.idle_timers = {}
+        self.lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    def get(self, key: Hashable, start: Callable[[], Any]) -> Any:
+        """Returns the pool for key, calling start() to create it on first use."""
+        with self.lock:
+            pool = self.pools.get(key)
+            if pool is None:
+                pool = start()
+                self.pools[key] = pool
+            return pool
+
+    def discard(self, pool: Any):
+        """Drops a pool whose workers died (OOM, crash), so the next get() starts a fresh one."""
+        with self.lock:
+            for key, cached in list(self.pools.items()):
+                if cached is pool:
+                    del self.pools[key]
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def claim(self, key: Hashable):
+        """Marks the pool for key as in use, so it isn't stopped as idle."""
+        with self.lock:
+            self.users[key] = self.users.get(key, 0) + 1
+            timer = self.idle_timers.pop(key, None)
+            if timer is not None:
+                timer.cancel()
+
+    def release(self, key: Hashable, idle_seconds: float):
+        """Ends a claim(); the pool is stopped idle_seconds after its last user released it."""
+        with self.lock:
+            self.users[key] -= 1
+            if self.users[key] == 0 and key in self.pools:
+                timer = threading.Timer(idle_seconds, self._stop_idle, (key,))
+                timer.daemon = True
+                self.idle_timers[key] = timer
+                timer.start()
+
+    @contextmanager
+    def claimed(self, key: Hashable, idle_seconds: float):
+        """claim() for the duration of a with-block."""
+        self.claim(key)
+        try:
+            yield
+        finally:
+            self.release(key, idle_seconds)
+
+    def _stop_idle(self, key: Hashable):
+        with self.lock:
+            # A call may have claimed the pool while this timer waited for the lock
+            if self.users.get(key) or self.idle_timers.get(key) is not threading.current_thread():
+                return
+            del self.idle_timers[key]
+            pool = self.pools.pop(key, None)
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=False)
+            print(f"[INFO] Stopped idle {self.name} workers.")
+
+    def shutdown(self):
+        with self.lock:
+            for timer in self.idle_timers.values():
+                timer.cancel()
+            self.idle_timers.clear()
+            for pool in self.pools.values():
+                pool.shutdown(wait=True, cancel_futures=True)
+            self.pools.clear()
+
+def _init_worker(model_name: str, loader: Callable, threads: int):
+    global _worker_model
+    try:
+        import torch
+        # Workers split the cores between them instead of each using all of them
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+    _worker_model = (loader or load_model)(model_name)
+
+def _encode_shard(texts: List[str], batch_size: int = None) -> np.ndarray:
+    kwargs = {"batch_size": batch_size} if batch_size else {}
+    return np.asarray(_worker_model.encode(texts, **kwargs), dtype="float32")
+
+class EmbeddingWorkerPool:
+    """
+    Worker processes that each hold a copy of the embedding model. encode() splits
+    the texts into shards, encodes them in parallel and reassembles the vectors in
+    input order. Pools are long-lived: get them with get_pool() so later sync runs
+    reuse the warm workers instead of spawning (and loading the model) again, and
+    hold them with pool_in_use() so they are stopped once idle.
+    """
+    def __init__(self, model_name: str, processes: int = None, loader: Callable = None):
+        self.model_name = model_name
+        self.processes = processes or os.cpu_count() or 1
+        threads = max(1, (os.cpu_count() or 1) // self.processes)
+        self.executor = spawn_executor(self.processes, _init_worker, (model_name, loader, threads))
+        print(f"[INFO] Started {self.processes} embedding workers for {model_name}.")
+
+    def encode(self, texts: List[str], lengths: List[int] = None, token_budget: int = None,
+               shard_size: int = SHARD_SIZE) -> np.ndarray:
+        """
+        With a token_budget, texts are sent in batches of similar token length, as in
+        EmbeddingPipeline._encode_bucketed, each encoded as one padded batch. `lengths` are
+        the chunker's token counts; missing ones are estimated from characters, since the
+        parent process doesn't hold the model. Without a budget, texts go in consecutive
+        shards of shard_size.
+        """
+        texts = list(texts)
+        if token_budget and len(texts) > 1:
+            if lengths is None or None in lengths:
+                lengths = token_lengths(None, texts)
+            batches = token_budget_batches(lengths, token_budget)
+            shards = [[texts[i] for i in batch] for batch in batches]
+            vectors = list(self.executor.map(_encode_shard, shards, [len(shard) for shard in shards]))
+            embeddings = np.empty((len(texts), vectors[0].shape[1]), dtype="float32")
+            for batch, rows in zip(batches, vectors):
+                embeddings[batch] = rows
+            return embeddings
+        shards = [texts[i:i + shard_size] for i in range(0, len(texts), shard_size)]
+        # map() yields results in submission order, so the rows line up with `texts`
+        return np.vstack(list(self.executor.map(_encode_shard, shards)))
+
+    def shutdown(self, wait: bool = True, cancel_futures: bool = True):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+_pools = PoolRegistry("embedding")
+
+def get_pool(model_name: str, processes: int = None, loader: Callable = None) -> EmbeddingWorkerPool:
+    """Returns the process-wide pool for (model, processes), starting it on first use."""
+    return _pools.get(_pool_key(model_name, processes),
+                      lambda: EmbeddingWorkerPool(model_name, processes=processes, loader=loader))
+
+def _pool_key(model_name: str, processes: int = None) -> tuple:
+    return model_name, processes or os.cpu_count() or 1
+
+def pool_in_use(model_name: str, processes: int = None):
+    """Context manager marking the (model, processes) pool busy; it stops POOL_IDLE_SECONDS after the last use."""
+    return _pools.claimed(_pool_key(model_name, processes), POOL_IDLE_SECONDS)
+
+def discard_pool(pool: EmbeddingWorkerPool):
+    """Drops a pool whose workers died (OOM, crash), so the next get_pool() starts a fresh one."""
+    _pools.discard(pool)
+
+def shutdown_pools():
+    _pools.shutdown()
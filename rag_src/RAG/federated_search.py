@@ -0,0 +1,124 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from sharded_store import open_store
+from model_registry import get_model
+from query_cache import QueryEmbeddingCache
+
+DEPENDENCY_DIR = "project_dependency"
+INDEX_DIR = "vector_index"
+
+class FederatedSearch:
+    """
+    Answers one question across every project under the OpenbookLM-Projects root
+    (or a chosen subset). The query is embedded once, projects are searched
+    concurrently and their hits are merged by distance. Only `max_open` project
+    indexes are kept open at a time (least recently used are closed first), so
+    memory stays bounded with dozens of notebooks.
+    """
+    def __init__(self, root_path: str, embedding_model: str = "all-MiniLM-L6-v2",
+                 max_open: int = 4, max_workers: int = None, query_cache_size: int = 256):
+        """
+        Args:
+            root_path: The OpenbookLM-Projects folder (DocumentManager.base_storage_path).
+            max_open: Project indexes kept open between queries.
+            max_workers: Projects searched at once. Defaults to max_open.
+            query_cache_size: Query texts whose vectors are kept for repeated questions.
+        """
+        self.root_path = root_path
+        self.embedding_model = embedding_model
+        self.max_open = max_open
+        self.max_workers = max_workers or max_open
+
+        self.open_stores = OrderedDict()
+        self.lock = threading.Lock()
+        self.query_cache = QueryEmbeddingCache(query_cache_size)
+
+    @property
+    def model(self):
+        """The shared embedding model, fetched from the registry on each use."""
+        return get_model(self.embedding_model)
+
+    def index_dir(self, project: str) -> str:
+        return os.path.join(self.root_path, project, DEPENDENCY_DIR, INDEX_DIR)
+
+    def list_projects(self) -> List[str]:
+        """Projects that have been indexed at least once."""
+        if not self.root_path or not os.path.isdir(self.root_path):
+            return []
+        return sorted(p for p in os.listdir(self.root_path) if os.path.isdir(self.index_dir(p)))
+
+    def _get_store(self, project: str):
+        """Returns the project's store from the LRU, opening (and evicting) as needed."""
+        with self.lock:
+            store = self.open_stores.pop(project, None)
+            if store is None:
+                # Read-only: the project may be open for ingest elsewhere, and this store
+                # must not clean up or finish anything that one is writing
+                store = open_store(self.index_dir(project), embedding_model=self.embedding_model, lazy=True,
+                                   writable=False)
+            self.open_stores[project] = store
+            while len(self.open_stores) > self.max_open:
+                evicted, _ = self.open_stores.popitem(last=False)
+                print(f"[INFO] Closed index of {evicted}.")
+        return store
+
+    def close(self, project: str = None):
+        """Closes one project's index (e.g. after it was deleted or renamed), or all of them."""
+        with self.lock:
+            if project is None:
+                self.open_stores.clear()
+            else:
+                self.open_stores.pop(project, None)
+
+    def query_cache_stats(self) -> dict:
+        """Hit rate and size of the query embedding cache."""
+        return self.query_cache.stats()
+
+    def query(self, query_text: str, top_k: int = 5, projects: List[str] = None) -> List[dict]:
+        return self.query_batch([query_text], top_k=top_k, projects=projects)[0]
+
+    def query_batch(self, query_texts: List[str], top_k: int = 5, projects: List[str] = None) -> List[List[dict]]:
+        """
+        Searches every indexed project (or only `projects`) and merges the hits by distance.
+        Each result is shaped like FaissVectorStore.query() plus the "project" it came from.
+        """
+        if not query_texts:
+            return []
+        available = self.list_projects()
+        names = [p for p in (available if projects is None else projects) if p in available]
+        if not names:
+            return [[] for _ in query_texts]
+
+        # Repeated questions are answered from the query cache without running the model
+        query_embs = self.query_cache.encode(self.model, query_texts)
+
+        def search(project):
+            try:
+                store = self._get_store(project)
+                store.ensure_index_loaded()
+                # The check and the search share the store lock, so a model migration
+                # can't swap the index in between
+                with store.lock:
+                    if store.embedding_model != self.embedding_model:
+                        # Distances between different models' vectors are meaningless
+                        raise ValueError(f"indexed with {store.embedding_model}, not {self.embedding_model}")
+                    return store.search_vectors(query_embs, top_k=top_k)
+            except Exception as e:
+                # One broken project must not fail the whole question
+                print(f"[ERROR] Search in {project} failed: {e}")
+                return [[] for _ in query_texts]
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(names))) as pool:
+            per_project = list(pool.map(search, names))
+
+        batch_results = []
+        for row in range(len(query_texts)):
+            merged = []
+            for project, results in zip(names, per_project):
+                merged.extend(dict(r, project=project) for r in results[row])
+            merged.sort(key=lambda r: r["distance"])
+            batch_results.append(merged[:top_k])
+        return batch_results
@@ -0,0 +1,181 @@
+import math
+import faiss
+import numpy as np
+
+# Index families FaissVectorStore can run on. "flat" is exact brute force,
+# the others are approximate and trade a little recall for speed.
+INDEX_TYPES = ("flat", "hnsw", "ivf")
+
+# Optional vector codecs. None keeps full float32 vectors; "sq8" stores one byte
+# per dimension (4x smaller); "pq" stores ~dim/8 bytes per vector (~32x smaller).
+COMPRESSIONS = (None, "sq8", "pq")
+
+# Compressed codecs need training data; below this many vectors we stay uncompressed
+MIN_TRAIN_POINTS = 1000
+
+def pq_nbits_for(n: int) -> int:
+    """Bits per PQ code that n training vectors support: 2^nbits centroids, ~39 points each."""
+    return max(4, min(8, int(math.log2(max(n, 39) / 39))))
+
+def _pq_codec(dim: int, n: int, pq_m: int = None) -> str:
+    m = pq_m or max(1, dim // 8)
+    while dim % m:
+        m -= 1
+    return f"PQ{m}x{pq_nbits_for(n)}"
+
+def _codec(compression: str, dim: int, n: int, pq_m: int = None) -> str:
+    if compression is None:
+        return "Flat"
+    if compression == "sq8":
+        return "SQ8"
+    if compression == "pq":
+        return _pq_codec(dim, n, pq_m)
+    raise ValueError(f"Unknown compression: {compression}")
+
+def make_index(index_type: str, dim: int, train_vectors: np.ndarray = None, compression: str = None,
+               hnsw_m: int = 32, nlist: int = None, pq_m: int = None):
+    """
+    Builds an empty (but trained, where needed) FAISS index.
+
+    Args:
+        index_type: One of INDEX_TYPES.
+        dim: Vector dimension.
+        train_vectors: Sample used to train IVF centroids and compressed codecs.
+        compression: One of COMPRESSIONS.
+        hnsw_m: Graph degree for HNSW.
+        nlist: Number of IVF lists. Defaults to ~4*sqrt(n), capped so every list gets training points.
+        pq_m: Number of PQ sub-quantizers (bytes per vector at 8 bits). Defaults to dim // 8.
+    """
+    n = 0 if train_vectors is None else len(train_vectors)
+    if (index_type == "ivf" or compression) and n == 0:
+        raise ValueError(f"{index_type}/{compression} index needs training vectors.")
+    codec = _codec(compression, dim, n, pq_m)
+
+    if index_type == "flat":
+        if compression is None:
+            return faiss.IndexFlatL2(dim)
+        index = faiss.index_factory(dim, codec)
+    elif index_type == "hnsw":
+        index = faiss.index_factory(dim, f"HNSW{hnsw_m},{codec}")
+    elif index_type == "ivf":
+        if nlist is None:
+            nlist = int(4 * math.sqrt(n))
+        # FAISS wants ~39 training points per centroid
+        nlist = max(1, min(nlist, n // 39))
+        index = faiss.index_factory(dim, f"IVF{nlist},{codec}")
+    else:
+        raise ValueError(f"Unknown index type: {index_type}")
+
+    if not index.is_trained:
+        index.train(train_vectors)
+    return index
+
+def unwrap(index):
+    """Returns the index underneath an IDMap wrapper."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        index = faiss.downcast_index(index.index)
+    return index
+
+def has_id_map(index) -> bool:
+    return isinstance(faiss.downcast_index(index), (faiss.IndexIDMap, faiss.IndexIDMap2))
+
+def index_kind(index) -> str:
+    """Maps a loaded FAISS index back to one of INDEX_TYPES."""
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+def index_compression(index) -> str:
+    """Maps a loaded FAISS index back to one of COMPRESSIONS."""
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return "sq8"
+    if isinstance(index, (faiss.IndexPQ, faiss.IndexIVFPQ)):
+        return "pq"
+    return None
+
+def pq_nbits(index) -> int:
+    """Bits per code of a PQ-compressed index (None for other codecs)."""
+    index = unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    return index.pq.nbits if hasattr(index, "pq") else None
+
+def index_nbytes(index) -> int:
+    """
+    Estimated memory of the index, added up from its parts: vector codes (ntotal x
+    code_size), ids, HNSW links, IVF centroids and codec tables. Nothing is copied,
+    unlike serializing the index, which would double a large index's footprint just
+    to measure it. Hash tables and allocator slack aren't counted.
+    """
+    index = faiss.downcast_index(index)
+    nbytes = 0
+    if has_id_map(index):
+        nbytes += index.ntotal * 8
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        hnsw = index.hnsw
+        nbytes += hnsw.neighbors.size() * 4 + hnsw.levels.size() * 4 + hnsw.offsets.size() * 8
+        index = faiss.downcast_index(index.storage)
+    nbytes += index.ntotal * index.code_size
+    if isinstance(index, faiss.IndexIVF):
+        # Inverted lists keep an id next to each code, plus one centroid per list
+        nbytes += index.ntotal * 8 + index.nlist * index.d * 4
+    if hasattr(index, "pq"):
+        nbytes += index.pq.centroids.size() * 4
+    if hasattr(index, "sq"):
+        nbytes += index.sq.trained.size() * 4
+    return nbytes
+
+def mapped_nbytes(index) -> int:
+    """
+    The part of index_nbytes that a read with IO_FLAG_MMAP_IFC leaves in the mapped file:
+    vector codes (flat, SQ, PQ and HNSW storage) and the IVF lists and centroids. The
+    IDMap ids, the HNSW graph (neighbors, levels, offsets) and codec tables are still
+    read into memory; faiss has no mapped form for them.
+    """
+    index = faiss.downcast_index(index)
+    if has_id_map(index):
+        index = faiss.downcast_index(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    nbytes = index.ntotal * index.code_size
+    if isinstance(index, faiss.IndexIVF):
+        nbytes += index.ntotal * 8 + index.nlist * index.d * 4
+    return nbytes
+
+def supports_remove(index) -> bool:
+    """
+    Whether remove_ids on the IDMap-wrapped index is safe. HNSW graphs can't drop vectors
+    in place. IVF can, but keeps its internal positions, while the IDMap wrapper compacts
+    its id list as if they were renumbered, so ids and vectors fall out of step. Only
+    flat codes renumber on removal.
+    """
+    return index_kind(index) == "flat"
+
+def set_search_params(index, nprobe: int = None, ef_search: int = None):
+    """Applies search-time knobs; parameters that don't apply to the index are skipped."""
+    kind = index_kind(index)
+    params = faiss.ParameterSpace()
+    if kind == "ivf" and nprobe:
+        params.set_index_parameter(index, "nprobe", nprobe)
+    if kind == "hnsw" and ef_search:
+        params.set_index_parameter(index, "efSearch", ef_search)
+
+def search_params(index, sel=None, nprobe: int = None, ef_search: int = None):
+    """
+    Per-call search parameters carrying an id selector. Passing parameters overrides the
+    index's own nprobe/efSearch, so the knobs are repeated here.
+    """
+    kind = index_kind(index)
+    if kind == "ivf":
+        return faiss.SearchParametersIVF(sel=sel, nprobe=nprobe or 1)
+    if kind == "hnsw":
+        return faiss.SearchParametersHNSW(sel=sel, efSearch=ef_search or 16)
+    return faiss.SearchParameters(sel=sel)
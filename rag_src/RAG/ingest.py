@@ -0,0 +1,204 @@
+import queue
+import threading
+from collections import namedtuple
+from typing import List, Iterable, Iterator
+from chunk_pool import MIN_POOL_CHARS
+from load_pool import LOADERS, load_each
+
+# One file to (re-)index. file_hash/mtime are passed through to on_file_done for the registry.
+FileJob = namedtuple("FileJob", ["path", "source", "file_hash", "mtime"])
+
+_DONE = object()
+
+def prefetch(items: Iterable, size: int) -> Iterator:
+    """
+    Runs `items` in a background thread, at most `size` results ahead of the consumer.
+    The bounded queue is the backpressure between two stages: a fast producer blocks
+    instead of buffering the whole input. Producer errors are re-raised to the consumer.
+    """
+    q = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+        finally:
+            # Unwinds upstream stages too when the consumer stops early
+            if hasattr(items, "close"):
+                items.close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = q.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+class IngestPipeline:
+    """
+    Streams files into a vector store as load -> chunk -> dedup -> embed -> add, one micro-batch
+    of `batch_size` chunks at a time. Stages run concurrently with bounded queues in
+    between, so memory stays flat regardless of how much is being indexed: at most
+    `queue_size` batches wait between any two stages.
+
+    A file's registry callback (`on_file_done`) only fires once all of its chunks are
+    in the store. A file that fails to load is logged and skipped; any of its chunks
+    already added are dropped again, and its callback never fires, so the next sync
+    retries it.
+
+    Files are parsed in a pool of `load_processes` worker processes (see load_pool) and
+    enter the chunk stage in the order they finish, so a slow PDF doesn't hold up the
+    rest; syncs too small to pay for starting the workers load in-process. None picks a
+    default from the core count; 0 loads in-process, in order.
+
+    Near-duplicates of chunks already indexed or seen earlier in the run are split off
+    before embedding (when the store has dedup on) and stored as links; stats["duplicates"]
+    counts them.
+    """
+    def __init__(self, store, batch_size: int = 256, queue_size: int = 4, on_file_done=None,
+                 load_processes: int = None):
+        self.store = store
+        self.load_processes = load_processes
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.on_file_done = on_file_done
+
+    def run(self, jobs: List[FileJob]) -> dict:
+        stats = {"files": 0, "failed": 0, "documents": 0, "chunks": 0, "duplicates": 0, "batches": 0}
+        if not jobs:
+            return stats
+        self.store.ensure_index_loaded()
+        emb_pipe = self.store.embedding_pipeline()
+        # The run's files replace what was indexed for them, so their old chunks aren't link targets
+        finder = self.store.near_duplicate_filter({job.source for job in jobs})
+
+        events = prefetch(self.load(jobs), self.queue_size)
+        batches = prefetch(self.chunk(events, emb_pipe, stats), self.queue_size)
+        embedded = prefetch(self.embed(self.dedup(batches, finder), emb_pipe), self.queue_size)
+
+        try:
+            with self.store.deferred_merge():
+                self.add(embedded, emb_pipe.model_name, stats)
+        finally:
+            embedded.close()
+
+        print(f"[INFO] Ingested {stats['files']} files ({stats['chunks']} chunks in {stats['batches']} batches, "
+              f"{stats['duplicates']} near-duplicates skipped, {stats['failed']} failed).")
+        return stats
+
+    def add(self, embedded: Iterable, model_name: str, stats: dict):
+        replaced = set()
+        for chunks, duplicates, vectors, markers in embedded:
+            if chunks or duplicates:
+                sources = {c.metadata["source"] for c in chunks + duplicates}
+                # The first batch of a source replaces what was indexed for it before
+                self.store.add_embedded(chunks, vectors, model_name, sources - replaced, duplicates)
+                replaced |= sources
+                stats["chunks"] += len(chunks)
+                stats["duplicates"] += len(duplicates)
+                stats["batches"] += 1
+            for kind, job in markers:
+                if kind == "failed":
+                    stats["failed"] += 1
+                    if job.source in replaced:
+                        self.store.remove_source(job.source)
+                    continue
+                if job.source not in replaced:
+                    # Nothing to index (e.g. empty file); still drop the old vectors
+                    self.store.remove_source(job.source)
+                stats["files"] += 1
+                if self.on_file_done:
+                    self.on_file_done(job)
+
+    def load(self, jobs: List[FileJob]) -> Iterator:
+        """
+        Yields ("doc", job, document) per page/document, then ("end", job), or just ("failed", job).
+        A file's events are contiguous; files come in the order they finish loading.
+        """
+        for job, docs, error in load_each(((job, job.path) for job in jobs), self.load_processes):
+            if error is not None:
+                print(f"[ERROR] {job.source}: {error}")
+                yield ("failed", job)
+                continue
+            for doc in docs:
+                doc.metadata["source"] = job.source
+                yield ("doc", job, doc)
+            yield ("end", job)
+
+    def chunk(self, events: Iterable, emb_pipe, stats: dict) -> Iterator:
+        """
+        Splits documents and yields (chunks, markers) batches of batch_size. Documents are
+        split a group at a time, so big imports reach the chunking worker pool.
+        A file's end marker travels with the batch holding its last chunk (or a later one).
+        """
+        buffer = []
+        markers = []
+        for group in self.group(events):
+            docs = [event[2] for event in group if event[0] == "doc"]
+            stats["documents"] += len(docs)
+            doc_chunks = iter(emb_pipe.split_each(docs))
+            for event in group:
+                kind, job = event[0], event[1]
+                if kind == "doc":
+                    buffer.extend(next(doc_chunks))
+                    while len(buffer) >= self.batch_size:
+                        yield buffer[:self.batch_size], markers
+                        buffer = buffer[self.batch_size:]
+                        markers = []
+                    continue
+                if kind == "failed":
+                    buffer = [c for c in buffer if c.metadata["source"] != job.source]
+                markers.append((kind, job))
+        if buffer or markers:
+            yield buffer, markers
+
+    @staticmethod
+    def group(events: Iterable) -> Iterator[list]:
+        """Collects events until their documents reach MIN_POOL_CHARS, the size worth parallel chunking."""
+        group = []
+        chars = 0
+        for event in events:
+            group.append(event)
+            if event[0] == "doc":
+                chars += len(event[2].page_content)
+                if chars >= MIN_POOL_CHARS:
+                    yield group
+                    group = []
+                    chars = 0
+        if group:
+            yield group
+
+    def dedup(self, batches: Iterable, finder) -> Iterator:
+        """Splits each batch into (unique chunks, near-duplicates, markers)."""
+        for chunks, markers in batches:
+            if finder is None:
+                yield chunks, [], markers
+            else:
+                yield (*finder.split(chunks), markers)
+
+    def embed(self, batches: Iterable, emb_pipe) -> Iterator:
+        for chunks, duplicates, markers in batches:
+            vectors = emb_pipe.embed_chunks(chunks).astype("float32") if chunks else None
+            yield chunks, duplicates, vectors, markers
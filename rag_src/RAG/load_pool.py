@@ -0,0 +1,120 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Any, Iterable, Iterator, Tuple
+from langchain_community.document_loaders import TextLoader
+from pdf_layout import LayoutPDFLoader
+from embedding_pool import PoolRegistry, default_processes, spawn_executor, POOL_IDLE_SECONDS
+
+LOADERS = {".pdf": LayoutPDFLoader, ".txt": TextLoader}
+
+# Each worker imports the PDF stack and holds a parsed file at a time; beyond this the
+# memory costs more than the extra cores save
+MAX_LOAD_PROCESSES = 16
+# Below this many bytes of files per call, loading in-process beats starting the workers:
+# text PDFs parse at about 2 MB/s on one core, and spawning the workers takes about 1 s
+MIN_POOL_BYTES = 8_000_000
+# Files handed out ahead per worker: enough to keep workers busy, few enough that parsed
+# files don't pile up while the embed stage is behind
+FILES_PER_PROCESS = 2
+
+def default_load_processes() -> int:
+    """Loading workers used when none are configured, at most MAX_LOAD_PROCESSES (see default_processes)."""
+    return default_processes(MAX_LOAD_PROCESSES)
+
+def loader_for(path: str):
+    loader_cls = LOADERS.get(os.path.splitext(path)[1].lower())
+    return loader_cls(path) if loader_cls else None
+
+def load_file(path: str) -> List[Any]:
+    """All documents of one file. Runs in the workers, so it has to stay a module-level function."""
+    loader = loader_for(path)
+    if loader is None:
+        raise ValueError("unsupported file type")
+    return list(loader.lazy_load())
+
+def _total_bytes(paths: Iterable[str]) -> int:
+    total = 0
+    for path in paths:
+        try:
+            total += os.path.getsize(path)
+        except OSError:
+            pass # Fails in load_file, on its own
+    return total
+
+
+_pools = PoolRegistry("loading")
+
+def _start_pool(processes: int) -> ProcessPoolExecutor:
+    pool = spawn_executor(processes)
+    print(f"[INFO] Started {processes} loading workers.")
+    return pool
+
+def get_load_pool(processes: int) -> ProcessPoolExecutor:
+    """Returns the process-wide loading pool of this size, starting it on first use."""
+    return _pools.get(processes, lambda: _start_pool(processes))
+
+def load_each(items: Iterable[Tuple[Any, str]], processes: int = None) -> Iterator[Tuple[Any, List[Any], Exception]]:
+    """
+    Loads (key, path) items and yields (key, documents, None) per file, or (key, None, error)
+    when the file can't be loaded, so one bad file never stops the others.
+
+    With more than one worker, files are parsed in worker processes and yielded in the
+    order they finish, at most FILES_PER_PROCESS per worker in flight; the next files are
+    only handed out as the consumer takes results. A file whose worker dies (e.g. the PDF
+    library crashing on it) fails along with the files in flight with it, and the pool is
+    restarted for the rest. The pool is only used for two or more files totalling at least
+    MIN_POOL_BYTES, and stops POOL_IDLE_SECONDS after its last use. processes=None picks
+    default_load_processes(); 0 or 1 loads in-process, in order.
+    """
+    if processes is None:
+        processes = default_load_processes()
+    items = list(items)
+    if len(items) < 2 or _total_bytes(path for _, path in items) < MIN_POOL_BYTES:
+        processes = 0
+    if processes <= 1:
+        for key, path in items:
+            try:
+                yield key, load_file(path), None
+            except Exception as e:
+                yield key, None, e
+        return
+
+    items = iter(items)
+    pending = {}
+    window = processes * FILES_PER_PROCESS
+    _pools.claim(processes)
+    try:
+        while True:
+            pool = get_load_pool(processes)
+            for key, path in items:
+                try:
+                    pending[pool.submit(load_file, path)] = (key, pool)
+                except BrokenProcessPool as e:
+                    # Broke after the last results came in: this file fails, the rest get a new pool
+                    _pools.discard(pool)
+                    yield key, None, e
+                    pool = get_load_pool(processes)
+                    continue
+                if len(pending) >= window:
+                    break
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key, used = pending.pop(future)
+                try:
+                    yield key, future.result(), None
+                except BrokenProcessPool as e:
+                    _pools.discard(used)
+                    yield key, None, e
+                except Exception as e:
+                    yield key, None, e
+    finally:
+        # Closed early (or failed): don't keep parsing files nobody will read
+        for future in pending:
+            future.cancel()
+        _pools.release(processes, POOL_IDLE_SECONDS)
+
+def shutdown_load_pools():
+    _pools.shutdown()
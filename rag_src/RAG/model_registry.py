@@ -0,0 +1,122 @@
+import time
+import threading
+from typing import Callable
+from embedding_backends import OllamaEmbeddingBackend, OnnxEmbeddingBackend, is_ollama_model, is_onnx_model
+
+# Imported on first use: it pulls in PyTorch, which the Ollama and ONNX backends don't need
+SentenceTransformer = None
+
+# Models not used for this many seconds are dropped from memory
+DEFAULT_IDLE_TIMEOUT = 600
+
+class ModelRegistry:
+    """
+    Process-wide cache of embedding models keyed by model name.
+
+    Every store, pipeline and worker asks the registry instead of constructing its
+    own SentenceTransformer, so each model is loaded once per process and the query
+    and ingest paths share the same instance. Models idle for longer than
+    `idle_timeout` seconds are unloaded by a background thread and reloaded on the
+    next request. Callers should fetch the model when they need it rather than
+    keep a reference, otherwise an unloaded model stays alive.
+    """
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT, loader: Callable = None):
+        """
+        Args:
+            idle_timeout: Seconds a model may go unused before it is unloaded. None/0 keeps models forever.
+            loader: Builds a model from its name. Defaults to load_model.
+        """
+        self.idle_timeout = idle_timeout
+        self.loader = loader
+        self.models = {}
+        self.last_used = {}
+        self.lock = threading.Lock()
+        # Per-model locks, so loading one model doesn't block lookups of another
+        self.load_locks = {}
+        self._reaper = None
+        self._stop = threading.Event()
+
+    def get(self, model_name: str):
+        """Returns the shared instance of `model_name`, loading it on first use."""
+        with self.lock:
+            model = self.models.get(model_name)
+            if model is not None:
+                self.last_used[model_name] = time.monotonic()
+                return model
+            load_lock = self.load_locks.setdefault(model_name, threading.Lock())
+
+        with load_lock:
+            with self.lock:
+                model = self.models.get(model_name)
+            if model is None:
+                # Loaded outside the registry lock: this can take seconds
+                model = (self.loader or load_model)(model_name)
+                print(f"[INFO] Loaded embedding model: {model_name}")
+            with self.lock:
+                self.models[model_name] = model
+                self.last_used[model_name] = time.monotonic()
+            self._start_reaper()
+        return model
+
+    def is_loaded(self, model_name: str) -> bool:
+        with self.lock:
+            return model_name in self.models
+
+    def unload(self, model_name: str):
+        with self.lock:
+            if self.models.pop(model_name, None) is not None:
+                print(f"[INFO] Unloaded embedding model: {model_name}")
+            self.last_used.pop(model_name, None)
+
+    def unload_all(self):
+        with self.lock:
+            self.models.clear()
+            self.last_used.clear()
+
+    def unload_idle(self) -> int:
+        """Unloads models unused for longer than idle_timeout. Returns how many were dropped."""
+        if not self.idle_timeout:
+            return 0
+        now = time.monotonic()
+        with self.lock:
+            idle = [name for name, used in self.last_used.items() if now - used >= self.idle_timeout]
+        for name in idle:
+            self.unload(name)
+        return len(idle)
+
+    def set_idle_timeout(self, idle_timeout: float):
+        self.idle_timeout = idle_timeout
+        self._start_reaper()
+
+    def _start_reaper(self):
+        if not self.idle_timeout or (self._reaper and self._reaper.is_alive()):
+            return
+        self._reaper = threading.Thread(target=self._reap, name="model-registry-reaper", daemon=True)
+        self._reaper.start()
+
+    def _reap(self):
+        while self.idle_timeout and not self._stop.wait(min(self.idle_timeout, 60)):
+            self.unload_idle()
+
+
+def load_model(model_name: str):
+    """
+    Ollama-served models ("name:tag") go over HTTP, "onnx/<name>" runs the int8 ONNX
+    export, everything else is a SentenceTransformer.
+    """
+    global SentenceTransformer
+    # ONNX first: "onnx/<path>" may contain a colon (e.g. a Windows drive)
+    if is_onnx_model(model_name):
+        return OnnxEmbeddingBackend(model_name)
+    if is_ollama_model(model_name):
+        return OllamaEmbeddingBackend(model_name)
+    if SentenceTransformer is None:
+        from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+# Shared by the whole process
+registry = ModelRegistry()
+
+def get_model(model_name: str):
+    """Shortcut for registry.get(model_name)."""
+    return registry.get(model_name)
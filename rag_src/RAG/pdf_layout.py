@@ -0,0 +1,174 @@
+import re
+import pymupdf
+from collections import Counter
+from typing import Iterator, List
+from langchain_core.documents import Document
+from langchain_core.document_loaders import BaseLoader
+
+# Headers/footers are looked for in this fraction of the page height at the top and bottom
+MARGIN = 0.1
+# A margin block no larger than the body text is page furniture when its text (digits
+# ignored) repeats on this share of pages. The size check keeps "Chapter 3"-style headings.
+FURNITURE_RATIO = 0.3
+# Short blocks set at least this much larger than the body text are treated as headings
+HEADING_SCALE = 1.15
+HEADING_MAX_CHARS = 200
+
+SENTENCE_END = re.compile(r'[.!?:;"\')\]]\s*$')
+
+def furniture_key(text: str) -> str:
+    """Header/footer text with page numbers and spacing normalized away."""
+    return re.sub(r"\s+", " ", re.sub(r"\d+", "#", text)).strip().lower()
+
+def reading_order(blocks: List[dict], width: float) -> List[dict]:
+    """
+    PyMuPDF blocks sorted for reading. Blocks come back in content-stream order, which
+    needn't follow the page. Blocks that cross the middle of the page (titles, single-column
+    text) are read top to bottom; the two-column stretches between them are read a column
+    at a time, left one first.
+    """
+    mid = width / 2
+    ordered, band = [], []
+
+    def flush_band():
+        ordered.extend(sorted(band, key=lambda b: (b["bbox"][0] >= mid, b["bbox"][1], b["bbox"][0])))
+        band.clear()
+
+    for block in sorted(blocks, key=lambda b: (b["bbox"][1], b["bbox"][0])):
+        x0, _, x1, _ = block["bbox"]
+        if x0 < mid < x1:
+            flush_band()
+            ordered.append(block)
+        else:
+            band.append(block)
+    flush_band()
+    return ordered
+
+def join_lines(lines: List[str]) -> str:
+    """A block's lines as one paragraph, undoing hyphenation at line ends."""
+    text = ""
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        if text.endswith("-") and line[0].islower():
+            text = text[:-1] + line
+        else:
+            text = f"{text} {line}" if text else line
+    return text
+
+class LayoutPDFLoader(BaseLoader):
+    """
+    Loads a PDF from its PyMuPDF text blocks instead of the flattened page text.
+
+    Blocks in the top/bottom margin that repeat across pages (running headers,
+    footers, page numbers) are dropped. Each remaining block becomes a paragraph
+    with its hard line wraps joined, headings get an extra blank line in front
+    (a section break for the chunker), and a paragraph cut by a page break is
+    joined back up. The whole file is one Document; `page_starts` in its metadata
+    maps character offsets back to pages, so every chunk records the page it
+    starts on along with its start/end offsets in this text.
+    """
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+
+    def lazy_load(self) -> Iterator[Document]:
+        with pymupdf.open(self.file_path) as pdf:
+            pages = [self.page_blocks(page) for page in pdf]
+        body_size = self.body_size(pages)
+        furniture = self.furniture(pages, body_size)
+
+        text = ""
+        last = ""
+        page_starts = []
+        dropped = 0
+        for blocks in pages:
+            page_start = None
+            for block in blocks:
+                if self.is_candidate(block, body_size) and furniture_key(block["text"]) in furniture:
+                    dropped += 1
+                    continue
+                heading = block["size"] >= body_size * HEADING_SCALE and len(block["text"]) <= HEADING_MAX_CHARS
+                if not text:
+                    sep = ""
+                elif heading:
+                    sep = "\n\n\n"
+                elif page_start is None and not SENTENCE_END.search(last) and block["text"][0].islower():
+                    # The previous page ended mid-sentence; carry on in the same paragraph
+                    sep = " "
+                else:
+                    sep = "\n\n"
+                text += sep
+                if page_start is None:
+                    page_start = len(text)
+                text += block["text"]
+                # Only the previous block is checked for a sentence end, not all text so far
+                last = block["text"]
+            page_starts.append(len(text) if page_start is None else page_start)
+
+        if dropped:
+            print(f"[INFO] Dropped {dropped} header/footer blocks from {self.file_path}.")
+        if text:
+            yield Document(page_content=text, metadata={"source": self.file_path, "total_pages": len(pages),
+                                                         "page_starts": page_starts})
+
+    @staticmethod
+    def page_blocks(page) -> List[dict]:
+        """
+        Text blocks of a page in reading order (see reading_order), with their font size.
+        MuPDF often puts a running header and the heading under it (or a heading and its
+        paragraph) in one block, so a block is split wherever the font size changes from
+        one line to the next.
+        """
+        height = page.rect.height
+        blocks = []
+
+        def flush(lines, size, y0, y1):
+            text = join_lines(lines)
+            if text:
+                blocks.append({"text": text, "size": size,
+                               "margin": y1 <= height * MARGIN or y0 >= height * (1 - MARGIN)})
+
+        text_blocks = [b for b in page.get_text("dict")["blocks"] if b.get("type") == 0]
+        for block in reading_order(text_blocks, page.rect.width):
+            lines, size, y0, y1 = [], None, None, None
+            for line in block["lines"]:
+                sizes = Counter()
+                for span in line["spans"]:
+                    sizes[round(span["size"], 1)] += len(span["text"].strip())
+                if not sizes or not sum(sizes.values()):
+                    continue
+                line_size = sizes.most_common(1)[0][0]
+                if lines and line_size != size:
+                    flush(lines, size, y0, y1)
+                    lines = []
+                if not lines:
+                    size, y0 = line_size, line["bbox"][1]
+                lines.append("".join(span["text"] for span in line["spans"]))
+                y1 = line["bbox"][3]
+            if lines:
+                flush(lines, size, y0, y1)
+        return blocks
+
+    @staticmethod
+    def is_candidate(block: dict, body_size: float) -> bool:
+        return block["margin"] and block["size"] <= body_size
+
+    def furniture(self, pages: List[List[dict]], body_size: float) -> set:
+        """Normalized texts of margin blocks repeated on enough pages to be headers/footers."""
+        if len(pages) < 2:
+            return set()
+        counts = Counter()
+        for blocks in pages:
+            counts.update({furniture_key(b["text"]) for b in blocks if self.is_candidate(b, body_size)})
+        min_pages = max(2, int(len(pages) * FURNITURE_RATIO))
+        return {key for key, n in counts.items() if n >= min_pages}
+
+    @staticmethod
+    def body_size(pages: List[List[dict]]) -> float:
+        """The font size most of the text is set in."""
+        sizes = Counter()
+        for blocks in pages:
+            for b in blocks:
+                sizes[b["size"]] += len(b["text"])
+        return sizes.most_common(1)[0][0] if sizes else 0.0
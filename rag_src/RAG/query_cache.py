@@ -0,0 +1,61 @@
+import re
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List
+
+class QueryEmbeddingCache:
+    """
+    Bounded LRU of query text -> query vector. Keys are whitespace-normalized, so
+    "what is  RAG? " and "what is RAG?" share an entry; repeated questions in a chat
+    session skip model inference entirely.
+    """
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip()
+
+    def encode(self, model, texts: List[str]) -> np.ndarray:
+        """Returns one float32 vector per text, encoding only the texts not cached yet."""
+        keys = [self.normalize(t) for t in texts]
+        vectors = {}
+        with self.lock:
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    vectors[key] = self.entries[key]
+            self.hits += sum(1 for k in keys if k in vectors)
+            self.misses += sum(1 for k in keys if k not in vectors)
+
+        missing = list(dict.fromkeys(k for k in keys if k not in vectors))
+        if missing:
+            new_vectors = np.asarray(model.encode(missing), dtype="float32")
+            vectors.update(zip(missing, new_vectors))
+            with self.lock:
+                for key, vector in zip(missing, new_vectors):
+                    self.entries[key] = vector
+                    self.entries.move_to_end(key)
+                while len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+        return np.vstack([vectors[k] for k in keys])
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+            }
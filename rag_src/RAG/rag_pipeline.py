@@ -1,14 +1,30 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 from data_loader import DocumentLoader
-from vectorstore import FaissVectorStore
+from sharded_store import open_store
 from db_manager import DBManager
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
+from ingest import IngestPipeline, FileJob, LOADERS
 import requests 
 
 DEPENDENCY_DIR = "project_dependency"
+EMBEDDING_CACHE_FILE = "embedding_cache.db"
+# Files hashed at once during a sync; hashing waits on the disk, so threads are enough
+HASH_THREADS = 8
 
 class RAGPipeline:
-    def __init__(self, project_path):
+    def __init__(self, project_path, sharded=False, shared_cache=False, embed_processes=0, dedup=False):
+        """
+        Args:
+            sharded: Keep one index shard per source file (see ShardedVectorStore).
+                Projects that already have shards stay sharded.
+            shared_cache: Keep the embedding cache in the projects root instead of
+                project_dependency/, so files copied between notebooks are embedded once.
+            embed_processes: Worker processes for embedding large imports. The pool is
+                shared process-wide, so later syncs reuse the warm workers.
+            dedup: Link near-duplicate chunks (e.g. a revised copy of a file) to the chunk
+                they repeat instead of embedding them again. In sharded projects only
+                duplicates within the same source are found.
+        """
         self.project_path = project_path
         
         # 1. Setup Paths (Fast)
@@ -24,7 +40,11 @@ class RAGPipeline:
         
         # Optimization: We pass 'lazy_load=True' (we need to add this support to VectorStore)
         # OR we just initialize the class but don't load vectors until needed.
-        self.store = FaissVectorStore(persist_dir=self.index_dir, lazy=True)
+        # Vectors of unchanged chunks are reused instead of re-embedded
+        cache_dir = os.path.dirname(os.path.abspath(project_path)) if shared_cache else self.dep_path
+        self.cache_path = os.path.join(cache_dir, EMBEDDING_CACHE_FILE)
+        self.store = open_store(self.index_dir, sharded=sharded, lazy=True, cache_path=self.cache_path,
+                                embed_processes=embed_processes, dedup=dedup)
         
         self.ollama_url = "http://localhost:11434/api/chat"
         self.model = "phi3:3.8b" 
@@ -41,10 +61,17 @@ class RAGPipeline:
             if os.path.isdir(full_path): continue
             if os.path.splitext(f)[1] in valid_exts:
                 all_files.append(full_path)
+
+        # Drop vectors of sources that were deleted or renamed since the last sync
+        current_names = {os.path.basename(p) for p in all_files}
+        for filename in self.db.get_registered_files():
+            if filename not in current_names:
+                self.remove_source(filename)
         
-        new_docs = []
+        changed = []
         for file_path in all_files:
             filename = os.path.basename(file_path)
+            if os.path.splitext(filename)[1] not in LOADERS: continue
             
             # Smart Check (Timestamp)
             current_mtime = os.path.getmtime(file_path)
@@ -54,32 +81,58 @@ class RAGPipeline:
                 continue 
 
             print(f"[INDEXING] Scanning: {filename}")
-            current_hash = self.db.calculate_file_hash(file_path)
-            
-            if current_hash != stored_hash:
-                try:
-                    if file_path.endswith(".pdf"): loader = PyPDFLoader(file_path)
-                    elif file_path.endswith(".txt"): loader = TextLoader(file_path)
-                    else: continue
-                    
-                    loaded = loader.load()
-                    for doc in loaded: doc.metadata["source"] = filename
-                    new_docs.extend(loaded)
-                    self.db.update_file_registry(filename, current_hash, current_mtime)
-                except Exception as e:
-                    print(f"[ERROR] {filename}: {e}")
-
-        if new_docs:
-            self.store.add_documents(new_docs)
-            return f"Indexed {len(new_docs)} new documents."
+            changed.append((file_path, filename, stored_hash, current_mtime))
+
+        def file_hash(file_path):
+            try:
+                return self.db.calculate_file_hash(file_path)
+            except OSError as e:
+                # Unreadable (or deleted mid-sync); the next sync tries again
+                print(f"[ERROR] {os.path.basename(file_path)}: {e}")
+                return None
+
+        with ThreadPoolExecutor(max_workers=HASH_THREADS) as pool:
+            hashes = list(pool.map(file_hash, [c[0] for c in changed]))
+
+        jobs = []
+        for (file_path, filename, stored_hash, current_mtime), current_hash in zip(changed, hashes):
+            if current_hash is not None and current_hash != stored_hash:
+                jobs.append(FileJob(file_path, filename, current_hash, current_mtime))
+
+        if not jobs:
+            return "Project up to date."
+
+        # Files are streamed through in micro-batches (re-indexed files replace their previous
+        # vectors); a file is registered only once all of its chunks are in the store.
+        # Files are parsed in worker processes and streamed on as each one finishes.
+        ingest = IngestPipeline(self.store, on_file_done=lambda job: self.db.update_file_registry(
+            job.source, job.file_hash, job.mtime))
+        stats = ingest.run(jobs)
+        if stats["documents"]:
+            skipped = f" ({stats['duplicates']} near-duplicate chunks skipped)" if stats["duplicates"] else ""
+            return f"Indexed {stats['documents']} new documents{skipped}."
         return "Project up to date."
 
-    def answer_query(self, query):
+    def change_embedding_model(self, model_name):
+        """
+        Re-embeds the project with `model_name` in a background thread (returned) and
+        swaps the index when done; queries keep using the current model until then.
+        Progress is available from self.store.migration_status().
+        """
+        return self.store.migrate_model(model_name, background=True)
+
+    def remove_source(self, filename):
+        """Removes a source's vectors and forgets it in the file registry."""
+        self.store.remove_source(filename)
+        self.db.remove_file_registry(filename)
+
+    def answer_query(self, query, sources=None):
+        """Answers from the project's chunks; `sources` limits retrieval to those files."""
         # Ensure index is loaded before query
         self.store.ensure_index_loaded()
         
         self.db.add_chat_message("user", query)
-        results = self.store.query(query, top_k=5)
+        results = self.store.query(query, top_k=5, sources=sources)
         context_text = "\n\n".join([r['metadata'].get('text', '') for r in results])
         
         if not context_text: context_text = "No relevant context found."
@@ -20,7 +20,7 @@ class RAGsearch:
         
         # Load or build vectorstore logic preserved from your snippet
         faiss_path = os.path.join(persist_dir, "faiss.index")
-        meta_path = os.path.join(persist_dir, "metadata.pkl")
+        meta_path = os.path.join(persist_dir, "chunks.db")
         
         if not (os.path.exists(faiss_path) and os.path.exists(meta_path)):
             print(f"[INFO] Index not found at {persist_dir}. Building from data...")
@@ -0,0 +1,413 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+import numpy as np
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any
+from langchain_core.documents import Document
+from chunk_store import ChunkStore
+from embedding_cache import EmbeddingCache
+from query_cache import QueryEmbeddingCache
+from vectorstore import (VectorStoreBase, FaissVectorStore, CONFIG_FILE, NEXT_SUFFIX, OLD_SUFFIX, recover_swap,
+                         MigrationLock, migration_running)
+from dedup import NearDuplicateFilter
+
+SHARD_DIR = "shards"
+# Written once every shard's re-embedded index is saved, and removed when all are swapped
+# in: opening the store finishes a shard swap this file records
+MIGRATION_FILE = "migration.json"
+
+class ShardedVectorStore(VectorStoreBase):
+    """
+    Keeps one FaissVectorStore per source file under `<persist_dir>/shards/`.
+    Re-indexing or deleting a file only touches its own shard, and queries fan
+    out over the shards in a thread pool (FAISS releases the GIL while searching)
+    before a single top-k merge. Exposes the same query/add/remove API as
+    FaissVectorStore; what doesn't depend on the sharding comes from VectorStoreBase.
+    """
+    def __init__(self, persist_dir: str, embedding_model: str = "all-MiniLM-L6-v2", lazy=False,
+                 max_workers: int = None, cache_path: str = None, embed_processes: int = 0,
+                 query_cache_size: int = 256, dedup: bool = False, writable: bool = True, **store_kwargs):
+        """
+        Args:
+            max_workers: Threads used to search shards. Defaults to the CPU count.
+            cache_path: SQLite file of an EmbeddingCache shared by all shards.
+            embed_processes: Worker processes for embedding large ingestion jobs (0 = in-process).
+            query_cache_size: Query texts whose vectors are kept for repeated questions.
+            dedup: Link near-duplicate chunks within a source instead of embedding them again.
+                Off by default. Dedup is per source: links never cross shards, so
+                duplicates across sources are indexed in each source's shard.
+            writable: False opens the store and its shards for searching only (see
+                FaissVectorStore); an unfinished model switch then raises ValueError.
+            store_kwargs: Passed on to every shard's FaissVectorStore.
+        """
+        self.persist_dir = persist_dir
+        self.shard_root = os.path.join(persist_dir, SHARD_DIR)
+        self.config_path = os.path.join(persist_dir, CONFIG_FILE)
+        self.migration_path = os.path.join(persist_dir, MIGRATION_FILE)
+        # As for FaissVectorStore, the recorded model wins; see migrate_model()
+        self.embedding_model = embedding_model
+        self.max_workers = max_workers or os.cpu_count() or 1
+        # Started on the first query and kept for the store's lifetime; its idle threads
+        # exit once the store is garbage collected
+        self.search_pool = None
+        self.store_kwargs = store_kwargs
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.embed_processes = embed_processes
+        self.query_cache = QueryEmbeddingCache(query_cache_size)
+        self.dedup = dedup
+        self.writable = writable
+
+        self.shards = {}
+        self.is_loaded = False
+        # Held by writes and searches, so a model swap happens between them, never during
+        self.lock = threading.RLock()
+        self.migration = None
+
+        if not lazy:
+            self.ensure_index_loaded()
+
+    @staticmethod
+    def shard_name(source: str) -> str:
+        """Directory name of a source's shard (file names aren't always safe paths)."""
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+    def _open_shard(self, path: str) -> FaissVectorStore:
+        shard = FaissVectorStore(path, embedding_model=self.embedding_model, lazy=True,
+                                 embed_processes=self.embed_processes, writable=self.writable, **self.store_kwargs)
+        # Shards share the project's embedding cache, so a migration reuses cached vectors
+        shard.cache = self.cache
+        return shard
+
+    def ensure_index_loaded(self):
+        """Discovers shards on disk. Each shard loads its index on first use."""
+        if self.is_loaded:
+            return
+        # Federated search and the sync worker may open a shared store at the same time
+        with self.lock:
+            if self.is_loaded:
+                return
+            if not self.writable:
+                self._load_config()
+                if os.path.exists(self.migration_path):
+                    raise ValueError(f"{self.persist_dir} has an unfinished model switch; open it writable to finish it.")
+            else:
+                if not os.path.exists(self.shard_root):
+                    os.makedirs(self.shard_root)
+                self._split_monolithic()
+                self._load_config()
+                self._finish_swap()
+
+                for name in os.listdir(self.shard_root):
+                    if name.endswith((NEXT_SUFFIX, OLD_SUFFIX)):
+                        recover_swap(os.path.join(self.shard_root, os.path.splitext(name)[0]))
+
+            names = os.listdir(self.shard_root) if os.path.isdir(self.shard_root) else []
+            for name in sorted(names):
+                path = os.path.join(self.shard_root, name)
+                if not os.path.isdir(path) or "." in name:
+                    continue
+                sources = ChunkStore(path, writable=self.writable).get_sources()
+                if not sources:
+                    if self.writable:
+                        shutil.rmtree(path)
+                    continue
+                self.shards[sources[0]] = self._open_shard(path)
+            print(f"[INFO] Opened {len(self.shards)} index shards.")
+            self.is_loaded = True
+
+    def _finish_swap(self):
+        """Completes a shard swap that was interrupted after its commit point (MIGRATION_FILE)."""
+        if not os.path.exists(self.migration_path) or migration_running(self.persist_dir):
+            return
+        with open(self.migration_path, 'r') as f:
+            state = json.load(f)
+        for name in state["shards"]:
+            path = os.path.join(self.shard_root, name)
+            next_dir, old_dir = path + NEXT_SUFFIX, path + OLD_SUFFIX
+            if os.path.isdir(next_dir):
+                if os.path.isdir(path):
+                    shutil.rmtree(old_dir, ignore_errors=True)
+                    os.replace(path, old_dir)
+                os.replace(next_dir, path)
+            shutil.rmtree(old_dir, ignore_errors=True)
+        self.embedding_model = state["model"]
+        self._save_config()
+        os.remove(self.migration_path)
+        print(f"[INFO] Finished an interrupted switch of {len(state['shards'])} shards to {self.embedding_model}.")
+
+    def _split_monolithic(self):
+        """Moves a single-index project into per-source shards, reusing the stored vectors."""
+        if not any(os.path.exists(os.path.join(self.persist_dir, f)) for f in ("chunks.db", "faiss.index")):
+            return
+        old = FaissVectorStore(self.persist_dir, embedding_model=self.embedding_model)
+        # Shards keep the model the project was indexed with
+        self.embedding_model = old.embedding_model
+        shards = {}
+        for source in old.chunks.get_sources():
+            ids, vectors = old.chunks.get_vectors(old.chunks.ids_for_sources([source]))
+            if vectors is None:
+                continue
+            rows = old.chunks.get_chunks(ids)
+            chunks = [Document(page_content=rows[int(i)]["text"],
+                               metadata={k: v for k, v in rows[int(i)].items() if k != "text"}) for i in ids]
+            shards[source] = self._open_shard(os.path.join(self.shard_root, self.shard_name(source)))
+            shards[source].add_embedded(chunks, vectors, old.embedding_model, [source])
+        # Duplicate links don't carry over; each duplicate is indexed in its own source's
+        # shard with the vector of the chunk it was linked to
+        duplicates = old.chunks.get_duplicates()
+        if duplicates:
+            ids, vectors = old.chunks.get_vectors([row["of_id"] for row in duplicates])
+            by_id = dict(zip(ids.tolist(), vectors)) if vectors is not None else {}
+            by_source = {}
+            for row in duplicates:
+                if row["of_id"] in by_id:
+                    by_source.setdefault(row["source"], []).append(row)
+            for source, rows in by_source.items():
+                chunks = [Document(page_content=row["text"],
+                                   metadata={k: v for k, v in row.items() if k not in ("id", "of_id", "text")})
+                          for row in rows]
+                if source not in shards:
+                    shards[source] = self._open_shard(os.path.join(self.shard_root, self.shard_name(source)))
+                shards[source].add_embedded(chunks, np.vstack([by_id[row["of_id"]] for row in rows]),
+                                           old.embedding_model)
+        for shard in shards.values():
+            shard.save()
+        for f in os.listdir(self.persist_dir):
+            path = os.path.join(self.persist_dir, f)
+            if f != SHARD_DIR and os.path.isfile(path):
+                os.remove(path)
+        print(f"[INFO] Split the project index into per-source shards.")
+
+    def count(self) -> int:
+        self.ensure_index_loaded()
+        return sum(shard.count() for shard in self.shards.values())
+
+    def get_sources(self) -> List[str]:
+        self.ensure_index_loaded()
+        return sorted(self.shards)
+
+    def add_documents(self, documents: List[Any], replace_existing: bool = True):
+        """Chunks and embeds once, then writes each source's chunks to its own shard."""
+        self.ensure_index_loaded()
+        self._check_writable()
+        if not documents: return
+
+        print(f"[INFO] Embedding {len(documents)} documents...")
+        emb_pipe = self.embedding_pipeline()
+        chunks = emb_pipe.chunk_documents(documents)
+        duplicates = []
+        finder = self.near_duplicate_filter()
+        if finder is not None:
+            chunks, duplicates = finder.split(chunks)
+            if duplicates:
+                print(f"[INFO] Skipped {len(duplicates)} near-duplicate chunks.")
+        vector_data = np.array(emb_pipe.embed_chunks(chunks)).astype('float32') if chunks else None
+
+        sources = {d.metadata.get("source", "unknown") for d in documents}
+        self.add_embedded(chunks, vector_data, emb_pipe.model_name, sources if replace_existing else (), duplicates)
+
+    def near_duplicate_filter(self, replace_sources=()) -> NearDuplicateFilter:
+        """
+        Same contract as FaissVectorStore.near_duplicate_filter, but chunks only match
+        chunks of the same source seen by the filter: a link can't point into another shard.
+        """
+        return NearDuplicateFilter(per_source=True) if self.dedup else None
+
+    def add_embedded(self, chunks: List[Any], vector_data: np.ndarray, model_name: str, replace_sources=(), duplicates=()):
+        """
+        Routes already embedded chunks (and duplicates) to their sources' shards, replacing
+        `replace_sources` first. Same `model_name` contract as FaissVectorStore.add_embedded.
+        """
+        self.ensure_index_loaded()
+        self._check_writable()
+        by_source = {source: ([], []) for source in replace_sources}
+        for pos, chunk in enumerate(chunks):
+            by_source.setdefault(chunk.metadata.get("source", "unknown"), ([], []))[0].append(pos)
+        for dup in duplicates:
+            by_source.setdefault(dup.metadata.get("source", "unknown"), ([], []))[1].append(dup)
+
+        with self.lock:
+            for source, (positions, dups) in by_source.items():
+                if not positions and not dups:
+                    self.remove_source(source)
+                    continue
+                shard = self.shards.get(source)
+                if shard is None:
+                    shard = self._open_shard(os.path.join(self.shard_root, self.shard_name(source)))
+                    self.shards[source] = shard
+                vectors = vector_data[positions] if positions else None
+                shard.add_embedded([chunks[p] for p in positions], vectors, model_name,
+                                   [source] if source in replace_sources else (), dups)
+
+    @contextmanager
+    def deferred_merge(self):
+        """Same contract as FaissVectorStore.deferred_merge; shards are per file and stay small."""
+        self.ensure_index_loaded()
+        self._check_writable()
+        yield self
+
+    def remove_source(self, source: str) -> int:
+        """Deletes the source's shard. Returns how many vectors it held."""
+        self.ensure_index_loaded()
+        self._check_writable()
+        with self.lock:
+            shard = self.shards.pop(source, None)
+            if shard is None:
+                return 0
+            removed = shard.count()
+            shutil.rmtree(shard.persist_dir, ignore_errors=True)
+        print(f"[INFO] Removed {removed} vectors for {source}.")
+        return removed
+
+    def save(self):
+        self.ensure_index_loaded()
+        self._check_writable()
+        for shard in self.shards.values():
+            shard.save()
+
+    def migrate_model(self, model_name: str, background: bool = False):
+        """
+        FaissVectorStore.migrate_model() for every shard. All shards are re-embedded first
+        and swapped together, so queries never mix the two models' vectors: if any shard
+        fails to build, none is swapped, and a swap interrupted halfway is finished the
+        next time the store is opened. A second migration while one runs is refused.
+        """
+        self._check_writable()
+        if background:
+            if migration_running(self.persist_dir):
+                print(f"[ERROR] A model migration is already running for {self.persist_dir}.")
+                return None
+            thread = threading.Thread(target=self.migrate_model, args=(model_name,), daemon=True)
+            thread.start()
+            return thread
+
+        self.ensure_index_loaded()
+        if model_name == self.embedding_model:
+            print(f"[INFO] Index already uses {model_name}.")
+            return False
+        claims = [MigrationLock(self.persist_dir)]
+        if not claims[0].acquire():
+            print(f"[ERROR] A model migration is already running for {self.persist_dir}.")
+            return False
+        self.migration = {"model": model_name, "state": "running", "done": 0, "total": self.count()}
+        built = {}
+
+        def build(source, shard):
+            # Each shard's .next is claimed too, so stores opening the shard leave it alone
+            claim = MigrationLock(shard.persist_dir)
+            if not claim.acquire():
+                raise RuntimeError(f"a migration is already running for shard {source}")
+            claims.append(claim)
+            return shard.build_reembedded(model_name, self.migration)
+
+        committed = False
+        try:
+            for source, shard in list(self.shards.items()):
+                try:
+                    built[source] = build(source, shard)
+                except Exception:
+                    if source in self.shards: raise # else it was removed meanwhile
+
+            with self.lock:
+                # Nothing is swapped until every shard's new index is complete and saved
+                for source, shard in self.shards.items():
+                    if source not in built:
+                        # Sources added since the builds started are small; embed them now
+                        built[source] = build(source, shard)
+                    shard.prepare_swap(built[source])
+                for source in [s for s in built if s not in self.shards]:
+                    shutil.rmtree(built.pop(source).persist_dir, ignore_errors=True)
+
+                with open(self.migration_path + ".tmp", 'w') as f:
+                    json.dump({"model": model_name,
+                               "shards": [os.path.basename(shard.persist_dir) for shard in self.shards.values()]}, f)
+                os.replace(self.migration_path + ".tmp", self.migration_path)
+                committed = True
+                try:
+                    for source, shard in self.shards.items():
+                        shard.commit_swap(built.pop(source))
+                    self.embedding_model = model_name
+                    self._save_config()
+                    os.remove(self.migration_path)
+                except Exception:
+                    # Past the commit point: reopening the shards finishes the swap
+                    self.shards = {}
+                    self.is_loaded = False
+                    raise
+                self.query_cache.clear()
+        except Exception as e:
+            if committed:
+                print(f"[ERROR] Switching shards to {model_name} was interrupted; it is finished when the index is next used: {e}")
+            else:
+                print(f"[ERROR] Migration to {model_name} failed, keeping {self.embedding_model}: {e}")
+            self.migration.update(state="failed", error=str(e))
+            return False
+        finally:
+            if not committed:
+                for new in built.values():
+                    shutil.rmtree(new.persist_dir, ignore_errors=True)
+            for claim in claims:
+                claim.release()
+        self.migration["state"] = "done"
+        print(f"[INFO] Switched {len(self.shards)} shards to {model_name}.")
+        return True
+
+    def _search_vectors(self, query_embs: np.ndarray, top_k: int, sources: List[str]) -> List[List[dict]]:
+        names = [s for s in (self.shards if sources is None else sources) if s in self.shards]
+        if not names:
+            return [[] for _ in query_embs]
+
+        def search(name):
+            shard = self.shards[name]
+            if shard.count() == 0:
+                return None
+            return shard._search(query_embs, top_k)
+
+        if len(names) == 1:
+            results = [search(names[0])]
+        else:
+            if self.search_pool is None:
+                self.search_pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="shard-search")
+            results = list(self.search_pool.map(search, names))
+        searched = [(name, r) for name, r in zip(names, results) if r is not None]
+        if not searched:
+            return [[] for _ in query_embs]
+
+        # Top-k merge over all shards; the shard column tells whose chunk store to read
+        D = np.hstack([r[0] for _, r in searched])
+        I = np.hstack([r[1] for _, r in searched])
+        S = np.hstack([np.full(r[1].shape, pos) for pos, (_, r) in enumerate(searched)])
+        order = np.argsort(D, axis=1, kind="stable")[:, :top_k]
+        D, I, S = (np.take_along_axis(a, order, axis=1) for a in (D, I, S))
+
+        hits = {}
+        for pos, (name, _) in enumerate(searched):
+            wanted = {int(i) for i, s in zip(I.ravel(), S.ravel()) if s == pos and i >= 0}
+            if wanted:
+                chunk_rows = self.shards[name].chunks.get_chunks(wanted)
+                hits.update({(pos, i): row for i, row in chunk_rows.items()})
+
+        batch_results = []
+        for ids, dists, shard_pos in zip(I, D, S):
+            results = []
+            for idx, dist, pos in zip(ids, dists, shard_pos):
+                row = hits.get((int(pos), int(idx)))
+                if row is not None:
+                    results.append({"metadata": row, "distance": float(dist)})
+            batch_results.append(results)
+        return batch_results
+
+
+
+def open_store(index_dir: str, sharded: bool = False, **kwargs):
+    """
+    Opens a project's vector index. Projects that already have shards stay sharded,
+    everything else uses a single FaissVectorStore.
+    """
+    if sharded or os.path.isdir(os.path.join(index_dir, SHARD_DIR)):
+        return ShardedVectorStore(persist_dir=index_dir, **kwargs)
+    return FaissVectorStore(persist_dir=index_dir, **kwargs)
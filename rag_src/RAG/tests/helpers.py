@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import patch
+import hashlib
+import os
+import sys
+import tempfile
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from model_registry import registry
+
+
+class FakeSentenceTransformer:
+    """Deterministic stand-in for SentenceTransformer (no model download)."""
+    def __init__(self, model_name, *args, **kwargs):
+        self.model_name = model_name
+
+    def encode(self, texts, **kwargs):
+        vectors = []
+        for text in texts:
+            seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+            vectors.append(np.random.default_rng(seed).random(384))
+        return np.array(vectors, dtype="float32")
+
+    def get_sentence_embedding_dimension(self):
+        return 384
+
+
+class FakeModels(FakeSentenceTransformer):
+    """Stand-in SentenceTransformer whose vectors (and dimension) depend on the model name."""
+    def __init__(self, model_name, *args, **kwargs):
+        super().__init__(model_name)
+        self.dim = 768 if model_name == "wide-model" else 384
+
+    def encode(self, texts, **kwargs):
+        vectors = []
+        for text in texts:
+            seed = int(hashlib.md5((self.model_name + text).encode("utf-8")).hexdigest()[:8], 16)
+            vectors.append(np.random.default_rng(seed).random(self.dim))
+        return np.array(vectors, dtype="float32")
+
+    def get_sentence_embedding_dimension(self):
+        return self.dim
+
+
+def make_docs(source, n=3):
+    return [Document(page_content=f"{source} paragraph {i} " * 20, metadata={"source": source}) for i in range(n)]
+
+
+class StoreTestCase(unittest.TestCase):
+    """
+    Runs each test (setUp included) with `fake_model` in place of SentenceTransformer
+    and a temporary directory; `persist_dir` is a store path inside it.
+    """
+    fake_model = FakeSentenceTransformer
+
+    def setUp(self):
+        patcher = patch('model_registry.SentenceTransformer', self.fake_model)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        # Cleanups run last-in first-out: models are dropped before the patch is undone
+        self.addCleanup(registry.unload_all)
+        self.persist_dir = os.path.join(self.tmp.name, "vector_index")
@@ -1,22 +1,20 @@
 # Nomic Embedding Test
 # Open-Source embedding model 
+# Manual smoke test against a running Ollama: python nomic_embedding_test.py
 
-import requests
+import os
+import sys
 
-# API endpoint and payload
-url = "http://localhost:11434/api/embeddings"
-payload = {
-    "model": "nomic-embed-text",
-    "prompt": "The sky is blue because of Rayleigh scattering"
-}
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-# Send the POST request
-response = requests.post(url, json=payload)
+from embedding_backends import OllamaEmbeddingBackend
 
-# Check if the request was successful and parse the response
-if response.status_code == 200:
-    result = response.json()
-    embedding = result["embedding"]
-    print("Embedding generated:", embedding)
-else:
-    print("Error:", response.status_code, response.text)   
\ No newline at end of file
+if __name__ == "__main__":
+    backend = OllamaEmbeddingBackend("nomic-embed-text:latest")
+    texts = ["The sky is blue because of Rayleigh scattering", "Grass is green because of chlorophyll"]
+    try:
+        embeddings = backend.encode(texts)
+        print("Embeddings generated:", embeddings.shape)
+        print("Dimension:", backend.get_sentence_embedding_dimension())
+    except Exception as e:
+        print("Error:", e)
@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from batching import token_budget_batches, padded_tokens, fixed_batches, token_lengths
+from embedding import EmbeddingPipeline
+from helpers import StoreTestCase, FakeSentenceTransformer
+
+
+class TestTokenBudgetBatches(unittest.TestCase):
+    def test_batches_respect_budget(self):
+        """Every position lands in exactly one batch, and batches stay within the budget."""
+        lengths = [5, 250, 12, 7, 256, 30, 9, 180, 4, 64] * 10
+        batches = token_budget_batches(lengths, token_budget=512)
+        self.assertEqual(sorted(i for b in batches for i in b), list(range(len(lengths))))
+        for batch in batches:
+            self.assertLessEqual(len(batch) * max(lengths[i] for i in batch), 512)
+        self.assertLess(padded_tokens(lengths, batches), padded_tokens(lengths, fixed_batches(len(lengths), 8)))
+
+    def test_oversized_text_gets_own_batch(self):
+        self.assertEqual(token_budget_batches([1000, 3, 3], token_budget=100), [[0], [1, 2]])
+
+    def test_estimate_without_tokenizer(self):
+        self.assertEqual(token_lengths(object(), ["a" * 40, ""]), [12, 2])
+
+
+class TestBucketedEmbedding(StoreTestCase):
+    def test_original_order_is_restored(self):
+        """Bucketed encoding returns the same rows, in the same order, as one encode call."""
+        texts = [("word " * n).strip() for n in (3, 200, 1, 50, 120, 7, 200, 2)]
+        chunks = [Document(page_content=t, metadata={"source": "a.txt"}) for t in texts]
+        pipeline = EmbeddingPipeline(token_budget=300)
+        with patch.object(FakeSentenceTransformer, 'encode', autospec=True,
+                          side_effect=FakeSentenceTransformer.encode) as encode:
+            vectors = pipeline.embed_chunks(chunks)
+            self.assertGreater(encode.call_count, 1)
+        np.testing.assert_array_equal(vectors, FakeSentenceTransformer("m").encode(texts))
+
+    def test_chunk_token_counts_are_reused(self):
+        """Chunks from the chunker are batched by their recorded counts, not tokenized again."""
+        chunks = EmbeddingPipeline(chunk_size=200, chunk_overlap=0).chunk_documents(
+            [Document(page_content="word " * n, metadata={"source": "a.txt"}) for n in (30, 400, 5)])
+        pipeline = EmbeddingPipeline(token_budget=300)
+        with patch('embedding.token_lengths', side_effect=token_lengths) as lengths:
+            vectors = pipeline.embed_chunks(chunks)
+            lengths.assert_not_called()
+            pipeline.embed_chunks([Document(page_content=c.page_content) for c in chunks])
+            lengths.assert_called_once()
+        np.testing.assert_array_equal(vectors, FakeSentenceTransformer("m").encode([c.page_content for c in chunks]))
+
+
+if __name__ == '__main__':
+    unittest.main()
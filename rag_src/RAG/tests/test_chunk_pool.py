@@ -0,0 +1,72 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import chunk_pool
+from chunk_pool import split_each, shutdown_chunk_pools
+from chunker import TokenChunker
+from test_chunker import FakeTokenizerModel, paragraphs
+
+
+class TestChunkWorkerPool(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_chunk_pools()
+
+    def docs(self, n):
+        return [Document(page_content=paragraphs(5 + i % 4), metadata={"source": f"{i % 3}.txt", "page": i})
+                for i in range(n)]
+
+    def test_pool_matches_in_process_chunking(self):
+        """Chunks come back per document, in order, with the documents' metadata."""
+        chunker = TokenChunker(FakeTokenizerModel(), chunk_tokens=40, overlap_tokens=8)
+        docs = self.docs(30)
+        with patch('chunk_pool.MIN_POOL_CHARS', 1000), patch('chunk_pool.TASK_CHARS', 2000):
+            pooled = split_each(chunker, docs, processes=2)
+            self.assertEqual(len(chunk_pool._pools.pools), 1)
+        serial = split_each(chunker, docs, processes=0)
+        self.assertEqual(len(pooled), len(docs))
+        self.assertEqual(pooled, serial)
+        for doc, chunks in zip(docs, pooled):
+            self.assertTrue(chunks)
+            self.assertTrue(all(c.metadata["page"] == doc.metadata["page"] for c in chunks))
+
+    def test_crashed_pool_is_replaced(self):
+        """A dead worker doesn't break later imports: this job is split in-process, the next gets a new pool."""
+        chunker = TokenChunker(FakeTokenizerModel(), chunk_tokens=40, overlap_tokens=8)
+        docs = self.docs(10)
+        with patch('chunk_pool.MIN_POOL_CHARS', 1000):
+            pool = chunk_pool.get_chunk_pool(chunker, 2)
+            split_each(chunker, docs, processes=2)
+            for process in list(pool.executor._processes.values()):
+                process.kill()
+            self.assertEqual(split_each(chunker, docs, processes=2), split_each(chunker, docs, processes=0))
+            self.assertIsNot(chunk_pool.get_chunk_pool(chunker, 2), pool)
+            self.assertEqual(split_each(chunker, docs, processes=2), split_each(chunker, docs, processes=0))
+
+    @patch('chunk_pool.POOL_IDLE_SECONDS', 0.1)
+    def test_idle_pool_is_stopped(self):
+        chunker = TokenChunker(FakeTokenizerModel(), chunk_tokens=40, overlap_tokens=8)
+        key = (chunker.signature(), 2)
+        with patch('chunk_pool.MIN_POOL_CHARS', 1000):
+            split_each(chunker, self.docs(10), processes=2)
+        self.assertIn(key, chunk_pool._pools.pools)
+        chunk_pool._pools.idle_timers[key].join()
+        self.assertNotIn(key, chunk_pool._pools.pools)
+
+    def test_small_jobs_stay_in_process(self):
+        """Below MIN_POOL_CHARS, or with a single document, no workers are started."""
+        chunker = TokenChunker(None, chunk_tokens=20, overlap_tokens=5)
+        with patch('chunk_pool.get_chunk_pool') as get_pool:
+            split_each(chunker, self.docs(5), processes=4)
+            with patch('chunk_pool.MIN_POOL_CHARS', 10):
+                split_each(chunker, self.docs(1), processes=4)
+            get_pool.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
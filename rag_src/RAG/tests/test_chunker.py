@@ -0,0 +1,95 @@
+import unittest
+import os
+import sys
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from chunker import TokenChunker
+
+WORDS = "the index stores vectors for every chunk of each source file in the notebook".split()
+
+
+class FakeTokenizerModel:
+    """Model-like object with a tokenizers.Tokenizer, like the ONNX backend."""
+    def __init__(self, max_seq_length=128, truncate=False):
+        vocab = {w: i for i, w in enumerate(["[UNK]", "[CLS]", "[SEP]", "."] + WORDS)}
+        self.tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="[UNK]"))
+        self.tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+        self.tokenizer.post_processor = processors.BertProcessing(("[SEP]", 2), ("[CLS]", 1))
+        if truncate:
+            self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.max_seq_length = max_seq_length
+
+
+def paragraphs(n, sentences=3):
+    sentence = " ".join(WORDS[:9]) + "."
+    return "\n\n".join(" ".join([sentence] * sentences) for _ in range(n))
+
+
+class TestTokenChunker(unittest.TestCase):
+    def test_chunks_fit_the_model(self):
+        """No chunk exceeds the model's sequence length minus its special tokens."""
+        model = FakeTokenizerModel(max_seq_length=64)
+        chunker = TokenChunker(model, chunk_tokens=1000, overlap_tokens=10)
+        self.assertEqual(chunker.chunk_tokens, 62)
+        for chunk in chunker.split_text(paragraphs(20)):
+            self.assertLessEqual(chunker.count_tokens([chunk])[0], 62)
+
+    def test_breaks_at_paragraphs_and_covers_text(self):
+        """Chunks end on paragraph breaks when one is in reach, overlap, and cover every token."""
+        text = paragraphs(12)
+        chunker = TokenChunker(FakeTokenizerModel(), chunk_tokens=100, overlap_tokens=20)
+        spans = chunker.spans(text)
+        self.assertGreater(len(spans), 3)
+        for start, end in spans[:-1]:
+            self.assertEqual(text[end:end + 2], "\n\n")
+        for (_, prev_end), (start, _) in zip(spans, spans[1:]):
+            self.assertLess(start, prev_end)
+        self.assertEqual((spans[0][0], spans[-1][1]), (0, len(text)))
+
+    def test_dense_windows_are_recut(self):
+        """Text with fewer characters per token than estimated is re-cut to fit, still overlapping."""
+        chunker = TokenChunker(FakeTokenizerModel(), chunk_tokens=50, overlap_tokens=10)
+        text = " ".join(["of the each"] * 300)
+        spans = chunker.spans(text)
+        counts = chunker.count_tokens([text[s:e] for s, e in spans])
+        self.assertLessEqual(max(counts), 50)
+        self.assertGreater(min(counts[:-1]), 25)
+        for (_, prev_end), (start, _) in zip(spans, spans[1:]):
+            self.assertLess(start, prev_end)
+        self.assertEqual((spans[0][0], spans[-1][1]), (0, len(text)))
+
+    def test_chunks_record_their_token_count(self):
+        """Each chunk's metadata holds its token count as the model sees it, recut windows included."""
+        chunker = TokenChunker(FakeTokenizerModel(), chunk_tokens=50, overlap_tokens=10)
+        docs = [Document(page_content=paragraphs(6), metadata={"source": "a.txt"}),
+                Document(page_content=" ".join(["of the each"] * 300), metadata={"source": "b.txt"})]
+        chunks = chunker.split_documents(docs)
+        counts = chunker.count_tokens([chunk.page_content for chunk in chunks])
+        self.assertEqual([chunk.metadata["tokens"] for chunk in chunks], [n + 2 for n in counts])
+
+    def test_model_tokenizer_is_left_alone(self):
+        """The ONNX backend's truncating tokenizer is copied, not truncated or modified."""
+        model = FakeTokenizerModel(max_seq_length=16, truncate=True)
+        chunker = TokenChunker(model, chunk_tokens=14, overlap_tokens=0)
+        text = paragraphs(2)
+        self.assertEqual(chunker.count_tokens([text]), [60])
+        self.assertEqual(len(model.tokenizer.encode(text).ids), 16)
+
+    def test_word_fallback_and_metadata(self):
+        """Without a tokenizer, words stand in for tokens; metadata carries the chunk offset."""
+        chunker = TokenChunker(None, chunk_tokens=20, overlap_tokens=5)
+        doc = Document(page_content=paragraphs(4), metadata={"source": "a.txt"})
+        chunks = chunker.split_documents([doc])
+        self.assertGreater(len(chunks), 1)
+        for chunk in chunks:
+            start = chunk.metadata["start_index"]
+            self.assertEqual(doc.page_content[start:start + len(chunk.page_content)], chunk.page_content)
+            self.assertEqual(chunk.metadata["source"], "a.txt")
+        self.assertEqual(chunker.split_text("  \n\n "), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import sqlite3
+import tempfile
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dedup import minhash, similarity, NearDuplicateFilter, THRESHOLD
+from chunk_store import ChunkStore
+from vectorstore import FaissVectorStore
+from ingest import IngestPipeline, FileJob
+from helpers import StoreTestCase
+
+WORDS = ("retrieval index vector chunk model query answer source notebook page layout token "
+         "embedding search latency memory document paragraph section figure table result").split()
+
+
+def report(seed, paragraphs=6):
+    rng = np.random.default_rng(seed)
+    return "\n\n".join(" ".join(rng.choice(WORDS, size=180)) + "." for _ in range(paragraphs))
+
+
+def revise(text):
+    """A second version of a report: one word changed in every paragraph."""
+    return "\n\n".join(p.replace(" ", " revised ", 1) for p in text.split("\n\n"))
+
+
+class TestMinHash(unittest.TestCase):
+    def test_similarity_separates_versions_from_other_text(self):
+        text = report(0, paragraphs=1)
+        self.assertEqual(similarity(minhash(text), minhash(text)), 1.0)
+        self.assertGreaterEqual(similarity(minhash(text), minhash(revise(text))), THRESHOLD)
+        self.assertLess(similarity(minhash(text), minhash(report(1, paragraphs=1))), 0.2)
+        self.assertEqual(minhash("  ... "), b"")
+
+    def test_filter_links_to_first_copy(self):
+        chunks = [Document(page_content=t, metadata={"source": s})
+                  for t, s in ((report(0, 1), "a"), (report(1, 1), "a"), (revise(report(0, 1)), "b"))]
+        unique, duplicates = NearDuplicateFilter().split(chunks)
+        self.assertEqual(unique, chunks[:2])
+        self.assertEqual(duplicates[0].metadata["duplicate_of"], chunks[0].metadata["minhash"])
+        # Stores sharded by source only match within a source
+        unique, duplicates = NearDuplicateFilter(per_source=True).split(chunks)
+        self.assertEqual((len(unique), len(duplicates)), (3, 0))
+
+
+class TestStoredBands(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = ChunkStore(self.tmp.name)
+        self.texts = [report(seed, 1) for seed in range(3)]
+        self.store.add_chunks([0, 1, 2], [{"text": t, "source": f"{i}.txt"} for i, t in enumerate(self.texts)])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_finds_stored_chunks_by_band(self):
+        copy = minhash(revise(self.texts[1]))
+        self.assertEqual(self.store.find_near_duplicates([copy, minhash(report(9, 1))]), {copy: minhash(self.texts[1])})
+        self.assertEqual(self.store.find_near_duplicates([copy], exclude_sources=["1.txt"]), {})
+        self.store.delete_ids([1])
+        self.assertEqual(self.store.find_near_duplicates([copy]), {})
+
+    def test_bands_are_backfilled_once(self):
+        """Stores from before the band table (or before dedup) get their bands on first lookup."""
+        conn = sqlite3.connect(self.store.db_path)
+        conn.execute("DROP TABLE minhash_bands")
+        conn.execute("DELETE FROM counters WHERE name = 'minhash_bands'")
+        conn.execute("UPDATE chunks SET minhash = NULL WHERE id = 0")
+        conn.commit()
+        conn.close()
+
+        store = ChunkStore(self.tmp.name)
+        copy = minhash(revise(self.texts[0]))
+        self.assertEqual(store.find_near_duplicates([copy]), {copy: minhash(self.texts[0])})
+        with patch("chunk_store.minhash", side_effect=AssertionError("backfilled again")):
+            self.assertEqual(len(store.find_near_duplicates([copy])), 1)
+
+
+class TestNearDuplicateLinks(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.v1 = report(0)
+        self.store = FaissVectorStore(self.persist_dir, index_type="flat", dedup=True)
+        self.store.add_documents([Document(page_content=self.v1, metadata={"source": "v1.txt"}),
+                                  Document(page_content=report(2), metadata={"source": "other.txt"})])
+        self.base = self.store.count()
+
+    def test_second_version_is_linked_not_indexed(self):
+        """A revised copy adds no vectors; hits name it and a source filter still finds it."""
+        self.store.add_documents([Document(page_content=revise(self.v1), metadata={"source": "v2.txt"})])
+        self.assertEqual(self.store.count(), self.base)
+        self.assertGreater(self.store.duplicate_count(), 0)
+
+        question = self.store.chunks.get_chunks(self.store.chunks.ids_for_sources(["v1.txt"]))
+        question = next(iter(question.values()))["text"]
+        hit = self.store.query(question, top_k=1)[0]["metadata"]
+        self.assertEqual((hit["source"], hit["duplicate_sources"]), ("v1.txt", ["v2.txt"]))
+        filtered = self.store.query(question, top_k=3, sources=["v2.txt"])
+        self.assertEqual({r["metadata"]["source"] for r in filtered}, {"v2.txt"})
+        self.assertIn("revised", filtered[0]["metadata"]["text"])
+
+    def test_off_by_default(self):
+        """Without dedup=True a revised copy is embedded and indexed like any other file."""
+        store = FaissVectorStore(os.path.join(self.tmp.name, "plain"), index_type="flat")
+        store.add_documents([Document(page_content=self.v1, metadata={"source": "v1.txt"})])
+        before = store.count()
+        store.add_documents([Document(page_content=revise(self.v1), metadata={"source": "v2.txt"})])
+        self.assertEqual(store.duplicate_count(), 0)
+        self.assertGreater(store.count(), before)
+
+    def test_removing_the_original_promotes_the_copy(self):
+        """Deleting the first version keeps the second one searchable."""
+        self.store.add_documents([Document(page_content=revise(self.v1), metadata={"source": "v2.txt"})])
+        linked = self.store.duplicate_count()
+        self.store.remove_source("v1.txt")
+        self.assertEqual(self.store.duplicate_count(), 0)
+        self.assertEqual(len(self.store.chunks.ids_for_sources(["v2.txt"])), linked)
+        self.assertEqual(self.store.count(), self.base)
+
+        reopened = FaissVectorStore(self.store.persist_dir)
+        results = reopened.query("revised", top_k=3, sources=["v2.txt"])
+        self.assertTrue(results)
+        self.assertTrue(all("duplicate_sources" not in r["metadata"] for r in results))
+
+    def test_ingest_reports_skipped_chunks(self):
+        path = os.path.join(self.tmp.name, "v2.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(revise(self.v1))
+        stats = IngestPipeline(self.store, batch_size=2).run([FileJob(path, "v2.txt", "h", 0.0)])
+        self.assertGreater(stats["duplicates"], 0)
+        self.assertEqual(stats["chunks"], 0)
+        self.assertEqual(self.store.duplicate_count(), stats["duplicates"])
+        # Re-ingesting the same file replaces its links instead of adding more
+        IngestPipeline(self.store, batch_size=2).run([FileJob(path, "v2.txt", "h", 0.0)])
+        self.assertEqual(self.store.duplicate_count(), stats["duplicates"])
+
+
+if __name__ == '__main__':
+    unittest.main()
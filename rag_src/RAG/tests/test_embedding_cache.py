@@ -0,0 +1,59 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from embedding import EmbeddingPipeline
+from embedding_cache import EmbeddingCache
+from helpers import StoreTestCase, FakeSentenceTransformer
+
+
+class TestEmbeddingCache(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = EmbeddingCache(os.path.join(self.tmp.name, "embedding_cache.db"))
+
+    def chunks(self, texts):
+        return [Document(page_content=t, metadata={"source": "a.txt"}) for t in texts]
+
+    def test_only_misses_are_embedded(self):
+        """A re-run embeds only new chunk texts and returns identical vectors."""
+        pipeline = EmbeddingPipeline(cache=self.cache)
+        first = pipeline.embed_chunks(self.chunks(["page one", "page two", "page three"]))
+
+        with patch.object(FakeSentenceTransformer, 'encode', autospec=True,
+                          side_effect=FakeSentenceTransformer.encode) as encode:
+            second = pipeline.embed_chunks(self.chunks(["page one", "page 2 edited", "page three", "page 2 edited"]))
+            self.assertEqual(encode.call_count, 1)
+            self.assertEqual(encode.call_args[0][1], ["page 2 edited"])
+
+        np.testing.assert_array_equal(second[0], first[0])
+        np.testing.assert_array_equal(second[2], first[2])
+        np.testing.assert_array_equal(second[1], second[3])
+        stats = self.cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (2, 5))
+
+    def test_key_includes_model(self):
+        """The same text under another model is a miss."""
+        self.cache.put_many("model-a", ["text"], np.ones((1, 4), dtype="float32"))
+        self.assertIn("text", self.cache.get_many("model-a", ["text"]))
+        self.assertEqual(self.cache.get_many("model-b", ["text"]), {})
+
+    def test_evicts_least_recently_used(self):
+        """Above max_entries the least recently used vectors are dropped."""
+        cache = EmbeddingCache(os.path.join(self.tmp.name, "small.db"), max_entries=2)
+        cache.put_many("m", ["old"], np.ones((1, 4), dtype="float32"))
+        cache.put_many("m", ["kept"], np.ones((1, 4), dtype="float32"))
+        cache.get_many("m", ["old"])
+        cache.put_many("m", ["new"], np.ones((1, 4), dtype="float32"))
+        self.assertEqual(cache.count(), 2)
+        self.assertEqual(set(cache.get_many("m", ["old", "kept", "new"])), {"old", "new"})
+        self.assertEqual(cache.stats()["evictions"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
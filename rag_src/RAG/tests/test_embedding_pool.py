@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import embedding_pool
+from embedding_pool import EmbeddingWorkerPool, get_pool, pool_in_use, shutdown_pools, MIN_POOL_TEXTS
+from embedding import EmbeddingPipeline
+from model_registry import registry
+from helpers import FakeSentenceTransformer
+
+
+def fake_loader(model_name):
+    # Module-level so spawned workers can unpickle it
+    return FakeSentenceTransformer(model_name)
+
+
+class TestEmbeddingWorkerPool(unittest.TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_pools()
+
+    def test_vectors_come_back_in_order(self):
+        """Sharded multi-process encoding matches in-process encoding row for row."""
+        pool = get_pool("fake-model", processes=2, loader=fake_loader)
+        texts = [f"chunk number {i}" for i in range(300)]
+        vectors = pool.encode(texts, shard_size=32)
+        np.testing.assert_array_equal(vectors, FakeSentenceTransformer("fake-model").encode(texts))
+
+    def test_token_batches_come_back_in_order(self):
+        """With a token budget, texts go out in batches of similar length and come back in input order."""
+        pool = get_pool("fake-model", processes=2, loader=fake_loader)
+        texts = [f"chunk number {i} " + "word " * (i % 50) for i in range(300)]
+        lengths = [len(t.split()) + 2 for t in texts]
+        with patch.object(pool.executor, 'map', wraps=pool.executor.map) as mapped:
+            vectors = pool.encode(texts, lengths, token_budget=512)
+        shards = mapped.call_args.args[1]
+        self.assertTrue(all(len(shard) * max(len(t.split()) + 2 for t in shard) <= 512 for shard in shards))
+        np.testing.assert_array_equal(vectors, FakeSentenceTransformer("fake-model").encode(texts))
+
+    @patch('embedding_pool.POOL_IDLE_SECONDS', 0.1)
+    def test_idle_pool_is_stopped(self):
+        with pool_in_use("fake-model", 2):
+            get_pool("fake-model", processes=2, loader=fake_loader).encode(["warm up"])
+        key = ("fake-model", 2)
+        self.assertIn(key, embedding_pool._pools.pools)
+        embedding_pool._pools.idle_timers[key].join()
+        self.assertNotIn(key, embedding_pool._pools.pools)
+
+    def test_pool_is_reused(self):
+        """The same (model, processes) pool is handed out again instead of respawning workers."""
+        pool = get_pool("fake-model", processes=2, loader=fake_loader)
+        self.assertIs(get_pool("fake-model", processes=2, loader=fake_loader), pool)
+        self.assertIsInstance(pool, EmbeddingWorkerPool)
+        self.assertIsNot(get_pool("fake-model", processes=1, loader=fake_loader), pool)
+
+    @patch('model_registry.SentenceTransformer', FakeSentenceTransformer)
+    def test_crashed_pool_is_replaced(self):
+        """A dead worker doesn't break later jobs: this one is encoded in-process, the next gets a new pool."""
+        pool = get_pool("fake-model", processes=2, loader=fake_loader)
+        pool.encode(["warm up"])
+        for process in list(pool.executor._processes.values()):
+            process.kill()
+        texts = [f"chunk number {i}" for i in range(MIN_POOL_TEXTS)]
+        with patch('embedding.get_pool', return_value=pool):
+            vectors = EmbeddingPipeline("fake-model", processes=2)._encode(texts)
+        np.testing.assert_array_equal(vectors, FakeSentenceTransformer("fake-model").encode(texts))
+        fresh = get_pool("fake-model", processes=2, loader=fake_loader)
+        self.assertIsNot(fresh, pool)
+        np.testing.assert_array_equal(fresh.encode(texts[:10]), vectors[:10])
+        registry.unload_all()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ from langchain_core.documents import Document
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from embedding import EmbeddingPipeline
+from model_registry import registry
 class TestEmbeddingPipeline(unittest.TestCase):
     def setUp(self):
         self.pipeline = EmbeddingPipeline(model_name="nomic-embed-text:latest")
@@ -19,19 +20,26 @@ class TestEmbeddingPipeline(unittest.TestCase):
         chunks = self.pipeline.chunk_documents([self.doc])
         self.assertTrue(len(chunks) > 0)
         self.assertIsInstance(chunks[0], Document)
-        # Ensure chunk size limit is respected
-        self.assertTrue(len(chunks[0].page_content) <= self.pipeline.chunk_size)
+        # Ensure chunk size limit (in tokens) is respected and chunks overlap
+        splitter = self.pipeline.splitter()
+        self.assertTrue(len(chunks) > 1)
+        for chunk in chunks:
+            self.assertLessEqual(splitter.count_tokens([chunk.page_content])[0], splitter.chunk_tokens)
+        self.assertLess(chunks[1].metadata["start_index"], chunks[0].metadata["start_index"] + len(chunks[0].page_content))
 
-    @patch('requests.post')
+    def tearDown(self):
+        registry.unload_all()
+
+    @patch('requests.Session.post')
     def test_embed_chunks(self, mock_post):
-        """Test embedding generation with mocked API response."""
-        # Mock successful Ollama response
-        mock_response = MagicMock()
-        mock_response.status_code = 200
+        """Test batched embedding generation with mocked Ollama /api/embed responses."""
         # specific vector size for nomic-embed-text is usually 768
-        dummy_vector = [0.1] * 768 
-        mock_response.json.return_value = {"embedding": dummy_vector}
-        mock_post.return_value = mock_response
+        def embed(url, json=None, **kwargs):
+            mock_response = MagicMock()
+            mock_response.status_code = 200
+            mock_response.json.return_value = {"embeddings": [[0.1] * 768 for _ in json["input"]]}
+            return mock_response
+        mock_post.side_effect = embed
 
         # Create dummy chunks
         chunks = self.pipeline.chunk_documents([self.doc])
@@ -44,8 +52,10 @@ class TestEmbeddingPipeline(unittest.TestCase):
         self.assertEqual(embeddings.shape[0], len(chunks)) # Rows = num chunks
         self.assertEqual(embeddings.shape[1], 768)         # Cols = vector dim
         
-        # Verify API was called correct number of times
-        self.assertEqual(mock_post.call_count, len(chunks))
+        # All chunks fit in one batch, so the API is called once
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertTrue(mock_post.call_args[0][0].endswith("/api/embed"))
+        self.assertEqual(len(mock_post.call_args[1]["json"]["input"]), len(chunks))
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
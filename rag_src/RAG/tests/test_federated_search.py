@@ -0,0 +1,75 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vectorstore import FaissVectorStore
+from sharded_store import ShardedVectorStore
+from federated_search import FederatedSearch
+from helpers import StoreTestCase
+
+
+class TestFederatedSearch(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.root = self.tmp.name
+
+    def make_project(self, name, sources, sharded=False):
+        index_dir = os.path.join(self.root, name, "project_dependency", "vector_index")
+        store = ShardedVectorStore(index_dir) if sharded else FaissVectorStore(index_dir)
+        for source in sources:
+            store.add_documents([Document(page_content=f"{name} {source} note {i} " * 10,
+                                          metadata={"source": source}) for i in range(3)])
+
+    def test_merges_projects_by_distance(self):
+        """Hits from all projects come back in one list sorted by distance."""
+        self.make_project("alpha", ["a.txt"])
+        self.make_project("beta", ["b.txt", "c.txt"], sharded=True)
+        os.makedirs(os.path.join(self.root, "empty"))
+
+        search = FederatedSearch(self.root)
+        self.assertEqual(search.list_projects(), ["alpha", "beta"])
+        question = "beta c.txt note 1 " * 10
+        results = search.query(question, top_k=4)
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]["project"], "beta")
+        self.assertEqual(results[0]["metadata"]["source"], "c.txt")
+        distances = [r["distance"] for r in results]
+        self.assertEqual(distances, sorted(distances))
+
+        only_alpha = search.query(question, top_k=4, projects=["alpha", "missing"])
+        self.assertEqual({r["project"] for r in only_alpha}, {"alpha"})
+        # Projects are opened read-only, so a running ingest's files are left alone
+        self.assertFalse(any(store.writable for store in search.open_stores.values()))
+
+    def test_open_indexes_are_bounded(self):
+        """Opened project indexes are kept in an LRU of size max_open."""
+        for name in ("p1", "p2", "p3"):
+            self.make_project(name, ["x.txt"])
+        search = FederatedSearch(self.root, max_open=2)
+        search.query("x.txt note 0", projects=["p1"])
+        search.query("anything")
+        self.assertEqual(len(search.open_stores), 2)
+        search.query("x.txt note 0", projects=["p1"])
+        self.assertIn("p1", search.open_stores)
+
+
+    def test_concurrent_queries_share_one_load(self):
+        """Parallel questions against a freshly opened project load its index once."""
+        self.make_project("alpha", ["a.txt"])
+        search = FederatedSearch(self.root)
+        question = "alpha a.txt note 1 " * 10
+        with patch('vectorstore.recover_swap', side_effect=lambda _: time.sleep(0.05)):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(lambda _: search.query(question, top_k=5), range(4)))
+        for hits in results:
+            self.assertEqual(len(hits), 3)
+            self.assertEqual(len({h["metadata"]["text"] for h in hits}), 3)
+
+if __name__ == '__main__':
+    unittest.main()
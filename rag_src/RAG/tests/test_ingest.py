@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vectorstore import FaissVectorStore
+from sharded_store import ShardedVectorStore
+from ingest import IngestPipeline, FileJob
+from helpers import StoreTestCase
+
+
+class TestIngestPipeline(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files_dir = os.path.join(self.tmp.name, "files")
+        os.makedirs(self.files_dir)
+
+    def write(self, name, text):
+        path = os.path.join(self.files_dir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return FileJob(path, name, "hash-" + name, os.path.getmtime(path))
+
+    def text(self, name, n=40):
+        return "\n\n".join(f"{name} paragraph {i} " * 12 for i in range(n))
+
+    def test_streams_in_micro_batches(self):
+        """Small batches give the same index as adding everything at once."""
+        jobs = [self.write("a.txt", self.text("a.txt")), self.write("b.txt", self.text("b.txt"))]
+        done = []
+        store = FaissVectorStore(os.path.join(self.tmp.name, "streamed"))
+        stats = IngestPipeline(store, batch_size=8, queue_size=1, on_file_done=done.append,
+                               load_processes=0).run(jobs)
+        self.assertGreater(stats["batches"], 2)
+        self.assertEqual(stats["files"], 2)
+        self.assertEqual([job.source for job in done], ["a.txt", "b.txt"])
+
+        bulk = FaissVectorStore(os.path.join(self.tmp.name, "bulk"))
+        bulk.add_documents([Document(page_content=self.text(n), metadata={"source": n}) for n in ("a.txt", "b.txt")])
+        self.assertEqual(store.count(), bulk.count())
+        self.assertEqual(store.query("b.txt paragraph 7", top_k=3), bulk.query("b.txt paragraph 7", top_k=3))
+
+    def test_reingest_replaces_vectors(self):
+        store = ShardedVectorStore(os.path.join(self.tmp.name, "index"))
+        IngestPipeline(store, batch_size=4).run([self.write("a.txt", self.text("a.txt"))])
+        before = store.count()
+        IngestPipeline(store, batch_size=4).run([self.write("a.txt", self.text("a.txt", n=3))])
+        self.assertLess(store.count(), before)
+        self.assertEqual(store.count(), len(store.embedding_pipeline().chunk_documents(
+            [Document(page_content=self.text("a.txt", n=3), metadata={"source": "a.txt"})])))
+
+    def test_broken_file_is_isolated(self):
+        """A file that fails to load is skipped and never registered; the others still go in."""
+        broken = self.write("broken.pdf", "not a pdf")
+        good = self.write("good.txt", self.text("good.txt", n=5))
+        done = []
+        store = FaissVectorStore(os.path.join(self.tmp.name, "index"))
+        stats = IngestPipeline(store, batch_size=4, on_file_done=done.append).run([broken, good])
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual([job.source for job in done], ["good.txt"])
+        self.assertEqual(store.chunks.get_sources(), ["good.txt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
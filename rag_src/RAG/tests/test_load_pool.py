@@ -0,0 +1,91 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+from concurrent.futures.process import BrokenProcessPool
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import load_pool
+from load_pool import load_each, get_load_pool, shutdown_load_pools
+from vectorstore import FaissVectorStore
+from ingest import IngestPipeline, FileJob
+from helpers import StoreTestCase
+from test_pdf_layout import write_pdf
+
+
+class TestParallelLoading(StoreTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutdown_load_pools()
+
+    def setUp(self):
+        super().setUp()
+        self.paths = []
+        for i in range(4):
+            path = os.path.join(self.tmp.name, f"{i}.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(f"file {i} paragraph {p} " * 12 for p in range(20)))
+            self.paths.append(path)
+        self.paths.append(os.path.join(self.tmp.name, "report.pdf"))
+        write_pdf(self.paths[-1], pages=2)
+        # Not a PDF, so the loader raises
+        self.broken = os.path.join(self.tmp.name, "broken.pdf")
+        with open(self.broken, "wb") as f:
+            f.write(b"not a pdf")
+
+    @patch('load_pool.MIN_POOL_BYTES', 0)
+    def test_pool_matches_in_process_loading(self):
+        """Every file comes back once with the same documents; a bad file fails on its own."""
+        items = [(p, p) for p in self.paths + [self.broken, "notes.docx"]]
+        pooled = {key: (docs, error) for key, docs, error in load_each(items, processes=2)}
+        serial = {key: (docs, error) for key, docs, error in load_each(items, processes=0)}
+        self.assertEqual(set(pooled), set(serial))
+        self.assertEqual(len(pooled), len(items))
+        for key, (docs, error) in pooled.items():
+            if key in (self.broken, "notes.docx"):
+                self.assertIsNone(docs)
+                self.assertIsNotNone(error)
+            else:
+                self.assertIsNone(error)
+                self.assertEqual(docs, serial[key][0])
+
+    def test_small_syncs_load_in_process(self):
+        with patch('load_pool.get_load_pool', side_effect=AssertionError("pool started")):
+            results = list(load_each([(p, p) for p in self.paths], processes=2))
+        self.assertEqual(len(results), len(self.paths))
+
+    @patch('load_pool.MIN_POOL_BYTES', 0)
+    def test_pool_broken_between_files(self):
+        """A pool that broke before a submit fails that file only; the rest load on a new pool."""
+        broken = get_load_pool(2)
+        with self.assertRaises(BrokenProcessPool):
+            broken.submit(os._exit, 1).result()
+        errors = {key: error for key, _, error in load_each([(p, p) for p in self.paths], processes=2)}
+        self.assertIsInstance(errors.pop(self.paths[0]), BrokenProcessPool)
+        self.assertEqual(errors, {p: None for p in self.paths[1:]})
+
+    @patch('load_pool.POOL_IDLE_SECONDS', 0.1)
+    @patch('load_pool.MIN_POOL_BYTES', 0)
+    def test_idle_pool_is_stopped(self):
+        list(load_each([(p, p) for p in self.paths], processes=2))
+        self.assertIn(2, load_pool._pools.pools)
+        load_pool._pools.idle_timers[2].join()
+        self.assertNotIn(2, load_pool._pools.pools)
+        # The next call starts a fresh one
+        self.assertEqual(len(list(load_each([(p, p) for p in self.paths], processes=2))), len(self.paths))
+
+    @patch('load_pool.MIN_POOL_BYTES', 0)
+    def test_ingest_isolates_failed_files(self):
+        store = FaissVectorStore(os.path.join(self.tmp.name, "index"))
+        jobs = [FileJob(p, os.path.basename(p), "h", 0.0) for p in [self.broken] + self.paths]
+        done = []
+        stats = IngestPipeline(store, batch_size=8, on_file_done=done.append, load_processes=2).run(jobs)
+        self.assertEqual((stats["files"], stats["failed"]), (len(self.paths), 1))
+        self.assertEqual({job.source for job in done}, {os.path.basename(p) for p in self.paths})
+        self.assertEqual(store.count(), stats["chunks"])
+        self.assertEqual(store.chunks.ids_for_sources(["broken.pdf"]), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
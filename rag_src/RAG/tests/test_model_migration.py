@@ -0,0 +1,155 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import shutil
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vectorstore import FaissVectorStore, MigrationLock
+from sharded_store import ShardedVectorStore
+from helpers import StoreTestCase, FakeModels, make_docs
+
+
+class TestModelMigration(StoreTestCase):
+    fake_model = FakeModels
+
+    def test_migrate_swaps_model_and_keeps_chunks(self):
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt") + make_docs("b.txt"))
+        store.query("a.txt paragraph 1")
+        ids_before = store.chunks.get_ids()
+
+        self.assertTrue(store.migrate_model("wide-model"))
+        self.assertEqual(store.embedding_model, "wide-model")
+        self.assertEqual(store.index.d, 768)
+        self.assertEqual(store.chunks.get_ids(), ids_before)
+        self.assertEqual(store.query_cache_stats()["size"], 0)
+        self.assertEqual(store.query("b.txt paragraph 2 " * 20, top_k=1)[0]["metadata"]["source"], "b.txt")
+        self.assertEqual(store.migration_status()["state"], "done")
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["vector_index"])
+
+        # The recorded model wins over the constructor default
+        reopened = FaissVectorStore(self.persist_dir)
+        self.assertEqual(reopened.embedding_model, "wide-model")
+        self.assertEqual(reopened.count(), 6)
+
+    def test_changes_during_build_are_caught_up(self):
+        """Chunks added or removed while the new index is built end up in the swapped index."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt") + make_docs("b.txt"))
+        built = store.build_reembedded("wide-model")
+
+        store.add_documents(make_docs("c.txt", n=2))
+        store.remove_source("a.txt")
+        store.swap_in(built)
+        self.assertEqual(store.count(), 5)
+        self.assertEqual(store.chunks.get_sources(), ["b.txt", "c.txt"])
+        self.assertEqual(store.query("c.txt paragraph 1 " * 20, top_k=1)[0]["metadata"]["source"], "c.txt")
+
+        # New chunks never reuse ids that existed before the swap
+        store.add_documents(make_docs("d.txt", n=1))
+        self.assertEqual(len(set(store.chunks.get_ids())), store.count())
+
+    def test_swap_between_embed_and_add(self):
+        """Vectors embedded with the old model before a swap are embedded again, not mixed in."""
+        for sharded in (False, True):
+            persist_dir = os.path.join(self.tmp.name, f"sharded_{sharded}")
+            store = (ShardedVectorStore if sharded else FaissVectorStore)(persist_dir)
+            store.add_documents(make_docs("a.txt"))
+            emb_pipe = store.embedding_pipeline()
+            chunks = emb_pipe.chunk_documents(make_docs("b.txt", n=2))
+            vectors = emb_pipe.embed_chunks(chunks).astype("float32")
+            self.assertTrue(store.migrate_model("wide-model"))
+
+            store.add_embedded(chunks, vectors, emb_pipe.model_name, ["b.txt"])
+            self.assertEqual(store.count(), 5)
+            hit = store.query(chunks[1].page_content, top_k=1)[0]
+            self.assertEqual(hit["metadata"]["text"], chunks[1].page_content)
+            self.assertAlmostEqual(hit["distance"], 0.0, places=3)
+
+    def test_sharded_migration_in_background(self):
+        store = ShardedVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt") + make_docs("b.txt", n=2))
+        store.migrate_model("wide-model", background=True).join()
+
+        self.assertEqual(store.embedding_model, "wide-model")
+        self.assertTrue(all(shard.embedding_model == "wide-model" for shard in store.shards.values()))
+        self.assertEqual(store.query("a.txt paragraph 0 " * 20, top_k=1)[0]["metadata"]["source"], "a.txt")
+        self.assertEqual(len(os.listdir(os.path.join(self.persist_dir, "shards"))), 2)
+        self.assertEqual(ShardedVectorStore(self.persist_dir).embedding_model, "wide-model")
+
+    def test_sharded_migration_is_all_or_nothing(self):
+        """A shard that fails to build or save leaves every shard on the old model."""
+        store = ShardedVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt") + make_docs("b.txt", n=2))
+        for step in ("build_reembedded", "prepare_swap"):
+            with patch.object(store.shards["b.txt"], step, side_effect=RuntimeError("disk full")):
+                self.assertFalse(store.migrate_model("wide-model"))
+            self.assertEqual(store.migration_status()["state"], "failed")
+            self.assertEqual(store.embedding_model, "all-MiniLM-L6-v2")
+            self.assertEqual({shard.index.d for shard in store.shards.values()}, {384})
+            self.assertFalse([f for f in os.listdir(os.path.join(self.persist_dir, "shards")) if "." in f])
+            self.assertEqual(store.query("a.txt paragraph 0 " * 20, top_k=1)[0]["metadata"]["source"], "a.txt")
+
+    def test_interrupted_shard_swap_is_finished(self):
+        """Once every shard is saved, a swap that fails halfway is finished on the next use."""
+        store = ShardedVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt") + make_docs("b.txt", n=2))
+        last = list(store.shards.values())[-1]
+        with patch.object(last, "commit_swap", side_effect=OSError("interrupted")):
+            self.assertFalse(store.migrate_model("wide-model"))
+        self.assertTrue(os.path.exists(os.path.join(self.persist_dir, "migration.json")))
+
+        self.assertEqual(store.query("b.txt paragraph 1 " * 20, top_k=1)[0]["metadata"]["source"], "b.txt")
+        self.assertEqual(store.embedding_model, "wide-model")
+        self.assertEqual({shard.index.d for shard in store.shards.values()}, {768})
+        self.assertFalse(os.path.exists(os.path.join(self.persist_dir, "migration.json")))
+        self.assertEqual(ShardedVectorStore(self.persist_dir).embedding_model, "wide-model")
+
+    def test_interrupted_swap_is_finished_on_open(self):
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        built = store.build_reembedded("wide-model")
+        built.save()
+        # Crash between the two renames
+        os.replace(self.persist_dir, self.persist_dir + ".old")
+
+        reopened = FaissVectorStore(self.persist_dir)
+        self.assertEqual(reopened.embedding_model, "wide-model")
+        self.assertEqual(reopened.count(), 3)
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["vector_index"])
+
+    def test_running_migration_is_left_alone(self):
+        """Opening the same index during a migration keeps its .next; a second migration is refused."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        claim = MigrationLock(self.persist_dir)
+        self.assertTrue(claim.acquire())
+        store.build_reembedded("wide-model")
+
+        FaissVectorStore(self.persist_dir).ensure_index_loaded()
+        self.assertTrue(os.path.isdir(self.persist_dir + ".next"))
+        self.assertFalse(store.migrate_model("wide-model"))
+        self.assertIsNone(store.migrate_model("wide-model", background=True))
+        self.assertEqual(store.embedding_model, "all-MiniLM-L6-v2")
+
+        # Once the migration is gone, its leftovers are cleaned up on open
+        claim.release()
+        FaissVectorStore(self.persist_dir).ensure_index_loaded()
+        self.assertEqual(sorted(os.listdir(self.tmp.name)), ["vector_index"])
+
+    def test_sharded_migration_uses_embedding_cache(self):
+        store = ShardedVectorStore(self.persist_dir, cache_path=os.path.join(self.tmp.name, "cache.db"))
+        docs = make_docs("a.txt") + make_docs("b.txt", n=2)
+        store.add_documents(docs)
+        self.assertTrue(store.migrate_model("wide-model"))
+        texts = [d.page_content.strip() for d in docs]
+        self.assertEqual(len(store.cache.get_many("wide-model", texts)), len(texts))
+        # Migrating back finds every chunk in the cache
+        with patch.object(FakeModels, "encode", side_effect=AssertionError("re-embedded")):
+            self.assertTrue(store.migrate_model("all-MiniLM-L6-v2"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import sys
+import time
+import threading
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from model_registry import ModelRegistry
+
+
+class CountingLoader:
+    """Records how often each model is constructed."""
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, model_name):
+        time.sleep(self.delay)
+        with self.lock:
+            self.calls.append(model_name)
+        return object()
+
+
+class TestModelRegistry(unittest.TestCase):
+    def test_loads_each_model_once(self):
+        """Concurrent callers share one instance per model name."""
+        loader = CountingLoader(delay=0.05)
+        registry = ModelRegistry(idle_timeout=None, loader=loader)
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(registry.get("m"))) for _ in range(8)]
+        for t in threads: t.start()
+        for t in threads: t.join()
+
+        self.assertEqual(loader.calls, ["m"])
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertIsNot(registry.get("other"), results[0])
+
+    def test_idle_models_are_unloaded(self):
+        """Models unused for idle_timeout are dropped and reloaded on the next request."""
+        loader = CountingLoader()
+        registry = ModelRegistry(idle_timeout=0.2, loader=loader)
+        first = registry.get("m")
+        self.assertEqual(registry.unload_idle(), 0)
+
+        deadline = time.monotonic() + 5
+        while registry.is_loaded("m") and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertFalse(registry.is_loaded("m"))
+        self.assertIsNot(registry.get("m"), first)
+        self.assertEqual(loader.calls, ["m", "m"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import pymupdf
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from pdf_layout import LayoutPDFLoader
+from chunker import TokenChunker
+from vectorstore import FaissVectorStore
+from helpers import StoreTestCase
+
+BODY = ("The retrieval index keeps one vector for every chunk of the notebook sources and "
+        "answers each question with the closest chunks it can find in the store.")
+
+
+def write_pdf(path, pages=4):
+    """Pages with a running header, a numbered footer, a heading and wrapped paragraphs."""
+    pdf = pymupdf.open()
+    for n in range(pages):
+        page = pdf.new_page(width=595, height=842)
+        page.insert_text((72, 40), "ACME Quarterly Report", fontsize=9)
+        page.insert_text((72, 60), f"Chapter {n + 1} Overview", fontsize=16)
+        y = 100
+        for p in range(3):
+            words = f"Page {n + 1} paragraph {p}. {BODY}".split()
+            lines = [" ".join(words[i:i + 10]) for i in range(0, len(words), 10)]
+            page.insert_textbox(pymupdf.Rect(72, y, 523, y + 120), "\n".join(lines), fontsize=10)
+            y += 140
+        page.insert_text((280, 820), f"Page {n + 1} of {pages}", fontsize=9)
+    pdf.save(path)
+    pdf.close()
+
+
+class TestLayoutPDFLoader(StoreTestCase):
+    def setUp(self):
+        super().setUp()
+        self.path = os.path.join(self.tmp.name, "report.pdf")
+        write_pdf(self.path)
+
+    def test_drops_page_furniture(self):
+        """Running headers and page-number footers are gone; headings start sections."""
+        doc = LayoutPDFLoader(self.path).load()[0]
+        self.assertNotIn("ACME", doc.page_content)
+        self.assertNotIn("of 4", doc.page_content)
+        self.assertIn("\n\n\nChapter 3 Overview\n\n", doc.page_content)
+        # Wrapped lines are joined back into one paragraph
+        self.assertIn(BODY, doc.page_content)
+        self.assertEqual(doc.metadata["total_pages"], 4)
+
+    def test_joins_sentence_across_page_break(self):
+        """A paragraph cut by a page break continues on the next page; a finished one doesn't."""
+        path = os.path.join(self.tmp.name, "wrapped.pdf")
+        pdf = pymupdf.open()
+        for text in ("The index keeps one vector for every", "chunk of the notebook. All done.", "Next part starts here."):
+            pdf.new_page(width=595, height=842).insert_text((72, 300), text, fontsize=10)
+        pdf.save(path)
+        pdf.close()
+        doc = LayoutPDFLoader(path).load()[0]
+        self.assertEqual(doc.page_content, "The index keeps one vector for every chunk of the notebook. All done.\n\n"
+                                           "Next part starts here.")
+
+    def test_two_columns_read_a_column_at_a_time(self):
+        """Columns are read left then right whatever order the PDF draws them in."""
+        path = os.path.join(self.tmp.name, "columns.pdf")
+        pdf = pymupdf.open()
+        page = pdf.new_page(width=595, height=842)
+        # Drawn out of order: right column, title, left column
+        for y, text in ((100, "Right column first paragraph."), (220, "Right column second paragraph.")):
+            page.insert_textbox(pymupdf.Rect(315, y, 545, y + 100), text, fontsize=10)
+        page.insert_textbox(pymupdf.Rect(50, 60, 545, 90), "A title spanning both columns of the page", fontsize=10)
+        for y, text in ((100, "Left column first paragraph."), (220, "Left column second paragraph.")):
+            page.insert_textbox(pymupdf.Rect(50, y, 280, y + 100), text, fontsize=10)
+        pdf.save(path)
+        pdf.close()
+        doc = LayoutPDFLoader(path).load()[0]
+        self.assertEqual(doc.page_content.split("\n\n"), [
+            "A title spanning both columns of the page",
+            "Left column first paragraph.", "Left column second paragraph.",
+            "Right column first paragraph.", "Right column second paragraph."])
+
+    def test_chunks_record_page_and_offsets(self):
+        """Chunks carry the page they start on and their offsets, also after a trip through the store."""
+        doc = LayoutPDFLoader(self.path).load()[0]
+        chunks = TokenChunker(None, chunk_tokens=60, overlap_tokens=0).split_documents([doc])
+        for chunk in chunks:
+            start, end = chunk.metadata["start_index"], chunk.metadata["end_index"]
+            self.assertEqual(doc.page_content[start:end], chunk.page_content)
+            self.assertIn(f"Page {chunk.metadata['page'] + 1} paragraph", chunk.page_content[:200])
+            self.assertNotIn("page_starts", chunk.metadata)
+
+        store = FaissVectorStore(os.path.join(self.tmp.name, "index"))
+        store.add_documents([doc])
+        last = store.embedding_pipeline().chunk_documents([doc])[-1]
+        hit = store.query(last.page_content, top_k=1)[0]["metadata"]
+        self.assertEqual(hit["page"], last.metadata["page"])
+        self.assertGreater(hit["page"], 0)
+        self.assertEqual((hit["start_index"], hit["end_index"]), (last.metadata["start_index"], len(doc.page_content)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vectorstore import FaissVectorStore
+from sharded_store import ShardedVectorStore
+from helpers import StoreTestCase, FakeSentenceTransformer, make_docs
+
+
+class TestShardedVectorStore(StoreTestCase):
+    def shard_dirs(self):
+        return sorted(os.listdir(os.path.join(self.persist_dir, "shards")))
+
+    def test_one_shard_per_source(self):
+        """Each source gets its own shard; re-indexing one leaves the others untouched."""
+        store = ShardedVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt") + make_docs("b.txt", n=2))
+        self.assertEqual(len(self.shard_dirs()), 2)
+        self.assertEqual(store.count(), 5)
+
+        b_dir = store.shards["b.txt"].persist_dir
+        before = {f: os.path.getmtime(os.path.join(b_dir, f)) for f in os.listdir(b_dir)}
+        store.add_documents(make_docs("a.txt", n=1))
+        after = {f: os.path.getmtime(os.path.join(b_dir, f)) for f in os.listdir(b_dir)}
+        self.assertEqual(before, after)
+        self.assertEqual(store.count(), 3)
+
+        self.assertEqual(store.remove_source("a.txt"), 1)
+        self.assertEqual(len(self.shard_dirs()), 1)
+        self.assertEqual(ShardedVectorStore(self.persist_dir).get_sources(), ["b.txt"])
+
+    def test_scatter_gather_matches_single_index(self):
+        """Merged shard results equal a search over one index with the same chunks."""
+        docs = make_docs("a.txt") + make_docs("b.txt") + make_docs("c.txt")
+        sharded = ShardedVectorStore(self.persist_dir, max_workers=3)
+        sharded.add_documents(docs)
+        single = FaissVectorStore(os.path.join(self.tmp.name, "single"))
+        single.add_documents(docs)
+
+        for question in ("a.txt paragraph 1", "c.txt paragraph 2"):
+            self.assertEqual(sharded.query(question, top_k=4), single.query(question, top_k=4))
+        filtered = sharded.query("a.txt paragraph 1", top_k=4, sources=["b.txt"])
+        self.assertEqual({r["metadata"]["source"] for r in filtered}, {"b.txt"})
+        # Every query fans out on the same threads
+        pool = sharded.search_pool
+        self.assertIsNotNone(pool)
+        sharded.query("b.txt paragraph 0", top_k=4)
+        self.assertIs(sharded.search_pool, pool)
+
+    def test_monolithic_index_is_split(self):
+        """An existing single-index project is split into shards without re-embedding."""
+        single = FaissVectorStore(self.persist_dir)
+        single.add_documents(make_docs("a.txt") + make_docs("b.txt"))
+        expected = single.query("b.txt paragraph 0", top_k=3)
+
+        with patch.object(FakeSentenceTransformer, 'encode', wraps=single.model.encode) as encode:
+            store = ShardedVectorStore(self.persist_dir)
+            self.assertEqual(encode.call_count, 0)
+        self.assertEqual(len(self.shard_dirs()), 2)
+        self.assertFalse(os.path.exists(os.path.join(self.persist_dir, "chunks.db")))
+        self.assertEqual(store.query("b.txt paragraph 0", top_k=3), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
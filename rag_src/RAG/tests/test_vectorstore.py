@@ -0,0 +1,440 @@
+import unittest
+from unittest.mock import patch
+import os
+import sys
+import threading
+import time
+import pickle
+import faiss
+import numpy as np
+from langchain_core.documents import Document
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from vectorstore import FaissVectorStore
+from index_factory import index_kind, index_compression, index_nbytes, make_index, pq_nbits, pq_nbits_for
+from coarse_index import CoarseIndex
+from helpers import StoreTestCase, make_docs
+
+
+class TestFaissVectorStore(StoreTestCase):
+    def test_add_writes_segment_not_base(self):
+        """Adding documents appends a segment instead of rewriting the base index."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        files = os.listdir(self.persist_dir)
+        self.assertNotIn("faiss.index", files)
+        self.assertEqual(len(store.segments), 1)
+
+        reopened = FaissVectorStore(self.persist_dir)
+        self.assertEqual(reopened.count(), store.count())
+        self.assertEqual(reopened.chunks.count(), store.count())
+
+    def test_segments_merge_into_base(self):
+        """Once max_segments is reached the segments are merged into faiss.index."""
+        store = FaissVectorStore(self.persist_dir, max_segments=2)
+        store.add_documents(make_docs("a.txt"))
+        store.add_documents(make_docs("b.txt"))
+        files = os.listdir(self.persist_dir)
+        self.assertIn("faiss.index", files)
+        self.assertFalse([f for f in files if f.startswith("segment_")])
+
+        reopened = FaissVectorStore(self.persist_dir)
+        self.assertEqual(reopened.count(), store.count())
+        first_text = reopened.chunks.get_chunks([0])[0]["text"]
+        results = reopened.query(first_text, top_k=1)
+        self.assertEqual(results[0]["metadata"]["source"], "a.txt")
+
+    def test_crashed_merge_is_not_replayed(self):
+        """Segments left behind by a crash after the merge's commit point aren't replayed."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        segment = os.path.join(self.persist_dir, "segment_000001.npz")
+        with open(segment, "rb") as f:
+            data = f.read()
+        store.save()
+        # Crash after the base state was written: base not renamed, segment not deleted
+        os.replace(store.faiss_path, store._pending_base_path(store.merged_seq))
+        with open(segment, "wb") as f:
+            f.write(data)
+
+        reopened = FaissVectorStore(self.persist_dir)
+        self.assertEqual(reopened.count(), 3)
+        self.assertEqual(reopened.delta.ntotal, 0)
+        self.assertEqual(sorted(os.listdir(self.persist_dir)), ["base_state.json", "chunks.db", "faiss.index", "store_config.json"])
+        results = reopened.query("a.txt paragraph 0", top_k=3)
+        self.assertEqual(len({r["metadata"]["text"] for r in results}), 3)
+        # Later segments continue after the merged seq
+        reopened.add_documents(make_docs("b.txt"))
+        self.assertEqual(reopened.segments, [reopened.merged_seq + 1])
+
+    def test_open_during_merge(self):
+        """A store opened while another one merges leaves its files alone and sees every chunk."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        opened = []
+        write_index, replace = faiss.write_index, os.replace
+
+        def open_after_write(index, path):
+            write_index(index, path)
+            # New base written, not yet committed
+            opened.append(FaissVectorStore(self.persist_dir))
+
+        def open_after_commit(src, dst):
+            replace(src, dst)
+            if dst == store.base_state_path:
+                # Committed, base not yet renamed into place
+                opened.append(FaissVectorStore(self.persist_dir))
+
+        with patch('vectorstore.faiss.write_index', side_effect=open_after_write), \
+                patch('vectorstore.os.replace', side_effect=open_after_commit):
+            store.save()
+        self.assertEqual(len(opened), 2)
+        for other in opened + [store, FaissVectorStore(self.persist_dir)]:
+            self.assertEqual(other.count(), 3)
+        self.assertEqual(sorted(os.listdir(self.persist_dir)), ["base_state.json", "chunks.db", "faiss.index", "store_config.json"])
+
+    def test_read_only_open(self):
+        """A read-only store searches everything without touching the directory, and refuses writes."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        store.save()
+        store.add_documents(make_docs("b.txt"))
+        # A merge mid-way: committed, base not yet renamed, plus a leftover from an older one
+        os.replace(store.faiss_path, store._pending_base_path(store.merged_seq))
+        with open(store._pending_base_path(store.merged_seq - 1), "wb") as f:
+            f.write(b"stale")
+        before = {f: os.path.getmtime(os.path.join(self.persist_dir, f)) for f in os.listdir(self.persist_dir)}
+
+        reader = FaissVectorStore(self.persist_dir, writable=False)
+        self.assertEqual(reader.count(), 6)
+        results = reader.query("b.txt paragraph 0", top_k=6)
+        self.assertEqual({r["metadata"]["source"] for r in results}, {"a.txt", "b.txt"})
+        for write in (lambda: reader.add_documents(make_docs("c.txt")), lambda: reader.remove_source("a.txt"),
+                      reader.save, lambda: reader.migrate_model("other-model")):
+            with self.assertRaises(ValueError):
+                write()
+        after = {f: os.path.getmtime(os.path.join(self.persist_dir, f)) for f in os.listdir(self.persist_dir)}
+        self.assertEqual(after, before)
+
+    def test_merge_waits_for_searches(self):
+        """save() merges under the store lock that searches hold."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        with store.lock:
+            worker = threading.Thread(target=store.save)
+            worker.start()
+            worker.join(0.2)
+            self.assertTrue(worker.is_alive())
+            self.assertEqual((store.index.ntotal, store.delta.ntotal), (0, 3))
+        worker.join()
+        self.assertEqual((store.index.ntotal, store.delta.ntotal), (3, 0))
+
+    def test_legacy_pickle_is_migrated(self):
+        """An old faiss.index + metadata.pkl pair is moved into the chunk store."""
+        os.makedirs(self.persist_dir)
+        index = faiss.IndexFlatL2(384)
+        index.add(np.random.default_rng(0).random((2, 384)).astype('float32'))
+        faiss.write_index(index, os.path.join(self.persist_dir, "faiss.index"))
+        with open(os.path.join(self.persist_dir, "metadata.pkl"), "wb") as f:
+            pickle.dump([{"text": "one", "source": "old.pdf"}, {"text": "two", "source": "old.pdf"}], f)
+
+        store = FaissVectorStore(self.persist_dir)
+        self.assertFalse(os.path.exists(os.path.join(self.persist_dir, "metadata.pkl")))
+        self.assertEqual(store.chunks.get_chunks([1]), {1: {"text": "two", "source": "old.pdf"}})
+        # Legacy positional ids carry over into the IDMap
+        self.assertEqual(store.count(), 2)
+        self.assertEqual(store.remove_source("old.pdf"), 2)
+
+    def test_concurrent_lazy_loads_load_once(self):
+        """Threads opening a lazy store at once replay its segments only once."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt"))
+        lazy = FaissVectorStore(self.persist_dir, lazy=True)
+        with patch('vectorstore.recover_swap', side_effect=lambda _: time.sleep(0.05)) as recover:
+            threads = [threading.Thread(target=lazy.ensure_index_loaded) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(recover.call_count, 1)
+        self.assertEqual(lazy.count(), 3)
+
+    def test_promotes_flat_to_ann(self):
+        """Crossing promote_threshold migrates the flat index to HNSW and keeps recall."""
+        store = FaissVectorStore(self.persist_dir, index_type="hnsw", promote_threshold=10)
+        store.add_documents(make_docs("a.txt", n=6))
+        self.assertEqual(index_kind(store.index), "flat")
+        store.add_documents(make_docs("b.txt", n=6))
+        self.assertEqual(index_kind(store.index), "hnsw")
+
+        reopened = FaissVectorStore(self.persist_dir)
+        self.assertEqual(index_kind(reopened.index), "hnsw")
+        report = reopened.evaluate_recall(top_k=5)
+        self.assertEqual(report["index_type"], "hnsw")
+        self.assertGreaterEqual(report["recall"], 0.9)
+
+    def test_reindexing_source_replaces_vectors(self):
+        """Re-adding a source swaps its vectors instead of appending duplicates."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt", n=3))
+        store.add_documents(make_docs("b.txt", n=2))
+        store.add_documents(make_docs("a.txt", n=1))
+        self.assertEqual(store.count(), 3)
+        self.assertEqual(len(store.chunks.ids_for_sources(["a.txt"])), 1)
+
+        reopened = FaissVectorStore(self.persist_dir)
+        self.assertEqual(reopened.count(), 3)
+
+    def test_remove_source(self):
+        """Removing a source drops its vectors, also from HNSW and IVF indexes."""
+        for index_type in ("flat", "hnsw", "ivf"):
+            persist_dir = os.path.join(self.tmp.name, index_type)
+            store = FaissVectorStore(persist_dir, index_type=index_type, promote_threshold=1)
+            store.add_documents(make_docs("a.txt"))
+            store.add_documents(make_docs("b.txt"))
+            self.assertEqual(index_kind(store.index), index_type)
+            self.assertEqual(store.remove_source("a.txt"), 3)
+            self.assertEqual(store.count(), 3)
+            results = store.query("a.txt paragraph 0", top_k=10)
+            self.assertEqual({r["metadata"]["source"] for r in results}, {"b.txt"})
+
+            reopened = FaissVectorStore(persist_dir)
+            self.assertEqual(reopened.count(), 3)
+
+    def test_ann_removal_keeps_base(self):
+        """A few removals from HNSW/IVF are tombstoned across merges; many trigger one rebuild."""
+        for index_type in ("hnsw", "ivf"):
+            persist_dir = os.path.join(self.tmp.name, index_type)
+            store = FaissVectorStore(persist_dir, index_type=index_type, promote_threshold=1)
+            for name in "abcdefghij":
+                store.add_documents(make_docs(f"{name}.txt", n=2))
+            store.save()
+            self.assertEqual(index_kind(store.index), index_type)
+
+            with patch.object(store, '_rebuild', wraps=store._rebuild) as rebuild:
+                store.remove_source("a.txt")
+                store.save()
+                self.assertEqual(rebuild.call_count, 0)
+            self.assertEqual((store.index.ntotal, len(store.tombstones), store.count()), (20, 2, 18))
+            results = store.query("a.txt paragraph 0", top_k=20)
+            self.assertEqual(len(results), 18)
+            self.assertNotIn("a.txt", {r["metadata"]["source"] for r in results})
+            # Ids still point at their own vectors after the merge
+            text = ("b.txt paragraph 1 " * 20).strip()
+            self.assertEqual(store.query(text, top_k=1)[0]["metadata"]["text"], text)
+
+            reopened = FaissVectorStore(persist_dir, index_type=index_type, promote_threshold=1)
+            self.assertEqual((len(reopened.tombstones), reopened.count()), (2, 18))
+            with patch.object(reopened, '_rebuild', wraps=reopened._rebuild) as rebuild:
+                for name in "bcd":
+                    reopened.remove_source(f"{name}.txt")
+                reopened.save()
+                self.assertEqual(rebuild.call_count, 1)
+            self.assertEqual((reopened.index.ntotal, len(reopened.tombstones)), (12, 0))
+
+    def test_ivf_add_remove_add(self):
+        """On an IVF store, removals from the base and the delta keep every id on its own vector."""
+        store = FaissVectorStore(self.persist_dir, index_type="ivf", promote_threshold=1)
+        for name in "abcdefghij":
+            store.add_documents(make_docs(f"{name}.txt", n=2))
+        store.save()
+        self.assertEqual(index_kind(store.index), "ivf")
+        store.add_documents(make_docs("k.txt", n=2))
+        store.remove_source("k.txt")
+        store.remove_source("a.txt")
+        store.add_documents(make_docs("l.txt", n=2))
+
+        def check(s):
+            self.assertEqual(s.count(), 20)
+            for name in "bjl":
+                text = (f"{name}.txt paragraph 1 " * 20).strip()
+                self.assertEqual(s.query(text, top_k=1)[0]["metadata"]["text"], text)
+            sources = {r["metadata"]["source"] for r in s.query("anything", top_k=30)}
+            self.assertFalse(sources & {"a.txt", "k.txt"})
+
+        check(store)
+        reopened = FaissVectorStore(self.persist_dir, index_type="ivf", promote_threshold=1)
+        check(reopened)
+        reopened.save()
+        check(reopened)
+        check(FaissVectorStore(self.persist_dir, index_type="ivf", promote_threshold=1))
+
+    def test_compressed_mode_reports_savings(self):
+        """SQ8/PQ shrink the index and report the recall they cost."""
+        store = FaissVectorStore(self.persist_dir, index_type="flat")
+        store.add_documents([Document(page_content=f"note {i}", metadata={"source": f"{i % 7}.txt"}) for i in range(1000)])
+        for compression in ("sq8", "pq"):
+            store.set_compression(compression)
+            self.assertEqual(index_compression(store.index), compression)
+            report = store.compression_report(top_k=5, sample_size=20)
+            self.assertGreater(report["saved_bytes"], 0)
+            self.assertTrue(0.0 <= report["recall"] <= 1.0)
+            if compression == "sq8":
+                self.assertGreaterEqual(report["recall"], 0.8)
+
+        # The choice is remembered per project
+        reopened = FaissVectorStore(self.persist_dir, index_type="flat")
+        self.assertEqual(reopened.compression, "pq")
+        self.assertEqual(index_compression(reopened.index), "pq")
+
+    def test_pq_is_retrained_as_the_corpus_grows(self):
+        """PQ codes get more bits once there are enough vectors to train them; the report counts stored vectors."""
+        store = FaissVectorStore(self.persist_dir, index_type="flat", compression="pq")
+        store.add_documents([Document(page_content=f"note {i}", metadata={"source": "a.txt"}) for i in range(1000)])
+        self.assertEqual(pq_nbits(store.index), 4)
+        # Training 5-bit codes is slow, so only the decision to retrain is checked
+        with patch.object(store, '_rebuild') as rebuild:
+            store.add_documents([Document(page_content=f"more {i}", metadata={"source": "b.txt"}) for i in range(200)])
+            rebuild.assert_not_called()
+            store.add_documents([Document(page_content=f"extra {i}", metadata={"source": "c.txt"}) for i in range(100)])
+            rebuild.assert_called_once_with("flat")
+        self.assertEqual((pq_nbits_for(1200), pq_nbits_for(1300)), (4, 5))
+
+        report = store.memory_report()
+        self.assertEqual(report["stored_vector_bytes"], 1300 * 384 * 4)
+        self.assertEqual(report["disk_bytes"], report["index_bytes"] + report["stored_vector_bytes"])
+
+    def test_index_size_is_estimated_without_copying(self):
+        """index_nbytes stays within 2% of the serialized size for every index kind, without serializing."""
+        vectors = np.random.default_rng(0).random((1000, 64), dtype="float32")
+        for index_type in ("flat", "hnsw", "ivf"):
+            for compression in (None, "sq8", "pq"):
+                index = faiss.IndexIDMap2(make_index(index_type, 64, train_vectors=vectors, compression=compression))
+                index.add_with_ids(vectors, np.arange(len(vectors)))
+                serialized = faiss.serialize_index(index).nbytes
+                with patch('faiss.serialize_index') as serialize:
+                    estimate = index_nbytes(index)
+                    serialize.assert_not_called()
+                self.assertAlmostEqual(estimate / serialized, 1.0, delta=0.02, msg=f"{index_type}/{compression}")
+
+    def test_persisted_index_is_memory_mapped(self):
+        """A persisted index opens read-only; later changes go to the delta and merge cleanly."""
+        store = FaissVectorStore(self.persist_dir, max_segments=1)
+        store.add_documents(make_docs("a.txt"))
+
+        reopened = FaissVectorStore(self.persist_dir, max_segments=3)
+        self.assertTrue(reopened.read_only)
+        reopened.add_documents(make_docs("b.txt"))
+        reopened.remove_source("a.txt")
+        self.assertTrue(reopened.read_only)
+        self.assertEqual(reopened.count(), 3)
+        results = reopened.query("a.txt paragraph 0", top_k=10)
+        self.assertEqual({r["metadata"]["source"] for r in results}, {"b.txt"})
+
+        reopened.save()
+        self.assertFalse(reopened.read_only)
+        self.assertEqual(reopened.index.ntotal, 3)
+        self.assertEqual(FaissVectorStore(self.persist_dir).count(), 3)
+
+    def test_memory_report_counts_what_mmap_leaves_resident(self):
+        """A mapped HNSW index keeps its graph and ids in memory; its codes stay in the file."""
+        store = FaissVectorStore(self.persist_dir, index_type="hnsw", promote_threshold=10)
+        store.add_documents(make_docs("a.txt", n=12))
+        self.assertEqual(store.memory_report()["resident_bytes"], store.memory_report()["index_bytes"])
+
+        reopened = FaissVectorStore(self.persist_dir)
+        report = reopened.memory_report()
+        self.assertTrue(reopened.read_only)
+        self.assertEqual(index_kind(reopened.index), "hnsw")
+        codes = reopened.index.ntotal * 384 * 4
+        self.assertEqual(report["resident_bytes"], report["index_bytes"] - codes)
+        self.assertGreater(report["resident_bytes"], reopened.index.ntotal * 8)
+
+    def test_query_batch_matches_single_queries(self):
+        """query_batch returns the same per-query results as repeated query() calls."""
+        store = FaissVectorStore(self.persist_dir)
+        store.add_documents(make_docs("a.txt") + make_docs("b.txt"))
+        questions = ["a.txt paragraph 1", "b.txt paragraph 2", "unrelated"]
+        with patch.object(store.model, 'encode', wraps=store.model.encode) as encode:
+            batch = store.query_batch(questions, top_k=2)
+            self.assertEqual(encode.call_count, 1)
+        self.assertEqual(batch, [store.query(q, top_k=2) for q in questions])
+
+    def test_source_filter_fills_top_k(self):
+        """A source filter returns top_k hits from the selected sources only, on both search paths."""
+        store = FaissVectorStore(self.persist_dir, index_type="hnsw", promote_threshold=10, max_segments=2)
+        for name in ("a.txt", "b.txt", "c.txt", "d.txt"):
+            store.add_documents(make_docs(name, n=4))
+        store.add_documents(make_docs("e.txt", n=2))
+        store.remove_source("d.txt")
+        self.assertEqual(index_kind(store.index), "hnsw")
+
+        for brute_force_max in (4096, 0):
+            with patch('vectorstore.FILTER_BRUTE_FORCE_MAX', brute_force_max):
+                results = store.query("a.txt paragraph 0", top_k=5, sources=["c.txt", "e.txt"])
+                self.assertEqual(len(results), 5)
+                self.assertEqual({r["metadata"]["source"] for r in results}, {"c.txt", "e.txt"})
+                distances = [r["distance"] for r in results]
+                self.assertEqual(distances, sorted(distances))
+                self.assertEqual(store.query("x", sources=["d.txt"]), [])
+
+
+    def test_repeated_queries_skip_the_model(self):
+        """Repeat questions (modulo whitespace) are served from the query LRU."""
+        store = FaissVectorStore(self.persist_dir, query_cache_size=2)
+        store.add_documents(make_docs("a.txt"))
+        first = store.query("what is  in a.txt?")
+        with patch.object(store.model, 'encode', wraps=store.model.encode) as encode:
+            self.assertEqual(store.query(" what is in a.txt? "), first)
+            self.assertEqual(encode.call_count, 0)
+            store.query("second")
+            store.query("third")
+            store.query("what is in a.txt?")
+            self.assertEqual(encode.call_count, 3)
+        stats = store.query_cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["size"]), (1, 4, 2))
+        self.assertAlmostEqual(stats["hit_rate"], 0.2)
+
+    def test_coarse_to_fine_search(self):
+        """The coarse pass finds the exact neighbours and follows later adds and removals."""
+        store = FaissVectorStore(self.persist_dir, index_type="flat")
+        store.add_documents([Document(page_content=f"note {i}", metadata={"source": f"{i % 7}.txt"}) for i in range(1000)])
+        # Stored texts, so the exact nearest neighbour is the chunk itself
+        questions = ["note 3", "note 500", "note 999"]
+        exact = store.query_batch(questions, top_k=5)
+
+        # Below coarse_min_points queries scan the index directly
+        store.set_coarse_search(128)
+        store.query_batch(questions, top_k=5)
+        self.assertIsNone(store.coarse)
+
+        for method in ("pca", "truncate"):
+            store.set_coarse_search(128, method=method, factor=20, min_points=1000)
+            coarse = store.query_batch(questions, top_k=5)
+            self.assertIsNotNone(store.coarse)
+            self.assertEqual([r[0] for r in coarse], [r[0] for r in exact])
+
+        store.add_documents([Document(page_content="late note", metadata={"source": "new.txt"})])
+        self.assertEqual(store.query("late note", top_k=1)[0]["metadata"]["source"], "new.txt")
+        store.remove_source("new.txt")
+        self.assertEqual(store.coarse.ntotal, 1000)
+        self.assertNotEqual(store.query("late note", top_k=1)[0]["metadata"]["source"], "new.txt")
+
+    def test_coarse_index_is_saved(self):
+        """The coarse index and its PCA are reopened from disk, caught up from later segments, and dropped on rebuild."""
+        store = FaissVectorStore(self.persist_dir, index_type="flat", coarse_dim=64, coarse_min_points=1000)
+        store.add_documents([Document(page_content=f"note {i}", metadata={"source": f"{i % 7}.txt"}) for i in range(1000)])
+        store.query("note 3")
+        store.add_documents([Document(page_content="late note", metadata={"source": "new.txt"})])
+
+        with patch.object(CoarseIndex, 'build') as build:
+            reopened = FaissVectorStore(self.persist_dir, index_type="flat", coarse_dim=64, coarse_min_points=1000)
+            self.assertEqual(reopened.coarse.ntotal, 1001)
+            self.assertEqual(reopened.query("late note", top_k=1)[0]["metadata"]["source"], "new.txt")
+            reopened.save()
+            reopened = FaissVectorStore(self.persist_dir, index_type="flat", coarse_dim=64, coarse_min_points=1000)
+            self.assertEqual(reopened.coarse.ntotal, 1001)
+            np.testing.assert_allclose(reopened.coarse.project(np.ones((1, 384))), store.coarse.project(np.ones((1, 384))))
+            build.assert_not_called()
+
+        # Other settings, or a rebuild, retrain it
+        other = FaissVectorStore(self.persist_dir, index_type="flat", coarse_dim=32, coarse_min_points=1000)
+        self.assertIsNone(other.coarse)
+        other.query("note 3")
+        self.assertEqual(other.coarse.coarse_dim, 32)
+        other.rebuild_index("flat")
+        self.assertFalse([f for f in os.listdir(self.persist_dir) if ".coarse." in f])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,25 +1,334 @@
 import os
+import json
+import shutil
+import threading
+import time
 import faiss
 import numpy as np
 import pickle
+from contextlib import contextmanager
 from typing import List, Any
-from sentence_transformers import SentenceTransformer
+from langchain_core.documents import Document
 from embedding import EmbeddingPipeline
+from chunk_store import ChunkStore, chunk_row
+from model_registry import get_model
+from embedding_cache import EmbeddingCache
+from query_cache import QueryEmbeddingCache
+from coarse_index import CoarseIndex, COARSE_MIN_POINTS
+from dedup import NearDuplicateFilter
+from index_factory import (
+    make_index, index_kind, index_compression, index_nbytes, mapped_nbytes, has_id_map, pq_nbits, pq_nbits_for,
+    supports_remove, set_search_params, search_params, MIN_TRAIN_POINTS
+)
 
-class FaissVectorStore:
-    def __init__(self, persist_dir: str, embedding_model: str = "all-MiniLM-L6-v2", lazy=False):
+SEGMENT_PREFIX = "segment_"
+# Sequence number of the last segment merged into faiss.index, and the ids still in it
+# that were removed (see MAX_TOMBSTONE_FRACTION). A merge writes the new base
+# as faiss.index.<seq>.tmp, then this file, then renames the base into place, so the file
+# is the commit point: on open, its pending base is moved into place and every segment
+# up to its seq is already in the base.
+BASE_STATE_FILE = "base_state.json"
+# The coarse index is saved as faiss.index.coarse.<seq> (PCA matrix included), <seq> being
+# the last segment or merge it holds. On open it is caught up from the newer segments; one
+# older than the last merge (whose segments are gone) is dropped and rebuilt on next use.
+COARSE_SUFFIX = ".coarse."
+# Source filters matching at most this many vectors are answered by exact search over
+# their stored vectors; larger ones are pushed into the index search as an id selector
+FILTER_BRUTE_FORCE_MAX = 4096
+# Indexes that can't remove vectors in place (HNSW, IVF) keep removed ids as persisted
+# tombstones that searches skip, and are only rebuilt once this fraction of them is dead
+MAX_TOMBSTONE_FRACTION = 0.2
+# Per-project index settings, persisted next to the index
+CONFIG_FILE = "store_config.json"
+# A model migration builds the re-embedded index in <persist_dir>.next and swaps the
+# directories; <persist_dir>.old only exists for the moment between the two renames
+NEXT_SUFFIX = ".next"
+OLD_SUFFIX = ".old"
+# Chunks re-embedded per batch during a model migration
+REEMBED_BATCH = 512
+# A running migration holds <persist_dir>.next.lock and touches it every MIGRATION_HEARTBEAT
+# seconds. Only a .next whose lock is gone or stale is left over from a migration that died;
+# any other one is being built right now (possibly by another store open on the same dir).
+LOCK_SUFFIX = ".lock"
+MIGRATION_HEARTBEAT = 10
+MIGRATION_STALE = 60
+
+# Lock files held by migrations in this process, kept fresh by one heartbeat thread
+_migrating = set()
+_migrating_lock = threading.Lock()
+_heartbeat = None
+
+def _lock_path(persist_dir: str) -> str:
+    return os.path.abspath(persist_dir) + NEXT_SUFFIX + LOCK_SUFFIX
+
+def _lock_is_fresh(lock_path: str) -> bool:
+    try:
+        return time.time() - os.path.getmtime(lock_path) < MIGRATION_STALE
+    except OSError:
+        return False
+
+def _beat():
+    global _heartbeat
+    while True:
+        time.sleep(MIGRATION_HEARTBEAT)
+        with _migrating_lock:
+            if not _migrating:
+                _heartbeat = None
+                return
+            paths = list(_migrating)
+        for path in paths:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+
+def migration_running(persist_dir: str) -> bool:
+    """Whether a model migration (in any process) is building or swapping this store's index."""
+    lock_path = _lock_path(persist_dir)
+    with _migrating_lock:
+        return lock_path in _migrating or _lock_is_fresh(lock_path)
+
+class MigrationLock:
+    """Claims a store's .next directory for one migration; acquire() fails if it is taken."""
+    def __init__(self, persist_dir: str):
+        self.path = _lock_path(persist_dir)
+
+    def acquire(self) -> bool:
+        global _heartbeat
+        with _migrating_lock:
+            if self.path in _migrating or _lock_is_fresh(self.path):
+                return False
+            with open(self.path, "w") as f:
+                f.write(str(os.getpid()))
+            _migrating.add(self.path)
+            if _heartbeat is None:
+                _heartbeat = threading.Thread(target=_beat, daemon=True)
+                _heartbeat.start()
+        return True
+
+    def release(self):
+        with _migrating_lock:
+            _migrating.discard(self.path)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def _discard(path: str):
+    """Deletes a file that another store open on the same directory may delete first."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def recover_swap(persist_dir: str):
+    """
+    Completes a model swap that was interrupted between its two renames, and drops a
+    half-built index left behind by an interrupted migration. Does nothing while a
+    migration is running, since its .next is live.
+    """
+    if migration_running(persist_dir):
+        return
+    next_dir, old_dir = persist_dir + NEXT_SUFFIX, persist_dir + OLD_SUFFIX
+    if os.path.isdir(old_dir):
+        if not os.path.exists(persist_dir):
+            # .next is complete before the swap starts, so the swap can be finished
+            os.replace(next_dir if os.path.isdir(next_dir) else old_dir, persist_dir)
+            print(f"[INFO] Recovered an interrupted index swap in {persist_dir}.")
+        shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.isdir(next_dir):
+        shutil.rmtree(next_dir, ignore_errors=True)
+
+class VectorStoreBase:
+    """
+    What FaissVectorStore and ShardedVectorStore share: the recorded model, store_config.json,
+    the read-only check and the query entry points. Subclasses set persist_dir, config_path,
+    embedding_model, writable, cache, embed_processes, query_cache, lock and migration, and
+    implement ensure_index_loaded() and _search_vectors().
+    """
+    @property
+    def model(self):
+        """The shared embedding model, fetched from the registry on each use."""
+        return get_model(self.embedding_model)
+
+    def _config(self) -> dict:
+        """What store_config.json records."""
+        return {"embedding_model": self.embedding_model}
+
+    def _apply_config(self, data: dict):
+        """Takes the settings other than the model from a loaded store_config.json."""
+
+    def _load_config(self):
+        if not os.path.exists(self.config_path):
+            if self.writable:
+                self._save_config()
+            return
+        try:
+            with open(self.config_path, 'r') as f:
+                data = json.load(f)
+            self._apply_config(data)
+            stored_model = data.get("embedding_model")
+        except Exception as e:
+            print(f"[ERROR] Could not load store config: {e}")
+            return
+        if stored_model is None:
+            # Written before the model was recorded; it was indexed with the configured one
+            if self.writable:
+                self._save_config()
+        elif stored_model != self.embedding_model:
+            print(f"[INFO] Index was embedded with {stored_model}, using it instead of {self.embedding_model}. "
+                  f"Call migrate_model() to switch.")
+            self.embedding_model = stored_model
+
+    def _save_config(self):
+        if not os.path.exists(self.persist_dir):
+            os.makedirs(self.persist_dir)
+        with open(self.config_path, 'w') as f:
+            json.dump(self._config(), f)
+
+    def _check_writable(self):
+        if not self.writable:
+            raise ValueError(f"{self.persist_dir} is open read-only.")
+
+    def embedding_pipeline(self) -> EmbeddingPipeline:
+        """An EmbeddingPipeline using this store's model, embedding cache and worker pool."""
+        return EmbeddingPipeline(model_name=self.embedding_model, cache=self.cache, processes=self.embed_processes)
+
+    def migration_status(self) -> dict:
+        """Model, state ("running", "done" or "failed") and chunks re-embedded so far."""
+        return dict(self.migration) if self.migration else None
+
+    def query(self, query_text: str, top_k: int = 5, sources: List[str] = None):
+        return self.query_batch([query_text], top_k=top_k, sources=sources)[0]
+
+    def query_batch(self, query_texts: List[str], top_k: int = 5, sources: List[str] = None) -> List[List[dict]]:
+        """
+        Runs several queries with one model call and one search.
+        Returns one result list per query, each shaped like query().
+        With `sources`, only chunks of those sources are searched.
+        """
+        if not query_texts:
+            return []
+        self.ensure_index_loaded()
+        # Encoding and search share the lock, so a model swap can't land in between
+        with self.lock:
+            # Repeated questions are answered from the query cache without running the model
+            query_embs = self.query_cache.encode(self.model, query_texts)
+            return self.search_vectors(query_embs, top_k=top_k, sources=sources)
+
+    def query_cache_stats(self) -> dict:
+        """Hit rate and size of the query embedding cache."""
+        return self.query_cache.stats()
+
+    def search_vectors(self, query_embs: np.ndarray, top_k: int = 5, sources: List[str] = None) -> List[List[dict]]:
+        """query_batch() for queries that are already embedded with this store's model."""
+        self.ensure_index_loaded()
+        with self.lock:
+            return self._search_vectors(query_embs, top_k, sources)
+
+class FaissVectorStore(VectorStoreBase):
+    def __init__(self, persist_dir: str, embedding_model: str = "all-MiniLM-L6-v2", lazy=False, max_segments: int = 8,
+                 index_type: str = "hnsw", promote_threshold: int = 50000, nprobe: int = 16, ef_search: int = 64,
+                 compression: str = None, rescore: bool = True, rescore_factor: int = 4,
+                 mmap: bool = True, max_delta: int = 20000, cache_path: str = None, embed_processes: int = 0,
+                 query_cache_size: int = 256, coarse_dim: int = None, coarse_method: str = "pca",
+                 coarse_factor: int = 10, coarse_min_points: int = COARSE_MIN_POINTS, dedup: bool = False,
+                 writable: bool = True):
+        """
+        Args:
+            max_segments: Pending segments that trigger a merge into faiss.index.
+            index_type: ANN index ("hnsw" or "ivf") the project migrates to once it outgrows
+                brute force. "flat" keeps exact search forever.
+            promote_threshold: Vector count at which a flat index is rebuilt as `index_type`.
+            nprobe: IVF lists visited per query.
+            ef_search: HNSW candidate list size per query.
+            compression: Default vector codec for new projects (None, "sq8" or "pq").
+                A project's own choice (see set_compression) is kept in store_config.json.
+            rescore: Re-rank a compressed shortlist with the full-precision vectors.
+            rescore_factor: Shortlist size as a multiple of top_k when rescoring.
+            mmap: Memory-map the persisted index read-only instead of reading it into memory.
+                Vector codes and IVF lists are mapped; an HNSW graph is still read in full.
+            max_delta: Unmerged vectors that trigger a merge into faiss.index.
+            cache_path: SQLite file of an EmbeddingCache, so unchanged chunks aren't re-embedded.
+            embed_processes: Worker processes for embedding large ingestion jobs (0 = in-process).
+            query_cache_size: Query texts whose vectors are kept for repeated questions.
+            coarse_dim: Enables coarse-to-fine search: a first pass over `coarse_dim`-dimensional
+                copies of the vectors, re-ranked with the full vectors. None searches the index.
+            coarse_method: "pca" or "truncate" (for Matryoshka-trained models).
+            coarse_factor: Coarse shortlist size as a multiple of top_k.
+            coarse_min_points: Live vectors below which queries skip the coarse pass and
+                search the index directly.
+            dedup: Link near-duplicate chunks to the indexed chunk they repeat instead of
+                embedding and indexing them again (see near_duplicate_filter). Off by default.
+            writable: False opens the store for searching only: nothing on disk is created,
+                finished, cleaned up or rewritten, so it is safe next to a store that is
+                writing the same directory (e.g. a running ingest). Writes raise ValueError.
+        """
         self.persist_dir = persist_dir
-        self.embedding_model = embedding_model
-        
+        self.writable = writable
+
         self.faiss_path = os.path.join(self.persist_dir, "faiss.index")
+        self.config_path = os.path.join(self.persist_dir, CONFIG_FILE)
+        self.base_state_path = os.path.join(self.persist_dir, BASE_STATE_FILE)
+        # Legacy pickled metadata, imported into the chunk store on first load
         self.meta_path = os.path.join(self.persist_dir, "metadata.pkl")
-        
+
+        # Base index as of the last merge, with vectors stored under stable ids (IDMap).
+        # When loaded from disk it is memory-mapped read-only, so changes since the last
+        # merge live in a small in-memory `delta` index plus a set of removed base ids.
         self.index = None
-        self.metadata = []
-        self.model = SentenceTransformer(embedding_model)
-        
+        self.delta = None
+        self.delta_ids = set()
+        self.tombstones = set()
+        self.mmap = mmap
+        self.read_only = False
+        # Chunk text lives on disk keyed by vector id; only the top-k rows are read per query
+        self.chunks = None
+        # The embedding model comes from the process-wide registry (see `model`), so
+        # opening a store doesn't load it and every store shares one instance
+        # The model a project was indexed with is recorded in store_config.json and wins
+        # over this argument; changing it goes through migrate_model()
+        self.embedding_model = embedding_model
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.embed_processes = embed_processes
+        self.query_cache = QueryEmbeddingCache(query_cache_size)
+        self.dedup = dedup
+        # Held by writes, merges and searches, so a model swap or a merge happens between
+        # them, never during. Reentrant: writes that trigger a merge take it again in save()
+        self.lock = threading.RLock()
+        # Progress of a running/finished migrate_model() job
+        self.migration = None
+
+        # Append-only persistence: every change writes a small segment (added ids/vectors and
+        # removed ids) next to the base index. Segments are merged into the base once there
+        # are `max_segments` of them (or `max_delta` unmerged vectors), so write cost scales
+        # with the delta.
+        self.max_segments = max_segments
+        self.max_delta = max_delta
+        self.segments = []
+        self.merged_seq = 0
+        # Set by deferred_merge() while a long ingest is running
+        self.defer_merge = False
+
+        self.index_type = index_type
+        self.promote_threshold = promote_threshold
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+
+        self.compression = compression
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+
+        # Built from the stored vectors on first use (or loaded, see COARSE_SUFFIX), then
+        # kept in step with every change
+        self.coarse = None
+        self.coarse_dim = coarse_dim
+        self.coarse_method = coarse_method
+        self.coarse_factor = coarse_factor
+        self.coarse_min_points = coarse_min_points
+
         self.is_loaded = False
-        
+
         # If NOT lazy, load immediately (old behavior)
         # If lazy, we wait.
         if not lazy:
@@ -29,55 +338,842 @@ class FaissVectorStore:
         """Loads index from disk if not already loaded."""
         if self.is_loaded:
             return
+        # The UI and the sync worker both open stores lazily; only one of them may load
+        # (a second load would replay the segments into the delta twice)
+        with self.lock:
+            if self.is_loaded:
+                return
+            if self.writable:
+                recover_swap(self.persist_dir)
+            self.chunks = ChunkStore(self.persist_dir, writable=self.writable)
+            self._load_config()
+            base_tombstones, base_path = self._load_base_state()
+            if os.path.exists(base_path):
+                print(f"[INFO] Loading FAISS index from disk...")
+                if self.mmap:
+                    # Pages are read on demand by the OS; the index can't be modified in place.
+                    # Only codes and IVF lists are mapped, an HNSW graph is read in full
+                    self.index = faiss.read_index(base_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+                    self.read_only = True
+                else:
+                    self.index = faiss.read_index(base_path)
+                print(f"[INFO] Loaded {self.index.ntotal} vectors.")
+            else:
+                print(f"[INFO] Initializing new FAISS index.")
+                # Sized for the configured model (384 for all-MiniLM-L6-v2, 768 for nomic-embed-text)
+                self.index = faiss.IndexIDMap2(make_index("flat", self.model.get_sentence_embedding_dimension()))
+            self._reset_delta()
+            self.tombstones.update(base_tombstones)
 
-        if os.path.exists(self.faiss_path) and os.path.exists(self.meta_path):
-            print(f"[INFO] Loading FAISS index from disk...")
-            self.index = faiss.read_index(self.faiss_path)
-            with open(self.meta_path, "rb") as f:
-                self.metadata = pickle.load(f)
-            print(f"[INFO] Loaded {self.index.ntotal} vectors.")
-        else:
-            print(f"[INFO] Initializing new FAISS index.")
-            self.index = faiss.IndexFlatL2(384)
-            self.metadata = []
-        
-        self.is_loaded = True
+            if not self.writable and (os.path.exists(self.meta_path) or not has_id_map(self.index)):
+                raise ValueError(f"{self.persist_dir} is in an old format; open it writable once to upgrade it.")
+            self._import_legacy_metadata()
+            if not has_id_map(self.index):
+                # Indexes written before stable ids: positions were the ids
+                self._backfill_vectors()
+                self._rebuild(index_kind(self.index))
+
+            self._replay_segments()
+            set_search_params(self.index, nprobe=self.nprobe, ef_search=self.ef_search)
+            self.is_loaded = True
 
-    def add_documents(self, documents: List[Any]):
+    def _reset_delta(self):
+        # Flat whatever the base is: removals from the delta go through remove_ids, which
+        # only keeps an IDMap2's ids in step with flat codes (see supports_remove)
+        self.delta = faiss.IndexIDMap2(make_index("flat", self.index.d))
+        self.delta_ids = set()
+        self.tombstones = set()
+
+    def _config(self) -> dict:
+        return {"compression": self.compression, "rescore": self.rescore, "embedding_model": self.embedding_model}
+
+    def _apply_config(self, data: dict):
+        self.compression = data.get("compression", self.compression)
+        self.rescore = data.get("rescore", self.rescore)
+
+    def _load_base_state(self):
+        """
+        Reads the merged seq and finishes a merge that crashed after its commit point.
+        Returns the base's tombstones and the path to read the base from (a read-only
+        store reads a committed base that hasn't been renamed into place where it is).
+        """
+        self.merged_seq = 0
+        tombstones = []
+        if os.path.exists(self.base_state_path):
+            with open(self.base_state_path, 'r') as f:
+                state = json.load(f)
+            self.merged_seq = state["merged_seq"]
+            tombstones = state.get("tombstones", [])
+        committed = self._pending_base_path(self.merged_seq)
+        if not self.writable:
+            return tombstones, committed if os.path.exists(committed) else self.faiss_path
+        if os.path.exists(committed):
+            try:
+                os.replace(committed, self.faiss_path)
+                print(f"[INFO] Finished an interrupted index merge in {self.persist_dir}.")
+            except FileNotFoundError:
+                # The store that is merging renamed it itself
+                pass
+        if os.path.isdir(self.persist_dir):
+            # Files of merges that crashed before their commit point. Only those older than
+            # the committed seq: a newer one may be a merge that another store open on this
+            # directory is writing right now.
+            prefix = os.path.basename(self.faiss_path) + "."
+            for f in os.listdir(self.persist_dir):
+                if not (f.startswith(prefix) and f.endswith(".tmp")):
+                    continue
+                seq = f[len(prefix):-len(".tmp")].rsplit(".", 1)[-1]
+                if seq.isdigit() and int(seq) < self.merged_seq:
+                    _discard(os.path.join(self.persist_dir, f))
+        return tombstones, self.faiss_path
+
+    def _pending_base_path(self, seq: int) -> str:
+        return f"{self.faiss_path}.{seq}.tmp"
+
+    def _import_legacy_metadata(self):
+        """Moves the old pickled metadata list into the chunk store and deletes the pickle."""
+        if not os.path.exists(self.meta_path):
+            return
+        with open(self.meta_path, "rb") as f:
+            legacy = pickle.load(f)
+        self.chunks.add_chunks(range(len(legacy)), legacy)
+        os.remove(self.meta_path)
+        print(f"[INFO] Migrated {len(legacy)} chunks from metadata.pkl.")
+
+    def _backfill_vectors(self):
+        """Copies vectors of chunks stored before the chunk store kept them out of the flat index."""
+        missing = self.chunks.missing_vector_ids()
+        if not missing or index_kind(self.index) != "flat":
+            return
+        missing = [i for i in missing if i < self.index.ntotal]
+        if missing:
+            self.chunks.set_vectors(missing, np.vstack([self.index.reconstruct(i) for i in missing]))
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.persist_dir, f"{SEGMENT_PREFIX}{seq:06d}.npz")
+
+    def _list_segments(self) -> List[int]:
+        """Sequence numbers of committed segments on disk, oldest first."""
+        if not os.path.isdir(self.persist_dir):
+            return []
+        seqs = []
+        for f in os.listdir(self.persist_dir):
+            # Segments are renamed into place once fully written
+            if f.startswith(SEGMENT_PREFIX) and f.endswith(".npz"):
+                seqs.append(int(f[len(SEGMENT_PREFIX):-len(".npz")]))
+        return sorted(seqs)
+
+    def _replay_segments(self):
+        """Rebuilds the in-memory delta (and catches up a saved coarse index) from segments written since the last merge."""
+        self.segments = []
+        coarse, coarse_seq = self._load_coarse()
+        for seq in self._list_segments():
+            if seq <= self.merged_seq:
+                # Merged into the base by a merge that crashed before deleting its segments,
+                # or that another open store is finishing right now
+                if self.writable:
+                    _discard(self._segment_path(seq))
+                continue
+            # A coarse index saved after this segment already holds it
+            self.coarse = coarse if seq > coarse_seq else None
+            with np.load(self._segment_path(seq)) as seg:
+                self._apply_delta(seg["ids"], seg["vectors"], seg["removed"])
+            self.segments.append(seq)
+        self.coarse = coarse
+        if self.segments:
+            print(f"[INFO] Replayed {len(self.segments)} index segments.")
+
+    def _coarse_path(self, seq: int) -> str:
+        return f"{self.faiss_path}{COARSE_SUFFIX}{seq}"
+
+    def _list_coarse(self) -> List[int]:
+        """Seqs of saved coarse indexes, newest first."""
+        if not os.path.isdir(self.persist_dir):
+            return []
+        prefix = os.path.basename(self.faiss_path) + COARSE_SUFFIX
+        return sorted((int(f[len(prefix):]) for f in os.listdir(self.persist_dir)
+                       if f.startswith(prefix) and f[len(prefix):].isdigit()), reverse=True)
+
+    def _load_coarse(self):
+        """
+        The saved coarse index and the seq it holds changes up to, or (None, 0). Files
+        older than the last merge are deleted; newer ones built with other coarse settings
+        are skipped (another open store may use them) and replaced by the next merge.
+        """
+        coarse, coarse_seq = None, 0
+        for seq in self._list_coarse():
+            path = self._coarse_path(seq)
+            if seq < self.merged_seq:
+                if self.writable:
+                    _discard(path)
+            elif coarse is None and self.coarse_dim:
+                loaded = CoarseIndex.load(path, self.index.d)
+                wanted = CoarseIndex(self.index.d, self.coarse_dim, self.coarse_method)
+                if (loaded.dim, loaded.coarse_dim, loaded.method) == (wanted.dim, wanted.coarse_dim, wanted.method):
+                    coarse, coarse_seq = loaded, seq
+        return coarse, coarse_seq
+
+    def _save_coarse(self, seq: int):
+        """Saves the coarse index as holding every change up to seq, and deletes older ones."""
+        if not self.writable:
+            return
+        if self.coarse is not None:
+            self.coarse.save(self._coarse_path(seq))
+        for old in self._list_coarse():
+            if self.coarse is None or old != seq:
+                _discard(self._coarse_path(old))
+
+    def _apply_delta(self, ids: np.ndarray, vectors: np.ndarray, removed_ids: np.ndarray):
+        """Records adds in the delta index and removals as delta deletes or base tombstones."""
+        if removed_ids.size:
+            in_delta = [int(i) for i in removed_ids if int(i) in self.delta_ids]
+            if in_delta:
+                self.delta.remove_ids(np.array(in_delta, dtype='int64'))
+                self.delta_ids.difference_update(in_delta)
+            self.tombstones.update(int(i) for i in removed_ids if int(i) not in in_delta)
+        if ids.size:
+            self.delta.add_with_ids(vectors, ids)
+            self.delta_ids.update(int(i) for i in ids)
+        if self.coarse is not None:
+            self.coarse.remove(removed_ids)
+            self.coarse.add(ids, vectors)
+
+    def count(self) -> int:
+        """Number of live vectors (base minus removed, plus unmerged additions)."""
         self.ensure_index_loaded()
+        return self.index.ntotal - len(self.tombstones) + self.delta.ntotal
+
+    def add_documents(self, documents: List[Any], replace_existing: bool = True):
+        """
+        Chunks, embeds and indexes documents. With replace_existing, vectors previously
+        indexed for the same sources are removed in the same operation.
+        """
+        self.ensure_index_loaded()
+        self._check_writable()
         if not documents: return
 
         print(f"[INFO] Embedding {len(documents)} documents...")
-        emb_pipe = EmbeddingPipeline(model_name=self.embedding_model)
+        emb_pipe = self.embedding_pipeline()
         chunks = emb_pipe.chunk_documents(documents)
-        if not chunks: return
+        sources = {d.metadata.get("source", "unknown") for d in documents}
+        replace_sources = sources if replace_existing else ()
+        duplicates = []
+        finder = self.near_duplicate_filter(replace_sources)
+        if finder is not None:
+            chunks, duplicates = finder.split(chunks)
+            if duplicates:
+                print(f"[INFO] Skipped {len(duplicates)} near-duplicate chunks.")
+        vector_data = np.array(emb_pipe.embed_chunks(chunks)).astype('float32') if chunks else None
 
-        embeddings = emb_pipe.embed_chunks(chunks)
-        vector_data = np.array(embeddings).astype('float32')
-        self.index.add(vector_data)
-        
-        new_metadatas = [{"text": c.page_content, "source": c.metadata.get("source", "unknown")} for c in chunks]
-        self.metadata.extend(new_metadatas)
-        
-        self.save()
+        self.add_embedded(chunks, vector_data, emb_pipe.model_name, replace_sources, duplicates)
 
-    def save(self):
+    def near_duplicate_filter(self, replace_sources=()) -> NearDuplicateFilter:
+        """
+        A filter that splits new chunks into unique ones and near-duplicates of chunks
+        already indexed (or seen earlier by the filter), to run before embedding. Chunks
+        of `replace_sources` are about to be dropped, so nothing links to them.
+        None when dedup is off.
+        """
+        if not self.dedup:
+            return None
+        self.ensure_index_loaded()
+        exclude = list(replace_sources)
+        return NearDuplicateFilter(lambda signatures: self.chunks.find_near_duplicates(signatures, exclude))
+
+    def add_embedded(self, chunks: List[Any], vector_data: np.ndarray, model_name: str, replace_sources=(), duplicates=()):
+        """
+        Indexes already embedded chunks, first dropping any vectors of `replace_sources`.
+        `model_name` is the model `vector_data` was embedded with; if a model swap landed
+        since, the chunks are embedded again with the store's current model.
+        `duplicates` (from near_duplicate_filter) are stored linked to the chunk they
+        repeat, without a vector of their own.
+        """
+        self.ensure_index_loaded()
+        self._check_writable()
+        with self.lock:
+            if chunks and model_name != self.embedding_model:
+                print(f"[INFO] Index switched to {self.embedding_model} while {len(chunks)} chunks were "
+                      f"embedded with {model_name}; embedding them again.")
+                vector_data = np.asarray(self.embedding_pipeline().embed_chunks(chunks), dtype='float32')
+            stale_ids = self.chunks.ids_for_sources(replace_sources)
+            self.chunks.delete_duplicates(replace_sources)
+            if not chunks and not stale_ids and not duplicates: return
+            if not chunks:
+                vector_data = np.empty((0, self.index.d), dtype='float32')
+
+            promoted_ids, promoted_vectors = self._promote_duplicates(stale_ids)
+            new_ids = self.chunks.allocate_ids(len(chunks))
+            new_metadatas = [chunk_row(c) for c in chunks]
+            self.chunks.delete_ids(stale_ids)
+            self.chunks.add_chunks(new_ids, new_metadatas, vector_data)
+            unlinked_ids, unlinked_vectors = self._link_duplicates(duplicates)
+
+            self._apply_changes(new_ids + promoted_ids + unlinked_ids,
+                                np.vstack([vector_data, promoted_vectors, unlinked_vectors]), stale_ids)
+
+    def _link_duplicates(self, duplicates: List[Any]):
+        """
+        Stores duplicates linked to the chunk with their `duplicate_of` signature. One whose
+        original is gone by now (e.g. its file failed halfway) is embedded and indexed after
+        all; returns the (ids, vectors) of those.
+        """
+        empty = ([], np.empty((0, self.index.d), dtype='float32'))
+        if not duplicates:
+            return empty
+        targets = self.chunks.ids_for_minhashes([d.metadata["duplicate_of"] for d in duplicates])
+        linked = [d for d in duplicates if d.metadata["duplicate_of"] in targets]
+        self.chunks.add_duplicates([targets[d.metadata["duplicate_of"]] for d in linked],
+                                   [chunk_row(d) for d in linked])
+        orphans = [d for d in duplicates if d.metadata["duplicate_of"] not in targets]
+        if not orphans:
+            return empty
+        vectors = np.asarray(self.embedding_pipeline().embed_chunks(orphans), dtype='float32')
+        ids = self.chunks.allocate_ids(len(orphans))
+        self.chunks.add_chunks(ids, [chunk_row(d) for d in orphans], vectors)
+        return ids, vectors
+
+    def _promote_duplicates(self, stale_ids: List[int]):
+        """
+        Before chunks are dropped, the first duplicate linked to each one takes its place
+        (reusing its vector, which is within the near-duplicate threshold) and the other
+        duplicates are re-linked to it. Returns the (ids, vectors) to index.
+        """
+        linked = self.chunks.duplicates_of(stale_ids)
+        if not linked:
+            return [], np.empty((0, self.index.d), dtype='float32')
+        old_ids, vectors = self.chunks.get_vectors(list(linked))
+        if vectors is None:
+            return [], np.empty((0, self.index.d), dtype='float32')
+        new_ids = self.chunks.allocate_ids(len(old_ids))
+        for old_id, new_id, vector in zip(old_ids, new_ids, vectors):
+            first, *rest = linked[int(old_id)]
+            self.chunks.add_chunks([new_id], [first], vector[None, :])
+            self.chunks.add_duplicates([new_id] * len(rest), rest)
+        self.chunks.delete_duplicate_ids([row["id"] for rows in linked.values() for row in rows])
+        return new_ids, vectors
+
+    def remove_source(self, source: str) -> int:
+        """Drops every vector indexed for `source`. Returns how many were removed."""
+        self.ensure_index_loaded()
+        self._check_writable()
+        with self.lock:
+            self.chunks.delete_duplicates([source])
+            stale_ids = self.chunks.ids_for_sources([source])
+            if not stale_ids:
+                return 0
+            promoted_ids, promoted_vectors = self._promote_duplicates(stale_ids)
+            self.chunks.delete_ids(stale_ids)
+            self._apply_changes(promoted_ids, promoted_vectors, stale_ids)
+        print(f"[INFO] Removed {len(stale_ids)} vectors for {source}.")
+        return len(stale_ids)
+
+    def duplicate_count(self) -> int:
+        """Chunks stored as links to a near-duplicate instead of with a vector of their own."""
+        self.ensure_index_loaded()
+        return self.chunks.duplicate_count()
+
+    def migrate_model(self, model_name: str, background: bool = False):
+        """
+        Re-embeds every chunk with `model_name` into a new index next to this one and then
+        swaps it in. Chunk text comes from the chunk store, so no file is parsed or split
+        again, and the current index keeps serving queries until the swap.
+        With background=True the job runs in a daemon thread, which is returned;
+        otherwise returns whether the store switched models. Only one migration per index
+        runs at a time; another one is refused (background=True then returns None).
+        """
+        self._check_writable()
+        if background:
+            if migration_running(self.persist_dir):
+                print(f"[ERROR] A model migration is already running for {self.persist_dir}.")
+                return None
+            thread = threading.Thread(target=self.migrate_model, args=(model_name,), daemon=True)
+            thread.start()
+            return thread
+
+        self.ensure_index_loaded()
+        if model_name == self.embedding_model:
+            print(f"[INFO] Index already uses {model_name}.")
+            return False
+        claim = MigrationLock(self.persist_dir)
+        if not claim.acquire():
+            print(f"[ERROR] A model migration is already running for {self.persist_dir}.")
+            return False
+        try:
+            self.migration = {"model": model_name, "state": "running", "done": 0, "total": self.count()}
+            try:
+                self.swap_in(self.build_reembedded(model_name, self.migration))
+            except Exception as e:
+                print(f"[ERROR] Migration to {model_name} failed, keeping {self.embedding_model}: {e}")
+                shutil.rmtree(self.persist_dir + NEXT_SUFFIX, ignore_errors=True)
+                self.migration.update(state="failed", error=str(e))
+                return False
+            self.migration["state"] = "done"
+            return True
+        finally:
+            claim.release()
+
+    def build_reembedded(self, model_name: str, progress: dict = None) -> "FaissVectorStore":
+        """
+        Builds <persist_dir>.next: the same chunks under the same ids and index settings,
+        embedded with `model_name`. Doesn't block writes or queries on this store.
+        """
+        self.ensure_index_loaded()
+        next_dir = self.persist_dir + NEXT_SUFFIX
+        shutil.rmtree(next_dir, ignore_errors=True)
+        new = FaissVectorStore(next_dir, embedding_model=model_name, max_segments=self.max_segments,
+                               index_type=self.index_type, promote_threshold=self.promote_threshold,
+                               nprobe=self.nprobe, ef_search=self.ef_search, compression=self.compression,
+                               rescore=self.rescore, rescore_factor=self.rescore_factor, mmap=False,
+                               max_delta=self.max_delta, embed_processes=self.embed_processes,
+                               coarse_dim=self.coarse_dim, coarse_method=self.coarse_method,
+                               coarse_factor=self.coarse_factor, coarse_min_points=self.coarse_min_points,
+                               dedup=self.dedup)
+        new.cache = self.cache
+        new._save_config()
+        self._catch_up(new, progress)
+        return new
+
+    def _catch_up(self, new: "FaissVectorStore", progress: dict = None):
+        """Brings a re-embedded copy in line with this store's current chunks."""
+        live = self.chunks.get_ids()
+        built = set(new.chunks.get_ids())
+        missing = [i for i in live if i not in built]
+        live = set(live)
+        stale = [i for i in built if i not in live]
+        if stale:
+            new.chunks.delete_ids(stale)
+            new._apply_changes([], np.empty((0, new.index.d), dtype='float32'), stale)
+
+        emb_pipe = new.embedding_pipeline()
+        with new.deferred_merge():
+            for start in range(0, len(missing), REEMBED_BATCH):
+                rows = self.chunks.get_chunks(missing[start:start + REEMBED_BATCH])
+                # Chunks removed meanwhile are simply gone from the result
+                ids = sorted(rows)
+                if not ids:
+                    continue
+                chunks = [Document(page_content=rows[i]["text"], metadata={"source": rows[i]["source"]}) for i in ids]
+                vectors = np.asarray(emb_pipe.embed_chunks(chunks), dtype='float32')
+                new.chunks.add_chunks(ids, [rows[i] for i in ids], vectors)
+                new._apply_changes(ids, vectors, [])
+                if progress is not None:
+                    progress["done"] = progress.get("done", 0) + len(ids)
+        new.chunks.set_next_id(self.chunks.next_id())
+        new.chunks.set_duplicates(self.chunks.get_duplicates())
+
+    def swap_in(self, new: "FaissVectorStore"):
+        """
+        Replaces this store's index with one from build_reembedded(). Changes made since
+        the build are replayed first; the final catch-up and the swap hold the store lock,
+        so each query runs entirely against the old model or entirely against the new one.
+        """
+        self.ensure_index_loaded()
+        # Most of the catch-up happens before blocking anyone
+        self._catch_up(new)
+        with self.lock:
+            self.prepare_swap(new)
+            self.commit_swap(new)
+
+    def prepare_swap(self, new: "FaissVectorStore"):
+        """
+        First half of swap_in(): the final catch-up, and `new` saved to disk. Until the
+        store lock is released, commit_swap(new) can't miss a change.
+        """
+        with self.lock:
+            self._catch_up(new)
+            new.save()
+
+    def commit_swap(self, new: "FaissVectorStore"):
+        """Second half of swap_in(): moves a prepared index into place and switches to it."""
+        with self.lock:
+            next_dir, old_dir = new.persist_dir, self.persist_dir + OLD_SUFFIX
+            # Release the (memory-mapped) old index before its directory moves
+            self.index = new.index
+            os.replace(self.persist_dir, old_dir)
+            os.replace(next_dir, self.persist_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+            self.chunks = ChunkStore(self.persist_dir)
+            self.read_only = False
+            self._reset_delta()
+            self.tombstones = set(new.tombstones)
+            self.segments = []
+            self.merged_seq = new.merged_seq
+            self.coarse = None
+            self.embedding_model = new.embedding_model
+            # Cached query vectors belong to the old model
+            self.query_cache.clear()
+        print(f"[INFO] Switched index to {self.embedding_model}.")
+
+    def _apply_changes(self, ids: List[int], vectors: np.ndarray, removed_ids: List[int]):
+        """Applies an add/remove delta (already reflected in the chunk store) and persists it."""
+        ids = np.array(ids, dtype='int64')
+        removed_ids = np.array(removed_ids, dtype='int64')
+        self._apply_delta(ids, vectors, removed_ids)
+        self.append_segment(ids, vectors, removed_ids)
+        self._maybe_promote()
+
+    def _maybe_promote(self):
+        """
+        Rebuilds the index once it grows enough to leave flat (promote_threshold), to
+        train the project's compression codec, or for a PQ codec to use more bits per code
+        (see pq_nbits_for). Never downgrades when vectors are removed.
+        """
+        n = self.count()
+        kind = index_kind(self.index)
+        compression = index_compression(self.index)
+
+        promote = (kind == "flat" and self.index_type != "flat"
+                   and self.promote_threshold and n >= self.promote_threshold)
+        compress = compression is None and self.compression and n >= MIN_TRAIN_POINTS
+        # PQ trained on the first MIN_TRAIN_POINTS vectors gets 4-bit codes; it is retrained
+        # each time the corpus reaches the next bit width (about every doubling, up to 8)
+        retrain = compression == "pq" and pq_nbits(self.index) < pq_nbits_for(n)
+        if promote or compress or retrain:
+            self._rebuild(self.index_type if promote else kind)
+
+    def rebuild_index(self, index_type: str):
+        """Re-creates the index as `index_type` from the stored full-precision vectors."""
+        self.ensure_index_loaded()
+        self._check_writable()
+        with self.lock:
+            self._rebuild(index_type)
+
+    def set_compression(self, compression: str, rescore: bool = True):
+        """Chooses this project's vector codec (None, "sq8" or "pq") and rebuilds the index."""
+        self.ensure_index_loaded()
+        self._check_writable()
+        with self.lock:
+            self.compression = compression
+            self.rescore = rescore
+            self._save_config()
+            self._rebuild(index_kind(self.index))
+
+    def _rebuild(self, index_type: str):
+        ids, vectors = self.chunks.get_vectors()
+        # Compressed codecs are only trained once there is enough data for them
+        compression = self.compression if len(ids) >= MIN_TRAIN_POINTS else None
+        print(f"[INFO] Building {index_type} index ({compression or 'uncompressed'}) over {len(ids)} vectors...")
+        if vectors is None:
+            index = faiss.IndexIDMap2(make_index("flat", self.index.d))
+        else:
+            index = faiss.IndexIDMap2(make_index(index_type, vectors.shape[1], train_vectors=vectors, compression=compression))
+            index.add_with_ids(vectors, ids)
+        set_search_params(index, nprobe=self.nprobe, ef_search=self.ef_search)
+        # The chunk store holds the post-change state, so the delta is folded in already
+        self.index = index
+        self.read_only = False
+        self._reset_delta()
+        # Dropped with the old base; the PCA is retrained on the rebuilt data on next use
+        self.coarse = None
+        self._write_base()
+
+    def set_search_params(self, nprobe: int = None, ef_search: int = None):
+        """Changes the IVF nprobe / HNSW efSearch used by subsequent queries."""
+        if nprobe: self.nprobe = nprobe
+        if ef_search: self.ef_search = ef_search
+        if self.index is not None:
+            set_search_params(self.index, nprobe=self.nprobe, ef_search=self.ef_search)
+
+    def set_coarse_search(self, coarse_dim: int = None, method: str = "pca", factor: int = None,
+                          min_points: int = None):
+        """Turns coarse-to-fine search on (coarse_dim) or off (None) for subsequent queries."""
+        with self.lock:
+            self.coarse_dim = coarse_dim
+            self.coarse_method = method
+            if factor: self.coarse_factor = factor
+            if min_points is not None: self.coarse_min_points = min_points
+            self.coarse = None
+
+    def evaluate_recall(self, queries: List[str] = None, top_k: int = 10, sample_size: int = 100) -> dict:
+        """
+        Measures recall@k of the current index against an exact flat search over the
+        stored vectors. Without queries, a sample of indexed vectors is used as queries.
+        """
+        self.ensure_index_loaded()
+        ids, vectors = self.chunks.get_vectors()
+        if vectors is None:
+            return {"index_type": index_kind(self.index), "recall": 1.0, "queries": 0, "top_k": top_k}
+
+        if queries:
+            query_vecs = self.model.encode(queries).astype('float32')
+        else:
+            rng = np.random.default_rng(0)
+            picks = rng.choice(len(vectors), size=min(sample_size, len(vectors)), replace=False)
+            query_vecs = vectors[picks]
+
+        exact = faiss.IndexIDMap(make_index("flat", vectors.shape[1]))
+        exact.add_with_ids(vectors, ids)
+        _, truth = exact.search(query_vecs, top_k)
+        _, approx = self._search(query_vecs, top_k)
+
+        found = 0
+        total = 0
+        for t_row, a_row in zip(truth, approx):
+            expected = set(int(i) for i in t_row if i >= 0)
+            found += len(expected & set(int(i) for i in a_row if i >= 0))
+            total += len(expected)
+        recall = found / total if total else 1.0
+        return {"index_type": index_kind(self.index), "recall": recall, "queries": len(query_vecs), "top_k": top_k}
+
+    def memory_report(self) -> dict:
+        """
+        Index size against what the same vectors would take as a flat float32 index.
+        `saved_bytes` is what the codec saves in the index (memory and faiss.index). The
+        chunk store keeps every full-precision vector regardless, for rebuilds, rescoring
+        and exact filtered search, so on disk the codec's index comes on top of
+        `stored_vector_bytes`; `disk_bytes` is the two together. `resident_bytes` is the
+        part of the index held in memory: all of it unless the index is memory-mapped,
+        which only maps vector codes and IVF lists (see mapped_nbytes), so an HNSW graph
+        stays resident.
+        """
+        self.ensure_index_loaded()
+        n = self.index.ntotal
+        index_bytes = index_nbytes(self.index)
+        resident_bytes = index_bytes - mapped_nbytes(self.index) if self.read_only else index_bytes
+        flat_bytes = n * self.index.d * 4
+        stored_vector_bytes = self.chunks.vector_bytes()
+        return {
+            "compression": index_compression(self.index),
+            "vectors": n,
+            "index_bytes": index_bytes,
+            "flat_bytes": flat_bytes,
+            "saved_bytes": flat_bytes - index_bytes,
+            "bytes_per_vector": index_bytes / n if n else 0.0,
+            "resident_bytes": resident_bytes,
+            "stored_vector_bytes": stored_vector_bytes,
+            "disk_bytes": index_bytes + stored_vector_bytes,
+        }
+
+    def compression_report(self, top_k: int = 10, sample_size: int = 100) -> dict:
+        """Memory saved by the codec and the recall@k it costs (after rescoring, if enabled)."""
+        report = self.memory_report()
+        report.update(self.evaluate_recall(top_k=top_k, sample_size=sample_size))
+        report["rescore"] = self.rescore
+        return report
+
+    def append_segment(self, ids: np.ndarray, vectors: np.ndarray, removed_ids: np.ndarray):
+        """Persists only the delta; merges once enough segments or vectors pile up."""
         if not os.path.exists(self.persist_dir):
             os.makedirs(self.persist_dir)
-        faiss.write_index(self.index, self.faiss_path)
-        with open(self.meta_path, "wb") as f:
-            pickle.dump(self.metadata, f)
 
-    def query(self, query_text: str, top_k: int = 5):
+        with self.lock:
+            seq = (self.segments[-1] if self.segments else self.merged_seq) + 1
+            seg_path = self._segment_path(seq)
+            tmp_path = seg_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                np.savez(f, ids=ids, vectors=vectors, removed=removed_ids)
+            os.replace(tmp_path, seg_path)
+            self.segments.append(seq)
+
+            segments_full = len(self.segments) >= self.max_segments and not self.defer_merge
+            if segments_full or self.delta.ntotal >= self.max_delta:
+                self.save()
+
+    @contextmanager
+    def deferred_merge(self):
+        """
+        Holds off segment-count merges while many small batches are added (see ingest.py),
+        so the base index isn't rewritten every few batches. max_delta still bounds the
+        in-memory delta; pending segments are merged on exit if there are enough of them.
+        """
         self.ensure_index_loaded()
-        if not self.index or self.index.ntotal == 0:
-            return []
-            
-        query_emb = self.model.encode([query_text]).astype('float32')
-        D, I = self.index.search(query_emb, top_k)
-        
-        results = []
-        for idx, dist in zip(I[0], D[0]):
-            if idx < len(self.metadata) and idx >= 0:
-                results.append({"metadata": self.metadata[idx], "distance": float(dist)})
-        return results
\ No newline at end of file
+        self._check_writable()
+        self.defer_merge = True
+        try:
+            yield self
+        finally:
+            self.defer_merge = False
+            with self.lock:
+                if len(self.segments) >= self.max_segments:
+                    self.save()
+
+    def save(self):
+        """Merges the delta and removals into the base index and writes it out."""
+        self.ensure_index_loaded()
+        self._check_writable()
+        # Searches hold the lock too, so none sees the delta both merged and still pending
+        with self.lock:
+            keep_tombstones = set()
+            if self.tombstones and not supports_remove(self.index):
+                # HNSW and IVF can't drop vectors in place (see supports_remove). Their removed
+                # ids stay in the base and searches skip them, until enough pile up to
+                # rebuild from the chunk store.
+                if len(self.tombstones) > MAX_TOMBSTONE_FRACTION * self.index.ntotal:
+                    self._rebuild(index_kind(self.index))
+                    return
+                keep_tombstones = self.tombstones
+
+            if self.read_only:
+                # A memory-mapped index is read-only, so the merge works on a full in-memory copy
+                base = faiss.read_index(self.faiss_path)
+                set_search_params(base, nprobe=self.nprobe, ef_search=self.ef_search)
+            else:
+                base = self.index
+            if self.tombstones and not keep_tombstones:
+                base.remove_ids(np.array(sorted(self.tombstones), dtype='int64'))
+            if self.delta.ntotal:
+                delta_ids = faiss.vector_to_array(self.delta.id_map)
+                base.add_with_ids(self.delta.index.reconstruct_n(0, self.delta.ntotal), delta_ids)
+
+            self.index = base
+            self.read_only = False
+            self._reset_delta()
+            self.tombstones = keep_tombstones
+            self._write_base()
+
+    def _write_base(self):
+        """Writes the base index, then drops the segments it now contains."""
+        if not os.path.exists(self.persist_dir):
+            os.makedirs(self.persist_dir)
+        # Every write takes a fresh seq, so a pending base is never mistaken for an older one
+        merged_seq = max(self.segments[-1] if self.segments else 0, self.merged_seq) + 1
+        pending = self._pending_base_path(merged_seq)
+        faiss.write_index(self.index, pending)
+        with open(self.base_state_path + ".tmp", 'w') as f:
+            json.dump({"merged_seq": merged_seq, "tombstones": sorted(self.tombstones)}, f)
+        os.replace(self.base_state_path + ".tmp", self.base_state_path)
+        try:
+            os.replace(pending, self.faiss_path)
+        except FileNotFoundError:
+            # A store opened on this directory after the commit point renamed it already
+            if not os.path.exists(self.faiss_path):
+                raise
+        self.merged_seq = merged_seq
+        # The live vectors are unchanged by a merge, so a loaded coarse index stays valid
+        # and is saved against the new seq; a saved one not loaded now can't catch up
+        self._save_coarse(merged_seq)
+
+        for seq in self.segments:
+            _discard(self._segment_path(seq))
+        self.segments = []
+
+    def _search_vectors(self, query_embs: np.ndarray, top_k: int, sources: List[str]) -> List[List[dict]]:
+        allowed_ids = None
+        if sources is not None:
+            # A selected source's duplicates are found through the chunk they're linked to
+            allowed_ids = sorted(set(self.chunks.ids_for_sources(sources)) | set(self.chunks.duplicate_targets(sources)))
+        if self.count() == 0 or allowed_ids == []:
+            return [[] for _ in query_embs]
+
+        D, I = self._search(query_embs, top_k, allowed_ids=allowed_ids)
+
+        # Only the rows for the returned ids are read from disk, once for all queries
+        hits = self.chunks.get_chunks({int(idx) for idx in I.ravel() if idx >= 0})
+        self._attach_duplicates(hits, sources)
+        batch_results = []
+        for ids, dists in zip(I, D):
+            results = []
+            for idx, dist in zip(ids, dists):
+                if int(idx) in hits:
+                    results.append({"metadata": hits[int(idx)], "distance": float(dist)})
+            batch_results.append(results)
+        return batch_results
+
+    def _attach_duplicates(self, hits: dict, sources: List[str] = None):
+        """
+        Adds `duplicate_sources` to hits that near-duplicates are linked to. With a source
+        filter, a hit from an unselected source is shown as its duplicate in a selected one.
+        """
+        for hit_id, rows in self.chunks.duplicates_of(list(hits)).items():
+            hit = hits[hit_id]
+            if sources is not None and hit["source"] not in sources:
+                row = next(r for r in rows if r["source"] in sources)
+                rows = [r for r in rows if r is not row] + [dict(hit)]
+                hit.clear()
+                hit.update((k, v) for k, v in row.items() if k not in ("id", "of_id", "minhash"))
+            hit["duplicate_sources"] = sorted({r["source"] for r in rows} - {hit["source"]})
+
+    def _search(self, query_vecs: np.ndarray, top_k: int, allowed_ids: List[int] = None):
+        """
+        Searches the base index (skipping removed ids) and the unmerged delta, and merges
+        the two result lists. Compressed bases optionally re-rank a larger shortlist exactly.
+        `allowed_ids` restricts the search to those (live) ids.
+        """
+        if allowed_ids is not None and len(allowed_ids) <= FILTER_BRUTE_FORCE_MAX:
+            return self._search_subset(query_vecs, top_k, allowed_ids)
+        # Small projects are cheap to scan in full; the coarse pass pays off on large ones
+        if self.coarse_dim and self.count() >= self.coarse_min_points:
+            return self._search_coarse(query_vecs, top_k, allowed_ids)
+
+        rescore = self.rescore and index_compression(self.index) is not None
+        fetch_k = top_k * self.rescore_factor if rescore else top_k
+
+        params = None
+        delta_params = None
+        if allowed_ids is not None:
+            # The chunk store only holds live ids, so tombstones are excluded already
+            allowed = np.array(allowed_ids, dtype='int64')
+            sel = faiss.IDSelectorBatch(allowed)
+            params = search_params(self.index, sel=sel, nprobe=self.nprobe, ef_search=self.ef_search)
+            delta_params = faiss.SearchParameters(sel=sel)
+        elif self.tombstones:
+            removed = faiss.IDSelectorBatch(np.array(sorted(self.tombstones), dtype='int64'))
+            keep = faiss.IDSelectorNot(removed)
+            params = search_params(self.index, sel=keep, nprobe=self.nprobe, ef_search=self.ef_search)
+        D, I = self.index.search(query_vecs, fetch_k, params=params)
+        if rescore:
+            D, I = self._rescore(query_vecs, I, top_k)
+
+        if self.delta.ntotal:
+            D_delta, I_delta = self.delta.search(query_vecs, top_k, params=delta_params)
+            D, I = np.hstack([D, D_delta]), np.hstack([I, I_delta])
+            # Empty slots (-1) come back with +inf/max distances, so they sort last
+            order = np.argsort(D, axis=1, kind="stable")[:, :top_k]
+            D, I = np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+        return D, I
+
+    def _search_subset(self, query_vecs: np.ndarray, top_k: int, ids: List[int]):
+        """
+        Exact search over a small set of ids using their stored vectors. Used for narrow
+        source filters, where an ANN index would visit mostly filtered-out neighbours.
+        """
+        D = np.full((len(query_vecs), top_k), np.inf, dtype='float32')
+        I = np.full((len(query_vecs), top_k), -1, dtype='int64')
+        ids, vectors = self.chunks.get_vectors(ids)
+        if vectors is None:
+            return D, I
+        subset = make_index("flat", vectors.shape[1])
+        subset.add(vectors)
+        D_sub, P = subset.search(query_vecs, min(top_k, len(ids)))
+        D[:, :P.shape[1]] = D_sub
+        I[:, :P.shape[1]] = np.where(P >= 0, ids[np.maximum(P, 0)], -1)
+        return D, I
+
+    def _search_coarse(self, query_vecs: np.ndarray, top_k: int, allowed_ids: List[int] = None):
+        """
+        Coarse-to-fine search: shortlists top_k * coarse_factor ids in the low-dimensional
+        coarse index, then re-ranks them by exact distance on the full vectors. The coarse
+        index only holds live vectors, so tombstones and the delta need no special handling.
+        """
+        if self.coarse is None:
+            ids, vectors = self.chunks.get_vectors()
+            print(f"[INFO] Building {self.coarse_dim}-d coarse index ({self.coarse_method}) over {len(ids)} vectors...")
+            coarse = CoarseIndex(self.index.d, self.coarse_dim, self.coarse_method)
+            coarse.build(ids, vectors)
+            self.coarse = coarse
+            self._save_coarse(self.segments[-1] if self.segments else self.merged_seq)
+        sel = None
+        if allowed_ids is not None:
+            sel = faiss.IDSelectorBatch(np.array(allowed_ids, dtype='int64'))
+        _, candidates = self.coarse.search(query_vecs, top_k * self.coarse_factor, sel=sel)
+        return self._rescore(query_vecs, candidates, top_k)
+
+    def _rescore(self, query_vecs: np.ndarray, candidates: np.ndarray, top_k: int):
+        """Re-ranks candidate ids by exact L2 distance to their stored full-precision vectors."""
+        D = np.full((len(query_vecs), top_k), np.inf, dtype='float32')
+        I = np.full((len(query_vecs), top_k), -1, dtype='int64')
+        # One read for the candidates of all queries
+        ids, vectors = self.chunks.get_vectors(np.unique(candidates[candidates >= 0]))
+        if vectors is None:
+            return D, I
+        position = {int(i): p for p, i in enumerate(ids)}
+        for row, (q, cand) in enumerate(zip(query_vecs, candidates)):
+            rows = [position[int(c)] for c in cand if int(c) in position]
+            if not rows:
+                continue
+            dists = ((vectors[rows] - q) ** 2).sum(axis=1)
+            order = np.argsort(dists)[:top_k]
+            D[row, :len(order)] = dists[order]
+            I[row, :len(order)] = ids[rows][order]
+        return D, I
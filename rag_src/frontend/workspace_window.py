@@ -35,12 +35,13 @@ class SyncWorker(QThread):
 
 class RAGWorker(QThread):
     response_received = pyqtSignal(str) 
-    def __init__(self, query, pipeline):
+    def __init__(self, query, pipeline, sources=None):
         super().__init__()
         self.query = query
         self.pipeline = pipeline
+        self.sources = sources
     def run(self):
-        response = self.pipeline.answer_query(self.query)
+        response = self.pipeline.answer_query(self.query, sources=self.sources)
         self.response_received.emit(response)
 
 class FastInitWorker(QThread):
@@ -152,6 +153,8 @@ class WorkspaceWindow(QMainWindow):
 
         # List
         self.source_list = QListWidget()
+        # Selecting sources limits chat answers to them; no selection searches everything
+        self.source_list.setSelectionMode(QListWidget.SelectionMode.ExtendedSelection)
         self.source_list.setContextMenuPolicy(Qt.ContextMenuPolicy.CustomContextMenu)
         self.source_list.customContextMenuRequested.connect(self.show_source_context_menu)
         left_layout.addWidget(self.source_list)
@@ -324,7 +327,8 @@ class WorkspaceWindow(QMainWindow):
         self.scroll_to_bottom()
         
         self.chat_input.setDisabled(True)
-        self.worker = RAGWorker(msg, self.rag)
+        selected = [item.data(Qt.ItemDataRole.UserRole) for item in self.source_list.selectedItems()]
+        self.worker = RAGWorker(msg, self.rag, sources=selected or None)
         self.worker.response_received.connect(self.handle_ai_response)
         self.worker.start()
 
@@ -355,7 +359,9 @@ class WorkspaceWindow(QMainWindow):
         if action and action.text() == "Delete":
             if QMessageBox.question(self, "Delete", f"Remove {filename}?") == QMessageBox.StandardButton.Yes:
                 self.backend.delete_source_file(filename)
-                self.refresh_sources_list()
+                # Sync drops the vectors of deleted files, on the worker thread instead of the UI
+                if self.rag: self.trigger_resync()
+                else: self.refresh_sources_list()
 
     def go_back(self):
         from frontend.main_window import MainWindow